@@ -0,0 +1,221 @@
+# Admission control in front of the handlers (and so the database pool).
+#
+#   app.add_middleware(AdmissionMiddleware, slo=0.25)
+#
+# Requests are grouped into route classes (by default "read" for GET/HEAD and
+# "write" for the rest). Each class has a concurrency limit that adapts to
+# latency (AIMD): it grows by ~1 per limit's worth of requests answered within
+# the SLO and is cut by `backoff` when latency goes over it. Requests over the
+# limit wait in a bounded FIFO queue. A request is shed with 503 + Retry-After
+# when the queue is full, when its expected wait is already over the SLO, or
+# when it has waited past its deadline, so overload turns into fast failures
+# instead of unbounded latency.
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, Optional
+
+from metrics import MetricsRegistry, registry
+
+ADMISSION_SLO_MS = float(os.getenv("ADMISSION_SLO_MS", "250"))
+
+EXEMPT_PATHS = ("/metrics", "/docs", "/redoc", "/openapi.json")
+
+
+def default_classifier(scope) -> Optional[str]:
+    """Route class for a request, None to bypass admission control."""
+    if scope["path"].startswith(EXEMPT_PATHS):
+        return None
+    return "read" if scope["method"] in ("GET", "HEAD") else "write"
+
+
+class Shed(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdaptiveLimiter:
+    """Concurrency limit with a bounded wait queue; event loop only, no locks."""
+
+    def __init__(
+        self,
+        initial_limit: int = 10,
+        min_limit: int = 1,
+        max_limit: int = 200,
+        slo: float = ADMISSION_SLO_MS / 1000,
+        queue_size: int = 100,
+        backoff: float = 0.9,
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.slo = slo
+        self.queue_size = queue_size
+        self.backoff = backoff
+        self.in_flight = 0
+        # Smoothed service time, used to estimate how long a new waiter would queue
+        self.latency = slo / 2
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def expected_wait(self, position: int) -> float:
+        return position * self.latency / max(self.limit, 1.0)
+
+    async def acquire(self) -> None:
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        if len(self._waiters) >= self.queue_size:
+            raise Shed("queue_full", self.expected_wait(len(self._waiters)))
+        wait = self.expected_wait(len(self._waiters) + 1)
+        if wait > self.slo:
+            raise Shed("slo", wait)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # The deadline: a request still queued after one SLO would miss it anyway
+            await asyncio.wait_for(waiter, self.slo)
+        except asyncio.TimeoutError:
+            if _owns_slot(waiter):
+                return
+            self._discard(waiter)
+            raise Shed("deadline", self.expected_wait(len(self._waiters))) from None
+        except asyncio.CancelledError:
+            # Client went away while queued; hand back a slot we may have just been given
+            if _owns_slot(waiter):
+                self.in_flight -= 1
+                self._wake()
+            else:
+                self._discard(waiter)
+            raise
+
+    def _discard(self, waiter: asyncio.Future) -> None:
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self, latency: Optional[float]) -> None:
+        self.in_flight -= 1
+        if latency is not None:
+            self.latency += (latency - self.latency) * 0.1
+            if latency <= self.slo:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            else:
+                now = time.monotonic()
+                # At most one decrease per SLO period, or a burst of slow requests
+                # that were all admitted together would collapse the limit
+                if now - self._last_decrease > self.slo:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._last_decrease = now
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # The slot is handed over directly, so a new arrival can't jump the queue
+                self.in_flight += 1
+                waiter.set_result(None)
+
+
+def _owns_slot(waiter: asyncio.Future) -> bool:
+    return waiter.done() and not waiter.cancelled()
+
+
+class AdmissionMiddleware:
+    """Pure ASGI; sheds with 503 before the request reaches the threadpool or the pool."""
+
+    def __init__(
+        self,
+        app,
+        classifier: Callable[[dict], Optional[str]] = default_classifier,
+        classes: Iterable[str] = ("read", "write"),
+        registry: MetricsRegistry = registry,
+        **limiter_options,
+    ):
+        self.app = app
+        self.classifier = classifier
+        self.limiter_options = limiter_options
+        self.limiters: Dict[str, AdaptiveLimiter] = {}
+
+        self.shed = registry.counter(
+            "admission_shed_total", "Requests rejected with 503 by admission control", ("class", "reason")
+        )
+        self.admitted = registry.counter("admission_admitted_total", "Requests admitted", ("class",))
+        self.queue_wait = registry.histogram(
+            "admission_queue_wait_seconds", "Time admitted requests spent queued", ("class",)
+        )
+        self._limit_gauge = registry.gauge("admission_limit", "Current adaptive concurrency limit", ("class",))
+        self._in_flight_gauge = registry.gauge("admission_in_flight", "Requests currently admitted", ("class",))
+        self._queued_gauge = registry.gauge("admission_queued", "Requests waiting for admission", ("class",))
+        for name in classes:
+            self._limiter(name)
+
+    def _limiter(self, name: str) -> AdaptiveLimiter:
+        limiter = self.limiters.get(name)
+        if limiter is None:
+            limiter = self.limiters[name] = AdaptiveLimiter(**self.limiter_options)
+            self._limit_gauge.set_function(lambda: limiter.limit, name)
+            self._in_flight_gauge.set_function(lambda: limiter.in_flight, name)
+            self._queued_gauge.set_function(lambda: limiter.queued, name)
+        return limiter
+
+    async def __call__(self, scope, receive, send):
+        route_class = self.classifier(scope) if scope["type"] == "http" else None
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        limiter = self._limiter(route_class)
+        start = time.perf_counter()
+        try:
+            await limiter.acquire()
+        except Shed as shed:
+            self.shed.inc(route_class, shed.reason)
+            await _reject(send, shed.retry_after)
+            return
+
+        admitted = time.perf_counter()
+        self.admitted.inc(route_class)
+        self.queue_wait.observe(admitted - start, route_class)
+
+        # Latency feedback is time to the response start: that's the part that
+        # waits on the database, a long streamed body shouldn't shrink the limit
+        latency: Optional[float] = None
+
+        async def send_wrapper(message):
+            nonlocal latency
+            if message["type"] == "http.response.start":
+                latency = time.perf_counter() - admitted
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            limiter.release(latency)
+
+
+_BODY = b'{"detail":"Server overloaded, retry later"}'
+
+
+async def _reject(send, retry_after: float) -> None:
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(_BODY)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": _BODY})
@@ -0,0 +1,46 @@
+"""requests, trainings and request_training as the apps first created them
+
+Revision ID: 0001
+Revises:
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases created by create_all before there were migrations already have them
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    if "requests" not in existing:
+        op.create_table(
+            "requests",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("name", sa.String, nullable=False),
+            sa.Column("description", sa.String),
+            sa.Column("group", sa.String, nullable=True),
+        )
+        op.create_index("ix_requests_id", "requests", ["id"])
+    if "trainings" not in existing:
+        op.create_table(
+            "trainings",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("title", sa.String, nullable=False),
+            sa.Column("duration", sa.Integer),
+        )
+        op.create_index("ix_trainings_id", "trainings", ["id"])
+    if "request_training" not in existing:
+        op.create_table(
+            "request_training",
+            sa.Column("request_id", sa.Integer, sa.ForeignKey("requests.id"), primary_key=True),
+            sa.Column("training_id", sa.Integer, sa.ForeignKey("trainings.id"), primary_key=True),
+        )
+
+
+def downgrade():
+    op.drop_table("request_training")
+    op.drop_table("trainings")
+    op.drop_table("requests")
@@ -0,0 +1,29 @@
+"""version column on requests and trainings (see versioning.py)
+
+Revision ID: 0002
+Revises: 0001
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+TABLES = ("requests", "trainings")
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table in TABLES:
+        if "version" in {column["name"] for column in inspector.get_columns(table)}:
+            continue
+        # The default fills every existing row, so there is nothing to backfill
+        op.add_column(table, sa.Column("version", sa.Integer, nullable=False, server_default="1"))
+
+
+def downgrade():
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch:
+            batch.drop_column("version")
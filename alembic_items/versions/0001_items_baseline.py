@@ -0,0 +1,32 @@
+"""items table as the apps first created it
+
+Revision ID: 0001
+Revises:
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if sa.inspect(op.get_bind()).has_table("items"):
+        # Created by create_all before there were migrations
+        return
+    op.create_table(
+        "items",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("name", sa.String, nullable=False),
+        sa.Column("description", sa.String),
+        sa.Column("is_active", sa.Boolean, nullable=False),
+        sa.Column("created_at", sa.TIMESTAMP, server_default=sa.func.now(), nullable=False),
+    )
+    op.create_index("ix_items_id", "items", ["id"])
+    op.create_index("ix_items_name", "items", ["name"])
+
+
+def downgrade():
+    op.drop_table("items")
@@ -0,0 +1,41 @@
+"""items ids are never reused, so archived ids stay unique (see archive.py)
+
+Revision ID: 0002
+Revises: 0001
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def _table_sql(bind) -> str:
+    return bind.execute(sa.text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'items'")).scalar()
+
+
+def upgrade():
+    bind = op.get_bind()
+    if "AUTOINCREMENT" not in _table_sql(bind).upper():
+        # SQLite can't add AUTOINCREMENT in place: copy the table. Its triggers
+        # go with the old table; the apps reinstall them on startup.
+        with op.batch_alter_table("items", recreate="always", table_kwargs={"sqlite_autoincrement": True}):
+            pass
+    # Start after every id ever used, including the ones now in the archive
+    # (an archive in an attached ARCHIVE_DB file isn't visible here)
+    used = [sa.select(sa.func.max(sa.column("id"))).select_from(sa.table("items"))]
+    if sa.inspect(bind).has_table("items_archive"):
+        used.append(sa.select(sa.func.max(sa.column("id"))).select_from(sa.table("items_archive")))
+    highest = max((bind.execute(statement).scalar() or 0) for statement in used)
+    current = bind.execute(sa.text("SELECT seq FROM sqlite_sequence WHERE name = 'items'")).scalar()
+    if current is None:
+        bind.execute(sa.text("INSERT INTO sqlite_sequence (name, seq) VALUES ('items', :seq)"), {"seq": highest})
+    elif current < highest:
+        bind.execute(sa.text("UPDATE sqlite_sequence SET seq = :seq WHERE name = 'items'"), {"seq": highest})
+
+
+def downgrade():
+    with op.batch_alter_table("items", recreate="always", table_kwargs={"sqlite_autoincrement": False}):
+        pass
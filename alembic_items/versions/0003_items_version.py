@@ -0,0 +1,30 @@
+"""version column on items (see versioning.py)
+
+Revision ID: 0003
+Revises: 0002
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def _columns(table):
+    return {column["name"] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade():
+    if "version" not in _columns("items"):
+        # The default fills every existing row, so there is nothing to backfill
+        op.add_column("items", sa.Column("version", sa.Integer, nullable=False, server_default="1"))
+    # Archive copies take every hot column (see archive.py), and a restored row needs a version
+    if sa.inspect(op.get_bind()).has_table("items_archive") and "version" not in _columns("items_archive"):
+        op.add_column("items_archive", sa.Column("version", sa.Integer, server_default="1"))
+
+
+def downgrade():
+    with op.batch_alter_table("items") as batch:
+        batch.drop_column("version")
@@ -0,0 +1,193 @@
+# Training popularity and duration analytics, computed by the database.
+#
+#   analytics = Analytics(Request, Training, request_training, versions)
+#   analytics.top_trainings(db, n=10)
+#   analytics.group_durations(db)
+#   analytics.duration_percentiles(db, (50, 90, 99))
+#
+# Every query is one statement with grouped aggregates and window functions;
+# only the final rows come back to Python. Results are cached per (query,
+# parameters) together with the table versions they were computed at (see
+# counters.TableVersions), so a cached answer costs one primary key read and
+# is dropped as soon as requests, trainings or request_training change. The
+# cache keeps the max_entries most recently used answers, since n and the
+# percentile list come from the client.
+#
+# python analytics.py seeds a database with a million request_training links
+# and times each query cold and cached.
+
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Sequence, Tuple
+
+from sqlalchemy import bindparam, case, desc, func, literal_column, select
+
+from counters import TableVersions
+
+
+class Analytics:
+    def __init__(self, Request, Training, request_training, versions: TableVersions, max_entries: int = 256):
+        self.Request = Request
+        self.Training = Training
+        self.links = request_training
+        self.versions = versions
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[Tuple, Tuple[Any, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        Training, links = self.Training, self.links
+        # Count links per training first, then join trainings only for the top N
+        per_training = (
+            select(links.c.training_id, func.count().label("requests"))
+            .group_by(links.c.training_id)
+            .subquery()
+        )
+        self._top = (
+            select(
+                Training.id,
+                Training.title,
+                per_training.c.requests,
+                func.rank().over(order_by=per_training.c.requests.desc()).label("rank"),
+            )
+            .join(per_training, per_training.c.training_id == Training.id)
+            .order_by(desc(per_training.c.requests), Training.id)
+            .limit(bindparam("n"))
+        )
+
+        total = func.coalesce(func.sum(Training.duration), 0)
+        self._groups = (
+            select(
+                Request.group,
+                func.count(func.distinct(Request.id)).label("requests"),
+                func.count().label("trainings"),
+                total.label("total_duration"),
+                # Window over the grouped sums: each group's share of all duration
+                (total * 1.0 / func.sum(total).over()).label("share"),
+            )
+            .select_from(Request)
+            .join(links, links.c.request_id == Request.id)
+            .join(Training, Training.id == links.c.training_id)
+            .group_by(Request.group)
+            .order_by(desc("total_duration"))
+        )
+
+    def _cached(self, conn, key: Tuple, compute):
+        version = self.versions.current(conn)
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit is not None and hit[0] == version:
+                self._cache.move_to_end(key)
+                return hit[1]
+        result = compute()
+        with self._lock:
+            self._cache[key] = (version, result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return result
+
+    def top_trainings(self, conn, n: int = 10):
+        return self._cached(
+            conn, ("top", n),
+            lambda: [dict(row._mapping) for row in conn.execute(self._top, {"n": n})],
+        )
+
+    def group_durations(self, conn):
+        return self._cached(
+            conn, ("groups",),
+            lambda: [dict(row._mapping) for row in conn.execute(self._groups)],
+        )
+
+    def duration_percentiles(self, conn, percentiles: Sequence[int] = (50, 90, 99)):
+        """Nearest-rank percentiles of the training load (summed duration) per request, per group."""
+        percentiles = tuple(sorted(set(int(p) for p in percentiles)))
+        statement = _percentile_statement(self.Request, self.Training, self.links, percentiles)
+        return self._cached(
+            conn, ("percentiles", percentiles),
+            lambda: [dict(row._mapping) for row in conn.execute(statement)],
+        )
+
+
+@lru_cache(maxsize=32)
+def _percentile_statement(Request, Training, links, percentiles: Tuple[int, ...]):
+    load = (
+        select(
+            Request.group.label("group"),
+            func.coalesce(func.sum(Training.duration), 0).label("load"),
+        )
+        .select_from(Request)
+        .join(links, links.c.request_id == Request.id)
+        .join(Training, Training.id == links.c.training_id)
+        .group_by(Request.id)
+        .subquery()
+    )
+    ranked = select(
+        load.c.group,
+        load.c.load,
+        func.row_number().over(partition_by=load.c.group, order_by=load.c.load).label("rn"),
+        func.count().over(partition_by=load.c.group).label("cnt"),
+    ).subquery()
+    # Nearest rank: ceil(p * cnt / 100) in integer arithmetic (no ceil() in older SQLite)
+    columns = [
+        func.max(case((ranked.c.rn == (p * ranked.c.cnt + 99) // 100, ranked.c.load))).label(f"p{p}")
+        for p in percentiles
+    ]
+    return (
+        select(ranked.c.group, func.max(ranked.c.cnt).label("requests"), *columns)
+        .group_by(ranked.c.group)
+        .order_by(literal_column("requests").desc())
+    )
+
+
+if __name__ == "__main__":
+    # Benchmark on a seeded database: 100k requests, 2k trainings, 1M links
+    import os
+    import random
+    import tempfile
+    import time
+
+    from sqlalchemy import create_engine
+
+    import model
+
+    path = os.path.join(tempfile.mkdtemp(), "analytics.db")
+    engine = create_engine(f"sqlite:///{path}")
+    model.Base.metadata.create_all(engine)
+    versions = model.versions
+
+    random.seed(1)
+    requests, trainings, links = 100_000, 2_000, 1_000_000
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "INSERT INTO trainings (id, title, duration) VALUES (?, ?, ?)",
+            [(i, f"training {i}", random.randint(1, 40)) for i in range(1, trainings + 1)],
+        )
+        conn.exec_driver_sql(
+            'INSERT INTO requests (id, name, "group") VALUES (?, ?, ?)',
+            [(i, f"request {i}", f"group {i % 12}") for i in range(1, requests + 1)],
+        )
+        pairs = set()
+        while len(pairs) < links:
+            # Skewed popularity, so the top-N is meaningful
+            pairs.add((random.randint(1, requests), int(random.paretovariate(1.2)) % trainings + 1))
+        conn.exec_driver_sql("INSERT INTO request_training (request_id, training_id) VALUES (?, ?)", list(pairs))
+        versions.install(conn)
+    print(f"seeded {links} links in {time.perf_counter() - start:.1f} s")
+
+    analytics = Analytics(model.Request, model.Training, model.request_training, versions)
+    with engine.connect() as conn:
+        for name, run in [
+            ("top_trainings", lambda: analytics.top_trainings(conn, 10)),
+            ("group_durations", lambda: analytics.group_durations(conn)),
+            ("duration_percentiles", lambda: analytics.duration_percentiles(conn, (50, 90, 99))),
+        ]:
+            start = time.perf_counter()
+            result = run()
+            cold = time.perf_counter() - start
+            start = time.perf_counter()
+            for _ in range(100):
+                run()
+            cached = (time.perf_counter() - start) / 100
+            print(f"{name:<22} cold {cold * 1e3:8.1f} ms, cached {cached * 1e3:6.3f} ms, first row {result[0]}")
@@ -0,0 +1,190 @@
+# Hot/cold partitioning: inactive or old rows move to an archive table.
+#
+#   items_archive = Archive(Item.__table__)        # items_archive, same database
+#   attach_archive(engine)                          # with ARCHIVE_DB=./archive.db: the
+#                                                   # archive lives in an attached file
+#   db.scalars(items_archive.select_all(Item))      # hot UNION ALL archived, as Items
+#
+# Handlers keep reading the hot table; select_all() is the opt-in union read.
+# Moving and restoring happen in batches, one short transaction each:
+#
+#   python archive.py archive --url sqlite:///./test.db --older-than-days 90
+#   python archive.py restore --url sqlite:///./test.db --ids 3,7
+#
+# The archive table is registered on the hot table's metadata, so create_all
+# and Alembic autogenerate pick it up like any other table.
+#
+# Archived ids must never be handed out again: give the hot table
+# sqlite_autoincrement=True. Without it SQLite reuses max(id) + 1 once the
+# newest row is deleted. A move that would overwrite a different row with the
+# same id raises ArchiveConflict instead.
+
+import os
+import time
+from datetime import timedelta
+from typing import Iterable, Optional
+
+import sqlalchemy as sa
+from sqlalchemy import event
+
+ARCHIVE_DB = os.getenv("ARCHIVE_DB")
+ARCHIVE_SCHEMA = "archive"
+
+
+class ArchiveConflict(RuntimeError):
+    pass
+
+
+def attach_archive(engine, path: Optional[str] = ARCHIVE_DB, schema: str = ARCHIVE_SCHEMA) -> None:
+    """ATTACH the archive database on every new SQLite connection (no-op without a path)."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    if not path or sync_engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(sync_engine, "connect")
+    def _attach(dbapi_connection, connection_record):
+        dbapi_connection.execute(f"ATTACH DATABASE '{path}' AS {schema}")
+
+
+class Archive:
+    def __init__(self, table: sa.Table, schema: Optional[str] = None, key: str = "id"):
+        if schema is None and ARCHIVE_DB:
+            schema = ARCHIVE_SCHEMA
+        self.hot = table
+        self.key = key
+        name = table.name + "_archive"
+        existing = table.metadata.tables.get(f"{schema}.{name}" if schema else name)
+        # Plain copies: no server defaults or foreign keys, the values come from the hot row
+        self.cold = existing if existing is not None else sa.Table(
+            name,
+            table.metadata,
+            *(sa.Column(column.name, column.type, primary_key=column.primary_key) for column in table.columns),
+            sa.Column("archived_at", sa.TIMESTAMP, nullable=False, index=True),
+            schema=schema,
+        )
+        self.columns = [column.name for column in table.columns]
+
+    def union(self) -> sa.CompoundSelect:
+        hot = sa.select(*(self.hot.c[name] for name in self.columns))
+        cold = sa.select(*(self.cold.c[name] for name in self.columns))
+        return sa.union_all(hot, cold).order_by(sa.literal_column(self.key))
+
+    def select_all(self, model) -> sa.Select:
+        """ORM select of hot and archived rows together."""
+        return sa.select(model).from_statement(self.union())
+
+    def select_columns(self, names) -> sa.Select:
+        """Some columns of hot and archived rows, as plain rows in key order."""
+        union = self.union().order_by(None).subquery()
+        return sa.select(*(union.c[name] for name in names)).order_by(union.c[self.key])
+
+    def _move(self, conn, source: sa.Table, target: sa.Table, keys: list, archived: bool) -> None:
+        source_key, target_key = source.c[self.key], target.c[self.key]
+        columns = [source.c[name] for name in self.columns]
+        if archived:
+            columns.append(sa.func.current_timestamp())
+        # A copy left by an interrupted batch is identical; anything else is a reused id
+        differs = sa.or_(*(target.c[name].is_distinct_from(source.c[name]) for name in self.columns))
+        clashes = conn.execute(
+            sa.select(target_key).join(source, source_key == target_key).where(target_key.in_(keys), differs)
+        ).scalars().all()
+        if clashes:
+            raise ArchiveConflict(
+                f"{target.name} already has different rows with {self.key} {', '.join(map(str, clashes))}; "
+                f"the ids were reused (is {self.hot.name} missing AUTOINCREMENT?)"
+            )
+        # Delete first: a batch interrupted between insert and delete can be redone
+        conn.execute(sa.delete(target).where(target_key.in_(keys)))
+        conn.execute(
+            sa.insert(target).from_select(
+                self.columns + (["archived_at"] if archived else []),
+                sa.select(*columns).where(source_key.in_(keys)),
+            )
+        )
+        conn.execute(sa.delete(source).where(source_key.in_(keys)))
+
+    def _batches(self, engine, source, target, where, batch_size, pause, archived) -> int:
+        key = source.c[self.key]
+        moved = 0
+        last = None
+        while True:
+            window = where if last is None else sa.and_(where, key > last)
+            with engine.begin() as conn:
+                keys = conn.execute(sa.select(key).where(window).order_by(key).limit(batch_size)).scalars().all()
+                if not keys:
+                    break
+                self._move(conn, source, target, keys, archived)
+            moved += len(keys)
+            last = keys[-1]
+            if len(keys) < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+        return moved
+
+    def archive(
+        self,
+        engine,
+        where: Optional[sa.ColumnElement] = None,
+        older_than: Optional[timedelta] = None,
+        batch_size: int = 500,
+        pause: float = 0.0,
+    ) -> int:
+        """Move inactive rows (plus rows created before now - older_than) to the archive."""
+        hot = self.hot.c
+        conditions = []
+        if where is not None:
+            conditions.append(where)
+        else:
+            conditions.append(hot.is_active.is_(False) if "is_active" in hot else sa.false())
+            if older_than is not None and "created_at" in hot:
+                # In SQL: created_at holds CURRENT_TIMESTAMP, which is UTC, not local time
+                cutoff = sa.func.datetime("now", f"-{int(older_than.total_seconds())} seconds")
+                conditions[0] = sa.or_(conditions[0], hot.created_at < cutoff)
+        # Never move the newest row: without AUTOINCREMENT SQLite hands out
+        # max(rowid) + 1, so removing it would let a new hot row reuse its id
+        conditions.append(hot[self.key] < sa.select(sa.func.max(hot[self.key])).scalar_subquery())
+        self.cold.create(engine, checkfirst=True)
+        return self._batches(engine, self.hot, self.cold, sa.and_(*conditions), batch_size, pause, archived=True)
+
+    def restore(
+        self,
+        engine,
+        ids: Optional[Iterable[int]] = None,
+        where: Optional[sa.ColumnElement] = None,
+        batch_size: int = 500,
+        pause: float = 0.0,
+    ) -> int:
+        """Move archived rows (all of them by default) back to the hot table."""
+        condition = sa.true() if where is None else where
+        if ids is not None:
+            condition = sa.and_(condition, self.cold.c[self.key].in_(list(ids)))
+        self.cold.create(engine, checkfirst=True)
+        return self._batches(engine, self.cold, self.hot, condition, batch_size, pause, archived=False)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Move rows between a table and its archive")
+    parser.add_argument("command", choices=["archive", "restore"])
+    parser.add_argument("--url", default="sqlite:///./test.db")
+    parser.add_argument("--table", default="items")
+    parser.add_argument("--older-than-days", type=int, help="archive: also move rows created before this")
+    parser.add_argument("--ids", help="restore: comma separated ids (default: everything)")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.0, help="seconds to sleep between batches")
+    args = parser.parse_args()
+
+    engine = sa.create_engine(args.url)
+    attach_archive(engine)
+    table = sa.Table(args.table, sa.MetaData(), autoload_with=engine)
+    archive = Archive(table)
+    if args.command == "archive":
+        older_than = timedelta(days=args.older_than_days) if args.older_than_days is not None else None
+        moved = archive.archive(engine, older_than=older_than, batch_size=args.batch_size, pause=args.pause)
+        print(f"Archived {moved} rows from {args.table}")
+    else:
+        ids = [int(i) for i in args.ids.split(",")] if args.ids else None
+        moved = archive.restore(engine, ids=ids, batch_size=args.batch_size, pause=args.pause)
+        print(f"Restored {moved} rows to {args.table}")
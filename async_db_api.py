@@ -1,40 +1,142 @@
 from contextlib import asynccontextmanager
 from datetime import datetime
+import json
 import os
-from typing import Optional
-from fastapi import FastAPI, Depends, HTTPException
-from sqlalchemy import Boolean, Column, Integer, String, TIMESTAMP, delete, func,select, update
+import tempfile
+from typing import List, Optional
+from fastapi import FastAPI, Depends, File, Header, HTTPException, Query, Response, UploadFile
+from sqlalchemy import Boolean, Column, Integer, String, TIMESTAMP, delete, func, insert, select, update
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Mapped, mapped_column
 from pydantic import BaseModel
+from admission import AdmissionMiddleware
+from compression import CompressionMiddleware
+from profiler import ProfilerMiddleware
+from idempotency import IdempotencyMiddleware
+from singleflight import SingleFlightMiddleware
+from metrics import instrument_app
+from statements import item_statements, track_compiled_cache
+from index_advisor import record_from_env
+from sqlite_tuning import enable_savepoints
+from write_coalescer import WriteCoalescer
+from startup import ALEMBIC_ITEMS_INI, prepare_database
+from archive import Archive, attach_archive
+from counters import FacetCounts
+from query_language import QueryError, QueryLanguage
+from projection import Projection, ProjectionError
+from versioning import ANY, etag, parse_if_match
+from jobs import SUCCEEDED, Job, JobRunner
+from blobstore import BlobStore
+from starlette.concurrency import run_in_threadpool
+from pydantic import ValidationError
 
 # Database configuration
 SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 engine = create_async_engine(SQLALCHEMY_DATABASE_URL, echo=True)
+enable_savepoints(engine)
 
 # Create async session maker
 async_session = async_sessionmaker(engine, expire_on_commit=False)
 
+# Creates, updates and deletes are group-committed by a single writer task
+writer = WriteCoalescer(async_session)
+
+# Exports, imports and reindexing run as background jobs (see jobs.py); files go to the blob store
+jobs = JobRunner()
+blobs = BlobStore()
+
 # Create Base class
 Base = declarative_base()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Create tables on startup (STARTUP_MODE=fast only checks the Alembic revision)
+    await prepare_database(
+        engine, Base.metadata, warm=[(stmts.by_id, {"item_id": 0}), (stmts.delete_by_id, {"item_id": 0})],
+        alembic_ini=ALEMBIC_ITEMS_INI,
+    )
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(facets.install)
+    await writer.start()
+    await jobs.start()
     yield
+    await jobs.stop()
+    await writer.stop()
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(SingleFlightMiddleware, paths=("/items",))
+app.add_middleware(IdempotencyMiddleware, paths=("/itemscreate",))
+app.add_middleware(CompressionMiddleware)
+# X-Profile: $PROFILE_TOKEN profiles one request; PROFILE_SAMPLE_RATE profiles at random (see profiler.py)
+app.add_middleware(ProfilerMiddleware)
+instrument_app(app, engine)
+track_compiled_cache(engine)
+# RECORD_STATEMENTS=statements.json feeds index_advisor.py
+record_from_env(engine)
 
 class Item(Base):
     __tablename__ = "items"
+    # Ids of archived rows are never handed out again (see archive.py)
+    __table_args__ = {"sqlite_autoincrement": True}
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True, autoincrement=True)
     name: Mapped[str] = mapped_column(String, index=True)
     description: Mapped[Optional[str]] = mapped_column(String)
     is_active: Mapped[bool] = mapped_column(Boolean)
     created_at: Mapped[datetime] = mapped_column(TIMESTAMP, server_default=func.now())
+    # Bumped on every UPDATE; flushes and If-Match updates check it (see versioning.py)
+    version: Mapped[int] = mapped_column(Integer, nullable=False, server_default="1")
+
+    # Fetch created_at with RETURNING on insert, so no refresh is needed
+    __mapper_args__ = {"eager_defaults": True, "version_id_col": version}
+
+# Prebuilt statements for the hot queries (see statements.py)
+stmts = item_statements(Item)
+
+# Inactive items are moved out by `python archive.py archive`; ?include_archived=true reads both
+items_archive = Archive(Item.__table__)
+attach_archive(engine)
+all_with_archived = items_archive.select_all(Item)
+
+# Item totals and counts per is_active, kept by triggers (see counters.py)
+facets = FacetCounts(Base.metadata)
+facets.track(Item.__table__, "is_active")
+
+# ?filter=...&sort=...&limit=... on GET /items (see query_language.py)
+item_queries = QueryLanguage(
+    Item,
+    allow={
+        "id": ("eq", "in", "range"),
+        "name": ("eq", "in", "prefix", "range"),
+        "is_active": ("eq",),
+        "created_at": ("eq", "range"),
+    },
+)
+
+def compile_query(filter, sort, limit, include_archived):
+    if include_archived:
+        raise HTTPException(status_code=400, detail="filter/sort/limit can't be combined with include_archived")
+    try:
+        return item_queries.compile(filter, sort, limit)
+    except QueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# ?fields=id,name: plain rows serialized straight to JSON, no ORM objects (see projection.py)
+item_projection = Projection(Item)
+
+def projected_query(fields, filter, sort, limit, include_archived):
+    try:
+        names = item_projection.parse(fields)
+    except ProjectionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if filter or sort or limit is not None:
+        statement, params = compile_query(filter, sort, limit, include_archived)
+        return item_projection.select(statement, names), params, names
+    if include_archived:
+        return items_archive.select_columns(names), {}, names
+    return item_projection.select(stmts.all, names), {}, names
 
 # Async dependency to get database session
 async def get_db():
@@ -46,67 +148,213 @@ async def get_db():
 
 # Test endpoint
 @app.get("/items")
-async def read_items(db: AsyncSession = Depends(get_db)):
-    result = (await db.scalars(select(Item))).all()
+async def read_items(
+    include_archived: bool = False,
+    filter: Optional[str] = None,
+    sort: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    if fields is not None:
+        statement, params, names = projected_query(fields, filter, sort, limit, include_archived)
+        return item_projection.response((await db.execute(statement, params)).all(), names)
+    if filter or sort or limit is not None:
+        statement, params = compile_query(filter, sort, limit, include_archived)
+        return (await db.scalars(statement, params)).all()
+    result = (await db.scalars(all_with_archived if include_archived else stmts.all)).all()
     return result
 
+@app.get("/items/facets")
+async def read_item_facets(db: AsyncSession = Depends(get_db)):
+    return await db.run_sync(facets.read)
+
 class ItemCreate(BaseModel):
     name: str
     description: str
 
 @app.post("/itemscreate")
-async def create_item(item: ItemCreate, db: AsyncSession = Depends(get_db)):
+async def create_item(item: ItemCreate):
     item_dict = item.model_dump()
     item_dict["is_active"] = True
-    
-    new_item = Item(**item_dict)
-    db.add(new_item)
-    await db.commit()
-    await db.refresh(new_item)
-    return new_item
+
+    async def op(db: AsyncSession):
+        new_item = Item(**item_dict)
+        db.add(new_item)
+        return new_item
+
+    return await writer.submit(op)
 
 
 @app.put("/items/{item_id}")
-async def update_item(item_id: int, item: ItemCreate, db: AsyncSession = Depends(get_db)):
-    # Check if item exists
-    result = await db.execute(select(Item).where(Item.id == item_id))
-    existing_item = result.scalar_one_or_none()
-    
-    if not existing_item:
-        raise HTTPException(status_code=404, detail="Item not found")
-    
+async def update_item(item_id: int, item: ItemCreate, response: Response, if_match: Optional[str] = Header(None)):
     # Filter out None values from update data
     update_data = {k: v for k, v in item.model_dump().items() if v is not None}
-    
-    if update_data:
-        # Update the item
-        await db.execute(
-            update(Item)
-            .where(Item.id == item_id)
-            .values(**update_data)
-        )
-        await db.commit()
-    
-    # Fetch and return updated item
-    result = await db.execute(select(Item).where(Item.id == item_id))
-    updated_item = result.scalar_one()
+    versions = parse_if_match(if_match) if if_match is not None else ANY
+
+    async def op(db: AsyncSession):
+        # One UPDATE ... RETURNING; with If-Match only while the version still matches (see versioning.py)
+        params = {"item_id": item_id, **update_data}
+        if versions is ANY:
+            result = await db.scalars(stmts.update_returning, params)
+        else:
+            result = await db.scalars(stmts.update_if_version, {**params, "versions": versions})
+        updated_item = result.first()
+
+        if updated_item is None:
+            if versions is ANY or (await db.scalars(stmts.by_id, params)).first() is None:
+                raise HTTPException(status_code=404, detail="Item not found")
+            raise HTTPException(status_code=412, detail="Item was modified since it was read")
+        return updated_item
+
+    updated_item = await writer.submit(op)
+    response.headers["ETag"] = etag(updated_item.version)
     return updated_item
 
 @app.delete("/items/{item_id}")
-async def delete_item(item_id: int, db: AsyncSession = Depends(get_db)):
-    # Check if item exists
-    result = await db.execute(select(Item).where(Item.id == item_id))
-    existing_item = result.scalar_one_or_none()
-    
-    if not existing_item:
-        raise HTTPException(status_code=404, detail="Item not found")
-    
-    # Delete the item
-    await db.execute(delete(Item).where(Item.id == item_id))
-    await db.commit()
-    
+async def delete_item(item_id: int):
+    async def op(db: AsyncSession):
+        # Check if item exists
+        result = await db.execute(stmts.by_id, {"item_id": item_id})
+        existing_item = result.scalar_one_or_none()
+
+        if not existing_item:
+            raise HTTPException(status_code=404, detail="Item not found")
+
+        # Delete the item
+        await db.execute(stmts.delete_by_id, {"item_id": item_id})
+
+    await writer.submit(op)
     return {"message": f"Item {item_id} deleted successfully"}
 
+# Background jobs: 202 with the job, then poll GET /jobs/{id}
+EXPORT_BATCH = 1000
+IMPORT_CHUNK = 1024 * 1024
+
+def _isoformat(value):
+    return value.isoformat()
+
+def encode_items(rows: List[dict]) -> bytes:
+    # Runs in the job process pool
+    return b"".join(json.dumps(row, default=_isoformat).encode() + b"\n" for row in rows)
+
+def parse_items(chunk: bytes):
+    # Runs in the job process pool: NDJSON lines of ItemCreate -> insert rows, rejected line count
+    rows, rejected = [], 0
+    for line in chunk.splitlines():
+        if not line.strip():
+            continue
+        try:
+            rows.append({**ItemCreate.model_validate_json(line).model_dump(), "is_active": True})
+        except ValidationError:
+            rejected += 1
+    return rows, rejected
+
+def read_lines(file, size: int) -> bytes:
+    # About `size` bytes, extended to the end of a line
+    return file.read(size) + file.readline()
+
+@jobs.task("export_items")
+async def export_items(job: Job, params: dict):
+    statement, query_params = item_queries.compile(params.get("filter"), params.get("sort"))
+    columns = statement.with_only_columns(*Item.__table__.columns)
+    async with async_session() as db:
+        total = await db.scalar(select(func.count()).select_from(statement.order_by(None).subquery()), query_params)
+        exported = 0
+        with tempfile.TemporaryFile() as out:
+            result = await db.stream(columns.execution_options(yield_per=EXPORT_BATCH), query_params)
+            async for batch in result.mappings().partitions():
+                data = await job.cpu(encode_items, [dict(row) for row in batch])
+                await run_in_threadpool(out.write, data)
+                exported += len(batch)
+                await job.progress(exported, total, f"{exported}/{total} items")
+            out.seek(0)
+            digest, size, _ = await run_in_threadpool(blobs.put, out)
+    return {"blob": digest, "items": exported, "bytes": size}
+
+async def commit_chunk(job: Job, rows: list, state: dict):
+    if rows:
+        # One short transaction per chunk; app writes get the lock in between
+        async with async_session() as db, db.begin():
+            await db.execute(insert(Item), rows)
+    await job.checkpoint(state)
+
+@jobs.task("import_items")
+async def import_items(job: Job, params: dict):
+    path = blobs.path(params["blob"])
+    total = os.path.getsize(path)
+    # Resumed after a shutdown: skip what the previous run committed
+    state = job.resume_from or {"offset": 0, "imported": 0, "rejected": 0}
+    imported, rejected = state["imported"], state["rejected"]
+    with open(path, "rb") as file:
+        file.seek(state["offset"])
+        while chunk := await run_in_threadpool(read_lines, file, IMPORT_CHUNK):
+            rows, bad = await job.cpu(parse_items, chunk)
+            imported += len(rows)
+            rejected += bad
+            state = {"offset": file.tell(), "imported": imported, "rejected": rejected}
+            await job.uninterrupted(commit_chunk(job, rows, state))
+            await job.progress(file.tell(), total, f"{imported} imported, {rejected} rejected")
+    return {"imported": imported, "rejected": rejected}
+
+@jobs.task("reindex")
+async def reindex(job: Job, params: dict):
+    steps = ("REINDEX items", "ANALYZE items", "PRAGMA optimize")
+    async with engine.connect() as conn:
+        for done, step in enumerate(steps):
+            await job.progress(done, len(steps), step)
+            await conn.exec_driver_sql(step)
+            await conn.commit()
+    return {"steps": list(steps)}
+
+class ExportRequest(BaseModel):
+    filter: Optional[str] = None
+    sort: Optional[str] = None
+
+@app.post("/jobs/export-items", status_code=202)
+async def start_export(request: ExportRequest):
+    # Reject a bad filter now rather than with a failed job
+    compile_query(request.filter, request.sort, None, False)
+    return await jobs.submit("export_items", request.model_dump())
+
+@app.post("/jobs/import-items", status_code=202)
+async def start_import(file: UploadFile = File(...)):
+    digest, size, _ = await blobs.save(file)
+    return await jobs.submit("import_items", {"blob": digest, "bytes": size})
+
+@app.post("/jobs/reindex", status_code=202)
+async def start_reindex():
+    return await jobs.submit("reindex")
+
+@app.get("/jobs")
+async def list_jobs(status: Optional[str] = None, limit: int = Query(50, ge=1, le=500)):
+    return await jobs.list(status, limit)
+
+@app.get("/jobs/{job_id}")
+async def read_job(job_id: str):
+    job = await jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    job = await jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}/result")
+async def download_job_result(job_id: str):
+    job = await jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != SUCCEEDED or not (job["result"] or {}).get("blob"):
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']} and has no file to download")
+    return blobs.response(
+        job["result"]["blob"], filename=f"{job['kind']}-{job_id}.ndjson", media_type="application/x-ndjson"
+    )
+
 
 if __name__ == "__main__":
     import uvicorn
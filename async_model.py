@@ -1,6 +1,7 @@
 from sqlalchemy import TIMESTAMP, Column, Integer, String, Table, ForeignKey, case, func, select, text
 from sqlalchemy.orm import relationship, declarative_base, joinedload, load_only
 from sqlalchemy.ext.asyncio import  create_async_engine, async_sessionmaker
+from summaries import RequestSummaries
 Base = declarative_base()
 
 # Association Table
@@ -18,16 +19,26 @@ class Request(Base):
     name = Column(String, nullable=False)
     description = Column(String)
     group=Column(String, nullable=True)
+    # Bumped on every UPDATE; flushes and If-Match updates check it (see versioning.py)
+    version = Column(Integer, nullable=False, server_default="1")
     trainings = relationship("Training", secondary=request_training, back_populates="requests")
 
+    __mapper_args__ = {"version_id_col": version}
+
 class Training(Base):
     __tablename__ = "trainings"
     
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, nullable=False)
     duration = Column(Integer)
+    version = Column(Integer, nullable=False, server_default="1")
     requests = relationship("Request", secondary=request_training, back_populates="trainings")
 
+    __mapper_args__ = {"version_id_col": version}
+
+# GET /requests/ payload, pre-serialized per request (see summaries.py)
+summaries = RequestSummaries(Base.metadata)
+
 
 
 SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./relation.db"
@@ -1,4 +1,12 @@
-from async_model import Request, Training, request_training,async_session
+from async_model import Request, Training, request_training,async_session, engine, summaries
+from admission import AdmissionMiddleware
+from compression import CompressionMiddleware
+from profiler import ProfilerMiddleware
+from singleflight import SingleFlightMiddleware
+from metrics import instrument_app
+from statements import request_statements, track_compiled_cache
+from index_advisor import record_from_env
+from contextlib import asynccontextmanager
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import Column, Integer, String, Table, ForeignKey, case, func, select, text
 from sqlalchemy.orm import relationship, declarative_base, joinedload, load_only
@@ -25,11 +33,29 @@ class RequestCreate(RequestBase):
 
 
    
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Response, status
 
 from typing import List
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Summary table and its triggers (no-op until the tables are migrated)
+    async with engine.begin() as conn:
+        await conn.run_sync(summaries.install)
+    yield
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(SingleFlightMiddleware, paths=("/requests/",))
+app.add_middleware(CompressionMiddleware)
+# X-Profile: $PROFILE_TOKEN profiles one request; PROFILE_SAMPLE_RATE profiles at random (see profiler.py)
+app.add_middleware(ProfilerMiddleware)
+instrument_app(app, engine)
+track_compiled_cache(engine)
+# RECORD_STATEMENTS=statements.json feeds index_advisor.py
+record_from_env(engine)
+
+request_stmts = request_statements(Request, Training)
 
 # Async dependency to get database session
 async def get_db():
@@ -73,18 +99,22 @@ async def get_db():
 async def get_all_requests(db: AsyncSession = Depends(get_db)):
     # Fetching data using sqlalchemy
     try : 
-        query = (
-            select(Request)
-            .options(
-                load_only(Request.id, Request.name),
-                joinedload(Request.trainings).load_only(Training.id, Training.title)
-                )
-            )
+        # query = (
+        #     select(Request)
+        #     .options(
+        #         load_only(Request.id, Request.name),
+        #         joinedload(Request.trainings).load_only(Training.id, Training.title)
+        #         )
+        #     )
+        # Same query, prebuilt once in statements.py
+        # query = request_stmts.with_trainings
 
     # Execute the query
-        results = await db.execute(query)
+        # results = await db.execute(query)
     # Unpack the results
-        results = results.unique().scalars().all()
+        # results = results.unique().scalars().all()
+        # Pre-serialized by the request_summaries triggers (see summaries.py): one table scan
+        results = Response(await db.run_sync(summaries.payload), media_type="application/json")
         # Fetching all requests data using text sql Query
         # query = text("""
         #     SELECT 
@@ -0,0 +1,245 @@
+# POST /batch: an ordered list of API operations in one HTTP call and one transaction.
+#
+#   Batcher(app, engine, SessionLocal, get_db)          # registers POST /batch
+#
+#   {"atomic": true, "operations": [
+#       {"method": "POST", "path": "/requests/", "body": {"name": "onboarding"}},
+#       {"method": "POST", "path": "/trainings/", "body": {"title": "security"}, "name": "training"},
+#       {"method": "POST", "path": "/requests/$0.id/trainings/$training.id"}
+#   ]}
+#
+# Operations are matched against the app's own routes and their (sync)
+# endpoint functions are called directly, with the body, path, query and
+# header parameters validated the way FastAPI would: no ASGI round trip and no
+# middleware between them. `$<index or name>.<field>` in a path, or as a whole
+# string value or key in body, query or headers, is replaced by that field of
+# an earlier operation's result.
+#
+# All operations share one Session joined to an outer transaction with
+# join_transaction_mode="create_savepoint": a handler's own commit() only
+# releases a SAVEPOINT and its rollback() undoes just that operation. The
+# outer transaction commits once, so the whole batch costs one commit.
+# - atomic (default): the first failure rolls everything back; the batch gets
+#   that operation's status and the operations after it are not run (424).
+# - best effort (atomic=false): a failed operation is rolled back to its
+#   savepoint, the others commit; one that refers to a failed result gets 424.
+#
+# SQLite needs enable_savepoints(engine) for the SAVEPOINTs.
+
+import inspect
+import re
+from functools import lru_cache
+from typing import Annotated, Any, Dict, List, Optional
+
+from fastapi import HTTPException, params
+from fastapi.encoders import jsonable_encoder
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+from pydantic.fields import FieldInfo
+from sqlalchemy.exc import IntegrityError
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Match
+
+MAX_OPERATIONS = 100
+
+_REF = re.compile(r"\$(\w+)((?:\.\w+)+)")
+# Headers of a bare Response(); only what the handler sets is reported
+_DEFAULT_HEADERS = frozenset(Response().headers.keys())
+
+
+class Operation(BaseModel):
+    method: str = "POST"
+    path: str
+    body: Any = None
+    query: Dict[str, Any] = {}
+    headers: Dict[str, str] = {}
+    # Lets later operations refer to this one as $name instead of $index
+    name: Optional[str] = None
+
+
+class BatchRequest(BaseModel):
+    operations: List[Operation] = Field(min_length=1, max_length=MAX_OPERATIONS)
+    atomic: bool = True
+
+
+class _Failed(Exception):
+    def __init__(self, status: int, detail: Any):
+        self.status = status
+        self.detail = detail
+
+
+@lru_cache(maxsize=None)
+def _adapter(annotation) -> TypeAdapter:
+    return TypeAdapter(annotation)
+
+
+def _validate(parameter: inspect.Parameter, value, loc: tuple):
+    annotation = parameter.annotation
+    if annotation is inspect.Parameter.empty:
+        return value
+    if isinstance(parameter.default, FieldInfo):
+        # Query(10, ge=1) and friends carry constraints
+        annotation = Annotated[annotation, parameter.default]
+    try:
+        return _adapter(annotation).validate_python(value)
+    except ValidationError as e:
+        errors = [
+            {**error, "loc": loc + tuple(error["loc"])}
+            for error in e.errors(include_url=False, include_context=False, include_input=False)
+        ]
+        raise _Failed(422, errors)
+
+
+def _is_body(parameter: inspect.Parameter) -> bool:
+    if isinstance(parameter.default, params.Body):
+        return True
+    annotation = parameter.annotation
+    if inspect.isclass(annotation) and issubclass(annotation, BaseModel):
+        return True
+    # Dict[int, ItemUpdate] and the like
+    return getattr(annotation, "__origin__", None) in (dict, list)
+
+
+class Batcher:
+    def __init__(self, app, engine, sessionmaker, dependency, path: str = "/batch"):
+        self.app = app
+        self.engine = engine
+        self.sessionmaker = sessionmaker
+        # The get_db dependency; handlers get the batch session in its place
+        self.dependency = dependency
+        self.path = path
+
+        def run_batch(request: BatchRequest):
+            return self.run(request)
+
+        app.add_api_route(path, run_batch, methods=["POST"])
+
+    def run(self, request: BatchRequest) -> JSONResponse:
+        names: Dict[str, int] = {}
+        for index, operation in enumerate(request.operations):
+            if operation.name is not None:
+                if operation.name in names or operation.name.isdigit():
+                    raise HTTPException(status_code=400, detail=f"operation name {operation.name!r} is not unique")
+                names[operation.name] = index
+
+        results: List[dict] = []
+        failed: Optional[int] = None
+        with self.engine.connect() as conn:
+            transaction = conn.begin()
+            db = self.sessionmaker(bind=conn, join_transaction_mode="create_savepoint")
+            try:
+                for index, operation in enumerate(request.operations):
+                    if failed is not None and request.atomic:
+                        results.append({"status": 424, "body": {"detail": f"not run, operation {failed} failed"}})
+                        continue
+                    try:
+                        results.append(self._execute(db, operation, results, names))
+                    except _Failed as e:
+                        # Back to the savepoint taken before this operation
+                        db.rollback()
+                        results.append({"status": e.status, "body": {"detail": e.detail}})
+                        if failed is None:
+                            failed = index
+                committed = failed is None or not request.atomic
+                if committed:
+                    db.commit()
+                    transaction.commit()
+                else:
+                    transaction.rollback()
+            finally:
+                db.close()
+        status = results[failed]["status"] if failed is not None and request.atomic else 200
+        return JSONResponse({"committed": committed, "results": results}, status_code=status)
+
+    def _execute(self, db, operation: Operation, results: List[dict], names: Dict[str, int]) -> dict:
+        path = _REF.sub(lambda ref: str(self._lookup(ref, results, names)), operation.path)
+        route, path_params = self._match(operation.method.upper(), path)
+        response = Response()
+        kwargs = self._arguments(db, route, path_params, operation, response, results, names)
+        try:
+            result = route.endpoint(**kwargs)
+        except HTTPException as e:
+            raise _Failed(e.status_code, e.detail)
+        except IntegrityError as e:
+            raise _Failed(409, str(e.orig))
+        if isinstance(result, Response):
+            raise _Failed(400, f"{operation.method} {route.path} returns a raw response and can't be batched")
+        headers = {name: value for name, value in response.headers.items() if name not in _DEFAULT_HEADERS}
+        # A status set on the injected Response wins over the route's, as in FastAPI
+        status = response.status_code if response.status_code != 200 else route.status_code or 200
+        # Encoded now, while the session still holds the objects the handler returned
+        entry = {"status": status, "body": jsonable_encoder(result)}
+        if headers:
+            entry["headers"] = headers
+        return entry
+
+    def _match(self, method: str, path: str):
+        scope = {"type": "http", "method": method, "path": path, "root_path": ""}
+        allowed = False
+        for route in self.app.router.routes:
+            if not isinstance(route, APIRoute) or route.path == self.path:
+                continue
+            match, child_scope = route.matches(scope)
+            if match == Match.FULL:
+                if inspect.iscoroutinefunction(route.endpoint):
+                    raise _Failed(400, f"{method} {route.path} is async and can't be batched")
+                return route, child_scope["path_params"]
+            allowed = allowed or match == Match.PARTIAL
+        if allowed:
+            raise _Failed(405, "Method Not Allowed")
+        raise _Failed(404, "Not Found")
+
+    def _arguments(self, db, route, path_params, operation, response, results, names) -> dict:
+        resolve = lambda value: self._resolve(value, results, names)  # noqa: E731
+        headers = {name.lower(): str(value) for name, value in resolve(operation.headers).items()}
+        query = resolve(operation.query)
+        kwargs = {}
+        for name, parameter in inspect.signature(route.endpoint).parameters.items():
+            default = parameter.default
+            if isinstance(default, params.Depends):
+                if default.dependency is not self.dependency:
+                    raise _Failed(400, f"{route.path} depends on {default.dependency.__name__}, which a batch can't provide")
+                kwargs[name] = db
+            elif parameter.annotation is Response:
+                kwargs[name] = response
+            elif isinstance(default, params.Header):
+                header = (default.alias or name.replace("_", "-")).lower()
+                kwargs[name] = _validate(parameter, headers.get(header, default.default), ("header", header))
+            elif name in path_params:
+                kwargs[name] = _validate(parameter, path_params[name], ("path", name))
+            elif _is_body(parameter):
+                kwargs[name] = _validate(parameter, resolve(operation.body), ("body",))
+            else:
+                fallback = default.default if isinstance(default, params.Query) else default
+                if name not in query and fallback is inspect.Parameter.empty:
+                    raise _Failed(422, [{"type": "missing", "loc": ("query", name), "msg": "Field required"}])
+                kwargs[name] = _validate(parameter, query.get(name, fallback), ("query", name))
+        return kwargs
+
+    def _resolve(self, value, results, names):
+        if isinstance(value, str):
+            ref = _REF.fullmatch(value)
+            return self._lookup(ref, results, names) if ref else value
+        if isinstance(value, dict):
+            # Keys too: bulk updates are keyed by id
+            return {self._resolve(key, results, names): self._resolve(item, results, names) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._resolve(item, results, names) for item in value]
+        return value
+
+    @staticmethod
+    def _lookup(ref: re.Match, results: List[dict], names: Dict[str, int]):
+        key, fields = ref.group(1), ref.group(2)[1:].split(".")
+        index = names.get(key, int(key) if key.isdigit() else None)
+        if index is None or index >= len(results):
+            raise _Failed(400, f"{ref.group(0)} doesn't refer to an earlier operation")
+        entry = results[index]
+        if entry["status"] >= 400:
+            raise _Failed(424, f"{ref.group(0)} refers to failed operation {index}")
+        value = entry["body"]
+        for field in fields:
+            try:
+                value = value[int(field)] if isinstance(value, list) else value[field]
+            except (KeyError, IndexError, ValueError, TypeError):
+                raise _Failed(400, f"{ref.group(0)}: result of operation {index} has no {field!r}")
+        return value
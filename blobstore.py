@@ -0,0 +1,151 @@
+# Content-addressed blob store.
+#
+#   blobs = BlobStore()                                   # BLOB_DIR, default ./blobs
+#   digest, size, created = await blobs.save(upload)      # created=False: already stored
+#   return blobs.response(digest, filename="report.pdf")  # GET/HEAD /blobs/{digest}
+#
+# A blob's name is the SHA-256 of its bytes (blobs/ab/cdef...), so identical
+# uploads are stored once and a client can HEAD /blobs/{digest} to skip an
+# upload entirely. Uploads are hashed while they are copied to a temporary
+# file, which is then hard-linked into place: two concurrent uploads of the
+# same bytes can't clobber each other and a reader never sees a partial blob.
+#
+# Downloads are FileResponses with the hash as a strong ETag, so Range (206),
+# If-Range and multi-range requests work and an interrupted download resumes
+# where it stopped; If-None-Match answers 304. The body is sent without
+# copying through Python when the server offers it: "http.response.zerocopysend"
+# (os.sendfile, including single ranges) or "http.response.pathsend" (whole
+# files). uvicorn offers neither and falls back to chunked reads.
+
+import hashlib
+import os
+import re
+import tempfile
+from typing import Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, MalformedRangeHeader, RangeNotSatisfiable, Response
+
+BLOB_DIR = os.getenv("BLOB_DIR", "./blobs")
+CHUNK_SIZE = 1024 * 1024
+
+_DIGEST = re.compile(r"^[0-9a-f]{64}$")
+
+
+class BlobStore:
+    def __init__(self, root: str = BLOB_DIR, chunk_size: int = CHUNK_SIZE):
+        self.root = root
+        self.chunk_size = chunk_size
+        self._incoming = os.path.join(root, "incoming")
+
+    def path(self, digest: str) -> str:
+        if not _DIGEST.match(digest):
+            raise ValueError(f"not a sha256 hex digest: {digest!r}")
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def put(self, fileobj) -> Tuple[str, int, bool]:
+        """Store a readable binary file object; returns (digest, size, created)."""
+        sha = hashlib.sha256()
+        size = 0
+        os.makedirs(self._incoming, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=self._incoming)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while chunk := fileobj.read(self.chunk_size):
+                    sha.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+                out.flush()
+                os.fsync(out.fileno())
+            digest = sha.hexdigest()
+            target = self.path(digest)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                os.link(temp, target)
+                created = True
+            except FileExistsError:
+                created = False
+        finally:
+            os.unlink(temp)
+        return digest, size, created
+
+    async def save(self, upload) -> Tuple[str, int, bool]:
+        """put() for an UploadFile, off the event loop."""
+        await upload.seek(0)
+        return await run_in_threadpool(self.put, upload.file)
+
+    def stat(self, digest: str) -> Optional[os.stat_result]:
+        try:
+            return os.stat(self.path(digest))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def response(
+        self, digest: str, filename: Optional[str] = None, media_type: str = "application/octet-stream"
+    ) -> Response:
+        stat_result = self.stat(digest)
+        if stat_result is None:
+            return Response(status_code=404)
+        return BlobResponse(
+            self.path(digest),
+            stat_result=stat_result,
+            filename=filename,
+            media_type=media_type,
+            headers={
+                "etag": f'"{digest}"',
+                # The content behind a digest never changes
+                "cache-control": "public, max-age=31536000, immutable",
+            },
+        )
+
+
+class BlobResponse(FileResponse):
+    async def __call__(self, scope, receive, send):
+        request_headers = Headers(scope=scope)
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match and _etag_matches(if_none_match, self.headers["etag"]):
+            not_modified = {name: self.headers[name] for name in ("etag", "cache-control")}
+            await Response(status_code=304, headers=not_modified)(scope, receive, send)
+            return
+        if "http.response.zerocopysend" in scope.get("extensions", {}) and scope["method"] != "HEAD":
+            if await self._zerocopy(request_headers, send):
+                return
+        await super().__call__(scope, receive, send)
+
+    async def _zerocopy(self, request_headers: Headers, send) -> bool:
+        """Whole file or one range via the server's sendfile; False leaves it to FileResponse."""
+        size = int(self.headers["content-length"])
+        start, end = 0, size
+        http_range = request_headers.get("range")
+        http_if_range = request_headers.get("if-range")
+        if http_range and (http_if_range is None or self._should_use_range(http_if_range)):
+            try:
+                ranges = self._parse_range_header(http_range, size)
+            except (MalformedRangeHeader, RangeNotSatisfiable):
+                return False
+            if len(ranges) != 1:
+                return False
+            start, end = ranges[0]
+
+        headers = self.raw_headers
+        status = self.status_code
+        if (start, end) != (0, size):
+            status = 206
+            headers = [(name, value) for name, value in headers if name != b"content-length"]
+            headers += [
+                (b"content-length", str(end - start).encode()),
+                (b"content-range", f"bytes {start}-{end - 1}/{size}".encode()),
+            ]
+        with open(self.path, "rb") as file:
+            await send({"type": "http.response.start", "status": status, "headers": headers})
+            await send({"type": "http.response.zerocopysend", "file": file, "offset": start, "count": end - start})
+        return True
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as If-None-Match requires
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in candidates
@@ -0,0 +1,230 @@
+# Facet counts and totals kept up to date by the database itself.
+#
+#   facets = FacetCounts(Base.metadata)
+#   facets.track(Item.__table__, "is_active")
+#   ...
+#   async with engine.begin() as conn:          # in the lifespan
+#       await conn.run_sync(facets.install)
+#   facets.read(db)                             # {"total": 12, "is_active": {True: 9, False: 3}}
+#
+# facet_counts holds one row per (facet, value) plus a "*" row with the table
+# total. AFTER INSERT/UPDATE/DELETE triggers adjust it in the same transaction
+# as the write, so ORM flushes, Core bulk statements (write_coalescer), the
+# archive job and raw SQL are all counted. Reading a facet is a primary key
+# range lookup instead of a COUNT(*) over the table.
+#
+# install() is idempotent: it creates the table and triggers if missing and
+# seeds facets that have no rows yet. To repair drift (e.g. rows written
+# while the triggers were dropped):
+#
+#   python counters.py reconcile sync_db_api:facets
+#
+# TableVersions uses the same mechanism for a per-table write counter, which
+# makes a cheap cache key for results derived from those tables.
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import sqlalchemy as sa
+
+TOTAL = "*"
+# Stored value for NULL, which can't be part of the primary key
+NULL = "<null>"
+
+
+def _value_sql(column: str, row: str) -> str:
+    return f"COALESCE(CAST({row}.\"{column}\" AS TEXT), '{NULL}')"
+
+
+def _bump(table: str, facet: str, value_sql: str, delta: int) -> str:
+    return (
+        f"INSERT INTO {table} (facet, value, count) VALUES ('{facet}', {value_sql}, {delta}) "
+        f"ON CONFLICT (facet, value) DO UPDATE SET count = count + ({delta});"
+    )
+
+
+class FacetCounts:
+    def __init__(self, metadata: sa.MetaData, name: str = "facet_counts"):
+        existing = metadata.tables.get(name)
+        self.table = existing if existing is not None else sa.Table(
+            name,
+            metadata,
+            sa.Column("facet", sa.String(128), primary_key=True),
+            sa.Column("value", sa.String(256), primary_key=True),
+            sa.Column("count", sa.Integer, nullable=False, server_default="0"),
+        )
+        self.tracked: Dict[str, Tuple[sa.Table, List[str]]] = {}
+        self._reads: Dict[str, sa.Select] = {}
+
+    def track(self, table: sa.Table, *columns: str) -> None:
+        """Count rows of `table`, in total and per value of each column."""
+        self.tracked[table.name] = (table, list(columns))
+        facets = [table.name] + [f"{table.name}.{column}" for column in columns]
+        self._reads[table.name] = (
+            sa.select(self.table.c.facet, self.table.c.value, self.table.c.count)
+            .where(self.table.c.facet.in_(facets))
+        )
+
+    def _triggers(self, table: sa.Table, columns: List[str]) -> List[str]:
+        name, counts = table.name, self.table.name
+        insert = [_bump(counts, name, f"'{TOTAL}'", 1)]
+        insert += [_bump(counts, f"{name}.{c}", _value_sql(c, "NEW"), 1) for c in columns]
+        delete = [_bump(counts, name, f"'{TOTAL}'", -1)]
+        delete += [_bump(counts, f"{name}.{c}", _value_sql(c, "OLD"), -1) for c in columns]
+        statements = [
+            f"CREATE TRIGGER IF NOT EXISTS {name}_facets_insert AFTER INSERT ON {name} BEGIN {' '.join(insert)} END",
+            f"CREATE TRIGGER IF NOT EXISTS {name}_facets_delete AFTER DELETE ON {name} BEGIN {' '.join(delete)} END",
+        ]
+        for c in columns:
+            statements.append(
+                f"CREATE TRIGGER IF NOT EXISTS {name}_facets_update_{c} AFTER UPDATE OF \"{c}\" ON {name} "
+                f"WHEN OLD.\"{c}\" IS NOT NEW.\"{c}\" BEGIN "
+                f"{_bump(counts, f'{name}.{c}', _value_sql(c, 'OLD'), -1)} "
+                f"{_bump(counts, f'{name}.{c}', _value_sql(c, 'NEW'), 1)} END"
+            )
+        return statements
+
+    def install(self, conn) -> None:
+        """Create the counts table and triggers; seed counts for newly tracked tables."""
+        if conn.dialect.name != "sqlite":
+            raise RuntimeError(f"facet triggers are only written for SQLite, not {conn.dialect.name}")
+        self.table.create(conn, checkfirst=True)
+        inspector = sa.inspect(conn)
+        for name, (table, columns) in self.tracked.items():
+            if not inspector.has_table(name, schema=table.schema):
+                # Not migrated yet; picked up by the next install()
+                continue
+            seeded = conn.execute(
+                sa.select(self.table.c.facet).where(self.table.c.facet == name).limit(1)
+            ).first()
+            for statement in self._triggers(table, columns):
+                conn.exec_driver_sql(statement)
+            if seeded is None:
+                self._recount(conn, table, columns)
+
+    def _recount(self, conn, table: sa.Table, columns: List[str]) -> None:
+        facets = [table.name] + [f"{table.name}.{column}" for column in columns]
+        conn.execute(sa.delete(self.table).where(self.table.c.facet.in_(facets)))
+        rows = [{"facet": table.name, "value": TOTAL,
+                 "count": conn.execute(sa.select(sa.func.count()).select_from(table)).scalar()}]
+        for column in columns:
+            grouped = conn.execute(sa.select(table.c[column], sa.func.count()).group_by(table.c[column]))
+            rows += [{"facet": f"{table.name}.{column}", "value": _encode(value), "count": count}
+                     for value, count in grouped]
+        conn.execute(sa.insert(self.table), rows)
+
+    def reconcile(self, conn) -> Dict[Tuple[str, str], Tuple[int, int]]:
+        """Recount every tracked facet; returns {(facet, value): (stored, actual)} for drifted ones."""
+        drift = {}
+        for name, (table, columns) in self.tracked.items():
+            before = {(f, v): c for f, v, c in conn.execute(self._reads[name])}
+            self._recount(conn, table, columns)
+            after = {(f, v): c for f, v, c in conn.execute(self._reads[name])}
+            for key in before.keys() | after.keys():
+                stored, actual = before.get(key, 0), after.get(key, 0)
+                if stored != actual:
+                    drift[key] = (stored, actual)
+        return drift
+
+    def read(self, conn, table_name: Optional[str] = None) -> Dict[str, Any]:
+        """{"total": n, column: {value: n, ...}} for one tracked table (works on a Session too)."""
+        table_name = table_name or next(iter(self.tracked))
+        table, _ = self.tracked[table_name]
+        return self.decode(table, conn.execute(self._reads[table_name]).all())
+
+    def decode(self, table: sa.Table, rows) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"total": 0}
+        for facet, value, count in rows:
+            if facet == table.name:
+                result["total"] = count
+                continue
+            if count == 0:
+                continue
+            column = facet.split(".", 1)[1]
+            result.setdefault(column, {})[_decode(table.c[column], value)] = count
+        return result
+
+
+class TableVersions:
+    """table_versions(name, version), bumped by triggers for every row written."""
+
+    def __init__(self, metadata: sa.MetaData, name: str = "table_versions"):
+        existing = metadata.tables.get(name)
+        self.table = existing if existing is not None else sa.Table(
+            name,
+            metadata,
+            sa.Column("name", sa.String(128), primary_key=True),
+            sa.Column("version", sa.Integer, nullable=False, server_default="0"),
+        )
+        self.tracked: List[str] = []
+        self._read = None
+
+    def track(self, *table_names: str) -> None:
+        self.tracked.extend(name for name in table_names if name not in self.tracked)
+        self._read = (
+            sa.select(self.table.c.name, self.table.c.version)
+            .where(self.table.c.name.in_(self.tracked))
+            .order_by(self.table.c.name)
+        )
+
+    def install(self, conn) -> None:
+        if conn.dialect.name != "sqlite":
+            raise RuntimeError(f"version triggers are only written for SQLite, not {conn.dialect.name}")
+        self.table.create(conn, checkfirst=True)
+        inspector = sa.inspect(conn)
+        versions = self.table.name
+        for name in self.tracked:
+            if not inspector.has_table(name):
+                continue
+            conn.exec_driver_sql(f"INSERT OR IGNORE INTO {versions} (name, version) VALUES ('{name}', 0)")
+            bump = f"UPDATE {versions} SET version = version + 1 WHERE name = '{name}';"
+            for action in ("INSERT", "UPDATE", "DELETE"):
+                conn.exec_driver_sql(
+                    f"CREATE TRIGGER IF NOT EXISTS {name}_version_{action.lower()} "
+                    f"AFTER {action} ON {name} BEGIN {bump} END"
+                )
+
+    def current(self, conn) -> Tuple[Tuple[str, int], ...]:
+        """Versions of every tracked table; changes whenever any of them is written."""
+        return tuple(conn.execute(self._read).all())
+
+
+def _encode(value) -> str:
+    if value is None:
+        return NULL
+    if isinstance(value, bool):
+        # Same text SQLite's CAST(bool_column AS TEXT) gives inside the triggers
+        return str(int(value))
+    return str(value)
+
+
+def _decode(column: sa.Column, value: str):
+    if value == NULL:
+        return None
+    if isinstance(column.type, sa.Boolean):
+        return value not in ("0", "false")
+    return value
+
+
+if __name__ == "__main__":
+    import argparse
+    import importlib
+
+    parser = argparse.ArgumentParser(description="Facet counters maintenance")
+    parser.add_argument("command", choices=["reconcile"])
+    parser.add_argument("target", help="module:attribute of a FacetCounts, e.g. sync_db_api:facets")
+    parser.add_argument("--url", help="database URL (default: the module's engine)")
+    args = parser.parse_args()
+
+    module_name, _, attribute = args.target.partition(":")
+    module = importlib.import_module(module_name)
+    facets = getattr(module, attribute or "facets")
+    engine = sa.create_engine(args.url) if args.url else module.engine
+    if hasattr(engine, "sync_engine"):
+        engine = sa.create_engine(engine.url.set(drivername="sqlite"))
+
+    with engine.begin() as conn:
+        facets.install(conn)
+        drift = facets.reconcile(conn)
+    for (facet, value), (stored, actual) in sorted(drift.items()):
+        print(f"{facet}={'NULL' if value == NULL else value}: {stored} -> {actual}")
+    print(f"Reconciled {len(facets.tracked)} tables, {len(drift)} counts fixed")
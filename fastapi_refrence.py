@@ -12,9 +12,19 @@ import io
 import csv
 import json
 
+from blobstore import BlobStore
+from compression import CompressionMiddleware
+from profiler import ProfilerMiddleware
+
 T = TypeVar('T')
 
 app = FastAPI(title="FastAPI Advanced CRUD Operations", version="1.0.0")
+app.add_middleware(CompressionMiddleware)
+# X-Profile: $PROFILE_TOKEN profiles one request; PROFILE_SAMPLE_RATE profiles at random (see profiler.py)
+app.add_middleware(ProfilerMiddleware)
+
+# Uploaded files, stored once per distinct content (see blobstore.py)
+blobs = BlobStore()
 
 # Advanced Pydantic models with validations
 class Location(BaseModel):
@@ -142,9 +152,11 @@ async def submit_form(
     response_type: Annotated[str, Form(enum=['json', 'text', 'file'])] = 'json'
 ) -> Union[JSONResponse, PlainTextResponse, FileResponse]:
     user_data=UserBase(email=email, username=username, website=website)
+    stored = [await blobs.save(file) for file in (files or [])]
     content = {
         "user": jsonable_encoder(user_data),
-        "files": [file.filename for file in (files or [])]
+        "files": [file.filename for file in (files or [])],
+        "blobs": [digest for digest, _, _ in stored]
     }
     
     if response_type == 'json':
@@ -164,6 +176,26 @@ async def submit_form(
             media_type="text/plain"
         )
 
+# 4b. Content-addressed uploads and resumable downloads
+@app.post("/blobs", status_code=status.HTTP_201_CREATED)
+async def upload_blobs(files: Annotated[List[UploadFile], File()]):
+    uploaded = []
+    for file in files:
+        digest, size, created = await blobs.save(file)
+        uploaded.append({"filename": file.filename, "sha256": digest, "size": size, "deduplicated": not created})
+    return {"blobs": uploaded}
+
+# HEAD tells a client whether it can skip the upload; GET honours Range, If-Range and If-None-Match
+@app.api_route("/blobs/{digest}", methods=["GET", "HEAD"], response_model=None)
+async def download_blob(
+    digest: Annotated[str, Path(pattern="^[0-9a-f]{64}$")],
+    filename: Optional[str] = None,
+):
+    response = blobs.response(digest, filename=filename)
+    if response.status_code == 404:
+        raise HTTPException(status_code=404, detail="Blob not found")
+    return response
+
 # 5. Streaming Response Example
 @app.get("/stream")
 async def stream_data(stream_type: str = Query(..., enum=['sse', 'bytes', 'iterator', 'async_iterator','json'])):
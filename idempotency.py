@@ -0,0 +1,313 @@
+# Idempotency-Key support for write endpoints.
+#
+#   app.add_middleware(IdempotencyMiddleware, paths=("/itemscreate", "/items/bulk-update"))
+#
+# A client that sends `Idempotency-Key: <unique value>` with a POST/PUT/PATCH
+# gets the same response for every retry with that key: the first request
+# runs the handler and its status, headers and body are kept in a small SQLite
+# store (IDEMPOTENCY_DB, separate from the app's database) for IDEMPOTENCY_TTL
+# seconds; retries are answered from there without touching the app's tables,
+# with an `Idempotent-Replayed: true` header.
+#
+# - A retry that arrives while the first request is still running waits for
+#   it (up to `wait` seconds, then 409). Within a process this is an event;
+#   across workers (launcher.py) the key row is claimed first and others poll.
+# - Reusing a key with a different method, path, query or body is a client
+#   bug and gets 422.
+# - 5xx responses and responses over max_bytes are not kept; the key is
+#   released so a retry runs again.
+# - Keys are scoped by the Authorization header, so clients can't read each
+#   other's responses by guessing keys.
+#
+# Add it after AdmissionMiddleware (replays and waiting retries take no
+# admission slot) and before CompressionMiddleware (the uncompressed response
+# is stored).
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from starlette.concurrency import run_in_threadpool
+
+from metrics import MetricsRegistry, registry
+from sqlite_tuning import enable_wal
+
+IDEMPOTENCY_DB = os.getenv("IDEMPOTENCY_DB", "./idempotency.db")
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+
+METHODS = ("POST", "PUT", "PATCH", "DELETE")
+# Headers that belong to the original exchange, not to the stored response
+SKIPPED_HEADERS = (b"date", b"server", b"set-cookie")
+
+NEW, DONE, PENDING, MISMATCH = "new", "done", "pending", "mismatch"
+
+
+class IdempotencyStore:
+    """idempotency_keys(key, fingerprint, status, headers, body, expires_at)."""
+
+    def __init__(self, url: str = f"sqlite:///{IDEMPOTENCY_DB}", lock_timeout: float = 60.0, purge_every: int = 500):
+        self.engine = sa.create_engine(url, connect_args={"check_same_thread": False})
+        enable_wal(self.engine)
+        self.table = sa.Table(
+            "idempotency_keys",
+            sa.MetaData(),
+            sa.Column("key", sa.String, primary_key=True),
+            sa.Column("fingerprint", sa.String(64), nullable=False),
+            # NULL while the first request is still running
+            sa.Column("status", sa.Integer),
+            sa.Column("headers", sa.Text),
+            sa.Column("body", sa.LargeBinary),
+            sa.Column("expires_at", sa.Float, nullable=False, index=True),
+        )
+        self.lock_timeout = lock_timeout
+        self.purge_every = purge_every
+        self._writes = 0
+        self._created = False
+        self._create_lock = threading.Lock()
+
+    def _begin(self):
+        if not self._created:
+            with self._create_lock:
+                if not self._created:
+                    self.table.create(self.engine, checkfirst=True)
+                    self._created = True
+        return self.engine.begin()
+
+    def claim(self, key: str, fingerprint: str) -> Tuple[str, Optional[Tuple[int, list, bytes]]]:
+        """(NEW, None) if the caller now owns the key, (DONE, response), (PENDING, None) or (MISMATCH, None).
+
+        Taking the key is a single conditional write (insert if missing, take
+        over if expired), so of any number of concurrent first requests, in
+        this process or another, exactly one gets NEW.
+        """
+        table = self.table
+        while True:
+            now = time.time()
+            claimed = {"fingerprint": fingerprint, "expires_at": now + self.lock_timeout}
+            with self._begin() as conn:
+                inserted = conn.execute(
+                    sqlite_insert(table).values(key=key, **claimed).on_conflict_do_nothing(index_elements=["key"])
+                ).rowcount
+                if inserted:
+                    return NEW, None
+                # Expired, or a claim whose owner died
+                taken = conn.execute(
+                    sa.update(table)
+                    .where(table.c.key == key, table.c.expires_at <= now)
+                    .values(status=None, headers=None, body=None, **claimed)
+                ).rowcount
+                if taken:
+                    return NEW, None
+                row = conn.execute(
+                    sa.select(table.c.fingerprint, table.c.status, table.c.headers, table.c.body)
+                    .where(table.c.key == key)
+                ).first()
+            if row is None:
+                # Released between the two statements; try again
+                continue
+            if row.fingerprint != fingerprint:
+                return MISMATCH, None
+            if row.status is None:
+                return PENDING, None
+            headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in json.loads(row.headers)]
+            return DONE, (row.status, headers, row.body)
+
+    def complete(self, key: str, status: int, headers: list, body: bytes, ttl: float) -> None:
+        encoded = json.dumps([(name.decode("latin-1"), value.decode("latin-1")) for name, value in headers])
+        with self._begin() as conn:
+            conn.execute(
+                sa.update(self.table)
+                .where(self.table.c.key == key)
+                .values(status=status, headers=encoded, body=body, expires_at=time.time() + ttl)
+            )
+        self._maybe_purge()
+
+    def release(self, key: str) -> None:
+        with self._begin() as conn:
+            conn.execute(sa.delete(self.table).where(self.table.c.key == key, self.table.c.status.is_(None)))
+
+    def _maybe_purge(self) -> None:
+        self._writes += 1
+        if self._writes % self.purge_every == 0:
+            self.purge()
+
+    def purge(self) -> int:
+        """Drop expired keys; uses the expires_at index."""
+        with self._begin() as conn:
+            return conn.execute(sa.delete(self.table).where(self.table.c.expires_at <= time.time())).rowcount
+
+
+class IdempotencyMiddleware:
+    """Pure ASGI; the first request streams to its client while the response is recorded."""
+
+    def __init__(
+        self,
+        app,
+        paths: Iterable[str] = (),
+        store: Optional[IdempotencyStore] = None,
+        ttl: float = IDEMPOTENCY_TTL,
+        wait: float = 30.0,
+        poll: float = 0.05,
+        max_bytes: int = 1024 * 1024,
+        registry: MetricsRegistry = registry,
+    ):
+        self.app = app
+        self.paths = frozenset(paths)
+        self.store = store if store is not None else IdempotencyStore()
+        self.ttl = ttl
+        self.wait = wait
+        self.poll = poll
+        self.max_bytes = max_bytes
+        self.running: Dict[str, asyncio.Event] = {}
+        self.requests = registry.counter(
+            "idempotency_requests_total", "Requests with an Idempotency-Key by outcome", ("path", "outcome")
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in METHODS or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        client_key = authorization = None
+        for name, value in scope["headers"]:
+            if name == b"idempotency-key":
+                client_key = value.decode("latin-1")
+            elif name == b"authorization":
+                authorization = value
+        if client_key is None:
+            await self.app(scope, receive, send)
+            return
+        path = scope["path"]
+        if not 0 < len(client_key) <= 255:
+            self.requests.inc(path, "invalid")
+            await _send_error(send, 400, "Idempotency-Key must be 1 to 255 characters")
+            return
+
+        body, receive = await _buffer(receive)
+        key = client_key
+        if authorization is not None:
+            key = hashlib.sha256(authorization).hexdigest()[:16] + ":" + client_key
+        fingerprint = hashlib.sha256(
+            b"\0".join([scope["method"].encode(), path.encode(), scope.get("query_string", b""), body])
+        ).hexdigest()
+
+        deadline = time.monotonic() + self.wait
+        while True:
+            running = self.running.get(key)
+            if running is not None:
+                # Same process: wait for the first request instead of polling the store
+                try:
+                    await asyncio.wait_for(running.wait(), max(deadline - time.monotonic(), 0))
+                except asyncio.TimeoutError:
+                    break
+                continue
+            # Registered before the claim, so same-process followers wait on
+            # this event instead of racing for the row
+            event = self.running[key] = asyncio.Event()
+            try:
+                outcome, stored = await run_in_threadpool(self.store.claim, key, fingerprint)
+            except BaseException:
+                self._finished(key, event)
+                raise
+            if outcome != NEW:
+                self._finished(key, event)
+            if outcome == NEW:
+                self.requests.inc(path, "executed")
+                await self._execute(key, event, scope, receive, send)
+                return
+            if outcome == DONE:
+                self.requests.inc(path, "replayed")
+                status, headers, stored_body = stored
+                await send({
+                    "type": "http.response.start",
+                    "status": status,
+                    "headers": headers + [(b"idempotent-replayed", b"true")],
+                })
+                await send({"type": "http.response.body", "body": stored_body})
+                return
+            if outcome == MISMATCH:
+                self.requests.inc(path, "mismatch")
+                await _send_error(send, 422, "Idempotency-Key was already used for a different request")
+                return
+            # Claimed by another worker process
+            if time.monotonic() >= deadline:
+                break
+            await asyncio.sleep(self.poll)
+        self.requests.inc(path, "conflict")
+        await _send_error(send, 409, "A request with this Idempotency-Key is still being processed")
+
+    def _finished(self, key: str, event: asyncio.Event) -> None:
+        event.set()
+        if self.running.get(key) is event:
+            del self.running[key]
+
+    async def _execute(self, key: str, event: asyncio.Event, scope, receive, send):
+        start: Optional[dict] = None
+        chunks: List[bytes] = []
+        size = 0
+        complete = False
+
+        async def send_wrapper(message):
+            nonlocal start, size, complete
+            if message["type"] == "http.response.start":
+                start = message
+            elif message["type"] == "http.response.body":
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                if size <= self.max_bytes:
+                    chunks.append(chunk)
+                complete = not message.get("more_body", False)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            try:
+                if start is not None and complete and start["status"] < 500 and size <= self.max_bytes:
+                    headers = [(n, v) for n, v in start.get("headers", []) if n not in SKIPPED_HEADERS]
+                    await run_in_threadpool(
+                        self.store.complete, key, start["status"], headers, b"".join(chunks), self.ttl
+                    )
+                else:
+                    await run_in_threadpool(self.store.release, key)
+            finally:
+                self._finished(key, event)
+
+
+async def _buffer(receive):
+    """Read the whole request body; returns it and a receive that replays it."""
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            # Disconnected before the body arrived
+            return b"", receive
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    body = b"".join(chunks)
+    replayed = False
+
+    async def replay():
+        nonlocal replayed
+        if not replayed:
+            replayed = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+
+    return body, replay
+
+
+async def _send_error(send, status: int, detail: str) -> None:
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
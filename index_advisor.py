@@ -0,0 +1,292 @@
+# Query-plan driven index advisor.
+#
+# 1. Record what the apps actually run: start them with RECORD_STATEMENTS=statements.json
+#    (see record_from_env). Every distinct statement is stored with sample parameters
+#    and the columns it filters, joins and sorts on.
+# 2. Analyze: python index_advisor.py analyze statements.json --url sqlite:///./relation.db
+#    runs EXPLAIN QUERY PLAN (SQLite) or EXPLAIN (Postgres) for each statement, looks for
+#    full scans and temporary sorts and proposes (covering) indexes for them.
+# 3. Accept: add --accept all (or --accept ix_a,ix_b) to write an Alembic migration
+#    creating the accepted indexes into alembic/versions.
+
+import atexit
+import json
+import os
+import re
+import uuid
+from typing import Dict, List, Optional
+
+from sqlalchemy import Column, event, inspect
+from sqlalchemy.sql import operators, visitors
+from sqlalchemy.sql.dml import Delete, Update
+from sqlalchemy.sql.elements import BinaryExpression, UnaryExpression
+from sqlalchemy.sql.selectable import Select
+
+EQUALITY = {operators.eq, operators.in_op, operators.is_}
+RANGE = {operators.lt, operators.le, operators.gt, operators.ge, operators.between_op, operators.like_op}
+
+# Covering indexes only when few extra columns are needed
+MAX_COVERING_COLUMNS = 3
+
+
+def _table_column(element) -> Optional[Column]:
+    if isinstance(element, Column) and getattr(element, "table", None) is not None:
+        return element
+    return None
+
+
+def column_usage(statement) -> Dict[str, Dict[str, List[str]]]:
+    """Columns used per table: equality/range filters, join keys, sort keys, selected."""
+    usage: Dict[str, Dict[str, List[str]]] = {}
+
+    def add(column: Column, kind: str) -> None:
+        entry = usage.setdefault(column.table.name, {"eq": [], "range": [], "join": [], "order": [], "select": []})
+        if column.name not in entry[kind]:
+            entry[kind].append(column.name)
+
+    roots = [statement.whereclause] if statement.whereclause is not None else []
+    if isinstance(statement, Select):
+        roots.extend(statement.get_final_froms())
+    for root in roots:
+        for node in visitors.iterate(root):
+            if not isinstance(node, BinaryExpression):
+                continue
+            left, right = _table_column(node.left), _table_column(node.right)
+            if left is not None and right is not None:
+                add(left, "join")
+                add(right, "join")
+                continue
+            column = left if left is not None else right
+            if column is None:
+                continue
+            if node.operator in EQUALITY:
+                add(column, "eq")
+            elif node.operator in RANGE:
+                add(column, "range")
+
+    if isinstance(statement, Select):
+        for clause in statement._order_by_clauses:
+            element = clause.element if isinstance(clause, UnaryExpression) else clause
+            column = _table_column(element)
+            if column is not None:
+                add(column, "order")
+        for selected in statement.selected_columns:
+            column = _table_column(selected)
+            if column is not None:
+                add(column, "select")
+    return usage
+
+
+class StatementRecorder:
+    def __init__(self, max_statements: int = 1000):
+        self.max_statements = max_statements
+        self.statements: Dict[str, dict] = {}
+
+    def attach(self, engine) -> None:
+        sync_engine = getattr(engine, "sync_engine", engine)
+        event.listen(sync_engine, "before_cursor_execute", self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        entry = self.statements.get(statement)
+        if entry is not None:
+            entry["count"] += 1
+            return
+        compiled = getattr(context, "compiled", None)
+        source = getattr(compiled, "statement", None)
+        if executemany or len(self.statements) >= self.max_statements:
+            return
+        if not isinstance(source, (Select, Update, Delete)):
+            return
+        self.statements[statement] = {
+            "sql": statement,
+            "params": list(parameters) if isinstance(parameters, (list, tuple)) else dict(parameters or {}),
+            "count": 1,
+            "usage": column_usage(source),
+        }
+
+    def dump(self, path: str) -> None:
+        recorded = load_statements(path) if os.path.exists(path) else {}
+        for sql, entry in self.statements.items():
+            if sql in recorded:
+                recorded[sql]["count"] += entry["count"]
+            else:
+                recorded[sql] = entry
+        with open(path, "w") as f:
+            json.dump(list(recorded.values()), f, indent=1, default=str)
+
+
+def load_statements(path: str) -> Dict[str, dict]:
+    with open(path) as f:
+        return {entry["sql"]: entry for entry in json.load(f)}
+
+
+def record_from_env(engine) -> Optional[StatementRecorder]:
+    """Record statements into $RECORD_STATEMENTS (written at exit), if it is set."""
+    path = os.getenv("RECORD_STATEMENTS")
+    if not path:
+        return None
+    recorder = StatementRecorder()
+    recorder.attach(engine)
+    atexit.register(recorder.dump, path)
+    return recorder
+
+
+def explain(conn, sql: str, params) -> List[str]:
+    if conn.dialect.name == "sqlite":
+        rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql, tuple(params) if isinstance(params, list) else params)
+        return [row[-1] for row in rows]
+    rows = conn.exec_driver_sql("EXPLAIN " + sql, tuple(params) if isinstance(params, list) else params)
+    return [row[0] for row in rows]
+
+
+def plan_problems(plan: List[str], dialect: str) -> List[tuple]:
+    """("scan", table) for full table scans, ("sort", None) for temporary sorts."""
+    problems = []
+    for line in plan:
+        if dialect == "sqlite":
+            scan = re.match(r"^SCAN (\w+)(?: AS \w+)?$", line.strip())
+            if scan:
+                problems.append(("scan", scan.group(1)))
+            elif "USE TEMP B-TREE" in line:
+                problems.append(("sort", None))
+        else:
+            scan = re.search(r"Seq Scan on (\w+)", line)
+            if scan:
+                problems.append(("scan", scan.group(1)))
+            elif re.match(r"^\s*(->\s*)?Sort\b", line):
+                problems.append(("sort", None))
+    return problems
+
+
+def _existing_prefixes(inspector, table: str) -> List[List[str]]:
+    prefixes = [index["column_names"] for index in inspector.get_indexes(table)]
+    primary_key = inspector.get_pk_constraint(table).get("constrained_columns") or []
+    if primary_key:
+        prefixes.append(primary_key)
+    return prefixes
+
+
+def propose(conn, statements: Dict[str, dict]) -> List[dict]:
+    inspector = inspect(conn)
+    tables = set(inspector.get_table_names())
+    proposals: Dict[str, dict] = {}
+
+    for entry in statements.values():
+        try:
+            plan = explain(conn, entry["sql"], entry["params"])
+        except Exception:
+            continue
+        problems = plan_problems(plan, conn.dialect.name)
+        sorts = any(kind == "sort" for kind, _ in problems)
+        candidates = {table for kind, table in problems if kind == "scan"}
+        if sorts:
+            candidates.update(table for table, usage in entry["usage"].items() if usage["order"])
+
+        for table in candidates:
+            usage = entry["usage"].get(table)
+            if table not in tables or not usage:
+                continue
+            # Equality and join columns first, then the sort keys (or a single range column)
+            key = usage["eq"] + [c for c in usage["join"] if c not in usage["eq"]]
+            tail = usage["order"] if sorts and usage["order"] else usage["range"][:1]
+            key += [c for c in tail if c not in key]
+            if not key:
+                continue
+            if any(prefix[: len(key)] == key for prefix in _existing_prefixes(inspector, table)):
+                continue
+
+            # Primary key columns are already part of every SQLite/Postgres index entry lookup
+            primary_key = inspector.get_pk_constraint(table).get("constrained_columns") or []
+            all_columns = [column["name"] for column in inspector.get_columns(table)]
+            extra = [c for c in usage["select"] if c not in key and c not in primary_key]
+            covering = (
+                0 < len(extra) <= MAX_COVERING_COLUMNS
+                and set(usage["select"]) != set(all_columns)
+            )
+            columns = key + extra if covering else key
+            name = "ix_" + table + "_" + "_".join(columns)
+            proposal = proposals.setdefault(
+                name,
+                {"name": name, "table": table, "columns": columns, "covering": covering,
+                 "reasons": [], "executions": 0},
+            )
+            proposal["executions"] += entry["count"]
+            reason = ", ".join(sorted({kind for kind, _ in problems})) + ": " + " ".join(entry["sql"].split())[:120]
+            if reason not in proposal["reasons"]:
+                proposal["reasons"].append(reason)
+
+    return sorted(proposals.values(), key=lambda p: -p["executions"])
+
+
+def render_migration(proposals: List[dict], revision: str, down_revision: Optional[str]) -> str:
+    upgrade = "\n".join(
+        f"    op.create_index({p['name']!r}, {p['table']!r}, {p['columns']!r})" for p in proposals
+    ) or "    pass"
+    downgrade = "\n".join(
+        f"    op.drop_index({p['name']!r}, table_name={p['table']!r})" for p in reversed(proposals)
+    ) or "    pass"
+    return f'''"""Indexes proposed by index_advisor.py
+
+Revision ID: {revision}
+Revises: {down_revision}
+"""
+from alembic import op
+
+revision = {revision!r}
+down_revision = {down_revision!r}
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+{upgrade}
+
+
+def downgrade():
+{downgrade}
+'''
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from sqlalchemy import create_engine
+
+    parser = argparse.ArgumentParser(description="Propose indexes from recorded statements")
+    sub = parser.add_subparsers(dest="command", required=True)
+    analyze = sub.add_parser("analyze", help="explain recorded statements and propose indexes")
+    analyze.add_argument("statements", help="file written through RECORD_STATEMENTS")
+    analyze.add_argument("--url", default="sqlite:///./relation.db")
+    analyze.add_argument("--accept", help="'all' or comma separated index names to write a migration for")
+    analyze.add_argument("--down-revision", help="current Alembic head (default: read from --alembic-ini)")
+    analyze.add_argument("--alembic-ini", default="alembic.ini")
+    analyze.add_argument("--versions", default=os.path.join("alembic", "versions"))
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    with engine.connect() as conn:
+        proposals = propose(conn, load_statements(args.statements))
+
+    for proposal in proposals:
+        kind = "covering index" if proposal["covering"] else "index"
+        print(f"{proposal['name']}: {kind} on {proposal['table']}({', '.join(proposal['columns'])}), "
+              f"{proposal['executions']} executions")
+        for reason in proposal["reasons"]:
+            print(f"    {reason}")
+    if not proposals:
+        print("No scans or temporary sorts that an index would fix.")
+
+    if args.accept:
+        accepted = [p for p in proposals if args.accept == "all" or p["name"] in args.accept.split(",")]
+        down_revision = args.down_revision
+        if down_revision is None:
+            from startup import alembic_head
+
+            # None while there are no revisions yet: this one becomes the first
+            down_revision = alembic_head(args.alembic_ini)
+        revision = uuid.uuid4().hex[:12]
+        os.makedirs(args.versions, exist_ok=True)
+        path = os.path.join(args.versions, f"{revision}_index_advisor.py")
+        with open(path, "w") as f:
+            f.write(render_migration(accepted, revision, down_revision))
+        print(f"Wrote {path} with {len(accepted)} indexes")
@@ -0,0 +1,434 @@
+# Background jobs: persisted in SQLite, run next to the app, off the request path.
+#
+#   jobs = JobRunner()                                  # JOBS_DB, JOB_CONCURRENCY, JOB_PROCESSES
+#
+#   @jobs.task("export_items")
+#   async def export_items(job: Job, params: dict):
+#       async for rows in ...:                          # I/O stages: plain asyncio
+#           data = await job.cpu(encode, rows)          # CPU stages: process pool
+#           await job.progress(done, total)
+#       return {"blob": digest}                         # kept as the job's result
+#
+#   await jobs.start() ... await jobs.stop()            # lifespan
+#   job = await jobs.submit("export_items", {"sort": "id"})
+#   await jobs.get(job["id"]), await jobs.cancel(job["id"])
+#
+# A job row (JOBS_DB, a file of its own so job bookkeeping never waits on the
+# app's write lock) goes queued -> running -> succeeded / failed / cancelled.
+# Each worker process claims queued rows with one UPDATE ... RETURNING, so
+# several workers (launcher.py) share the queue and queued jobs survive a
+# restart. Jobs still running when their worker shuts down go back to the
+# queue for the next worker; a task that saves job.checkpoint(...) resumes
+# from there, otherwise it starts over (job.uninterrupted keeps a commit and
+# its checkpoint together). A job that was running when its worker died is
+# marked failed once its heartbeat is `stale_after` seconds old rather than
+# run twice; stale_after must span several heartbeats (one per `poll`), so a
+# slow but live worker is never taken for a dead one.
+#
+# Heavy work can't crowd out the CRUD routes:
+# - at most JOB_CONCURRENCY jobs run per worker, the rest wait in the queue;
+# - CPU stages run in a pool of JOB_PROCESSES processes at nice JOB_NICE, so
+#   they hold neither the event loop, the GIL nor the threadpool, and the OS
+#   schedules request handling first;
+# - I/O stages should work in short transactions (batches), which lets the
+#   app's writers in between.
+#
+# Cancelling a queued job just marks it. A running job's task is cancelled at
+# its next await (the worker that owns it sees the request on its next
+# heartbeat); a CPU chunk already in the pool finishes, its result is dropped.
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import sqlalchemy as sa
+from starlette.concurrency import run_in_threadpool
+
+from metrics import MetricsRegistry, registry
+from sqlite_tuning import enable_wal
+
+JOBS_DB = os.getenv("JOBS_DB", "./jobs.db")
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "2"))
+JOB_PROCESSES = int(os.getenv("JOB_PROCESSES", str(max((os.cpu_count() or 2) - 1, 1))))
+JOB_NICE = int(os.getenv("JOB_NICE", "10"))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+
+logger = logging.getLogger(__name__)
+
+Task = Callable[["Job", dict], Awaitable[Any]]
+
+
+class JobStore:
+    """jobs(id, kind, params, status, progress, message, result, error, timestamps, owner)."""
+
+    def __init__(self, url: str = f"sqlite:///{JOBS_DB}"):
+        self.engine = sa.create_engine(url, connect_args={"check_same_thread": False})
+        enable_wal(self.engine)
+        self.table = sa.Table(
+            "jobs",
+            sa.MetaData(),
+            sa.Column("id", sa.String(32), primary_key=True),
+            sa.Column("kind", sa.String, nullable=False),
+            sa.Column("params", sa.Text, nullable=False),
+            sa.Column("status", sa.String, nullable=False),
+            sa.Column("progress", sa.Float, nullable=False, default=0.0),
+            sa.Column("message", sa.String),
+            sa.Column("result", sa.Text),
+            sa.Column("error", sa.Text),
+            # Saved by the task to resume after a requeue
+            sa.Column("checkpoint", sa.Text),
+            sa.Column("cancel_requested", sa.Boolean, nullable=False, default=False),
+            sa.Column("owner", sa.String),
+            sa.Column("created_at", sa.Float, nullable=False),
+            sa.Column("started_at", sa.Float),
+            sa.Column("finished_at", sa.Float),
+            sa.Column("heartbeat_at", sa.Float),
+            # Claims take the oldest queued job; listings are newest first
+            sa.Index("ix_jobs_status_created_at", "status", "created_at"),
+        )
+        self.table.create(self.engine, checkfirst=True)
+
+    def create(self, kind: str, params: dict) -> str:
+        job_id = uuid.uuid4().hex
+        with self.engine.begin() as conn:
+            conn.execute(sa.insert(self.table).values(
+                id=job_id, kind=kind, params=json.dumps(params), status=QUEUED, created_at=time.time()
+            ))
+        return job_id
+
+    def claim(self, owner: str) -> Optional[sa.Row]:
+        table = self.table
+        now = time.time()
+        oldest = (
+            sa.select(table.c.id).where(table.c.status == QUEUED)
+            .order_by(table.c.created_at).limit(1).scalar_subquery()
+        )
+        with self.engine.begin() as conn:
+            return conn.execute(
+                sa.update(table)
+                .where(table.c.id == oldest, table.c.status == QUEUED)
+                .values(status=RUNNING, owner=owner, started_at=now, heartbeat_at=now)
+                .returning(table.c.id, table.c.kind, table.c.params, table.c.checkpoint)
+            ).first()
+
+    def progress(self, job_id: str, progress: float, message: Optional[str]) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(
+                sa.update(self.table).where(self.table.c.id == job_id)
+                .values(progress=progress, message=message, heartbeat_at=time.time())
+            )
+
+    def save_checkpoint(self, job_id: str, checkpoint: Any) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(
+                sa.update(self.table).where(self.table.c.id == job_id)
+                .values(checkpoint=json.dumps(checkpoint), heartbeat_at=time.time())
+            )
+
+    def heartbeat(self, job_ids: List[str]) -> List[str]:
+        """Touch the running jobs of one worker; returns those with a pending cancel."""
+        if not job_ids:
+            return []
+        table = self.table
+        with self.engine.begin() as conn:
+            conn.execute(sa.update(table).where(table.c.id.in_(job_ids)).values(heartbeat_at=time.time()))
+            return list(conn.execute(
+                sa.select(table.c.id).where(table.c.id.in_(job_ids), table.c.cancel_requested)
+            ).scalars())
+
+    def finish(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None) -> None:
+        values = {"status": status, "error": error, "finished_at": time.time(), "result": json.dumps(result)}
+        if status == SUCCEEDED:
+            values["progress"] = 1.0
+        with self.engine.begin() as conn:
+            conn.execute(sa.update(self.table).where(self.table.c.id == job_id).values(**values))
+
+    def requeue(self, job_id: str) -> None:
+        """A running job back to the queue (cancelled instead if that was requested); keeps its checkpoint."""
+        table = self.table
+        with self.engine.begin() as conn:
+            conn.execute(
+                sa.update(table).where(table.c.id == job_id, table.c.status == RUNNING)
+                .values(
+                    status=sa.case((table.c.cancel_requested, CANCELLED), else_=QUEUED),
+                    finished_at=sa.case((table.c.cancel_requested, time.time()), else_=None),
+                    owner=None, started_at=None, heartbeat_at=None,
+                )
+            )
+
+    def request_cancel(self, job_id: str) -> Optional[str]:
+        """Cancels a queued job outright, flags a running one; returns the status or None if missing."""
+        table = self.table
+        with self.engine.begin() as conn:
+            conn.execute(
+                sa.update(table).where(table.c.id == job_id, table.c.status == QUEUED)
+                .values(status=CANCELLED, finished_at=time.time())
+            )
+            conn.execute(
+                sa.update(table).where(table.c.id == job_id, table.c.status == RUNNING)
+                .values(cancel_requested=True)
+            )
+            return conn.execute(sa.select(table.c.status).where(table.c.id == job_id)).scalar()
+
+    def fail_stale(self, older_than: float) -> int:
+        """Running jobs whose worker stopped sending heartbeats; older_than must span several of them."""
+        table = self.table
+        with self.engine.begin() as conn:
+            return conn.execute(
+                sa.update(table)
+                .where(table.c.status == RUNNING, table.c.heartbeat_at < time.time() - older_than)
+                .values(status=FAILED, error="worker stopped", finished_at=time.time())
+            ).rowcount
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self.engine.connect() as conn:
+            row = conn.execute(sa.select(self.table).where(self.table.c.id == job_id)).first()
+        return _job_dict(row) if row is not None else None
+
+    def list(self, status: Optional[str] = None, limit: int = 50) -> List[dict]:
+        statement = sa.select(self.table).order_by(self.table.c.created_at.desc()).limit(limit)
+        if status is not None:
+            statement = statement.where(self.table.c.status == status)
+        with self.engine.connect() as conn:
+            return [_job_dict(row) for row in conn.execute(statement)]
+
+
+def _job_dict(row) -> dict:
+    def when(timestamp):
+        return datetime.fromtimestamp(timestamp, timezone.utc) if timestamp is not None else None
+
+    return {
+        "id": row.id,
+        "kind": row.kind,
+        "params": json.loads(row.params),
+        "status": row.status,
+        "progress": row.progress,
+        "message": row.message,
+        "result": json.loads(row.result) if row.result is not None else None,
+        "error": row.error,
+        "cancel_requested": row.cancel_requested,
+        "created_at": when(row.created_at),
+        "started_at": when(row.started_at),
+        "finished_at": when(row.finished_at),
+    }
+
+
+def _lower_priority() -> None:
+    # Pool processes yield the CPU to the request-serving workers
+    if JOB_NICE and hasattr(os, "nice"):
+        os.nice(JOB_NICE)
+
+
+class Job:
+    """Handle passed to a task: its parameters, progress reporting and the process pool."""
+
+    def __init__(
+        self, runner: "JobRunner", job_id: str, kind: str, params: dict,
+        checkpoint: Any = None, progress_every: float = 0.5,
+    ):
+        self.id = job_id
+        self.kind = kind
+        self.params = params
+        # What the previous run saved before it was requeued, None on a first run
+        self.resume_from = checkpoint
+        self._runner = runner
+        self._progress_every = progress_every
+        self._reported = 0.0
+
+    async def progress(self, done: float, total: Optional[float] = None, message: Optional[str] = None) -> None:
+        """Record progress (done/total, or a fraction); written at most every progress_every seconds."""
+        now = time.monotonic()
+        if now - self._reported < self._progress_every:
+            return
+        self._reported = now
+        fraction = min(done / total, 1.0) if total else done
+        await run_in_threadpool(self._runner.store.progress, self.id, fraction, message)
+
+    async def checkpoint(self, value: Any) -> None:
+        """Save where the task is (JSON); a requeued run gets it back as job.resume_from."""
+        await run_in_threadpool(self._runner.store.save_checkpoint, self.id, value)
+
+    async def uninterrupted(self, awaitable: Awaitable) -> Any:
+        """Await to the end even if the job is cancelled meanwhile, e.g. a commit and its checkpoint."""
+        step = asyncio.ensure_future(awaitable)
+        try:
+            return await asyncio.shield(step)
+        except asyncio.CancelledError:
+            await step
+            raise
+
+    async def cpu(self, fn: Callable, *args) -> Any:
+        """fn(*args) in the process pool; fn and its arguments must be picklable (module-level functions)."""
+        return await asyncio.get_running_loop().run_in_executor(self._runner.pool, fn, *args)
+
+
+class JobRunner:
+    def __init__(
+        self,
+        store: Optional[JobStore] = None,
+        concurrency: int = JOB_CONCURRENCY,
+        processes: int = JOB_PROCESSES,
+        poll: float = 1.0,
+        stale_after: float = 60.0,
+        registry: MetricsRegistry = registry,
+    ):
+        if stale_after < 5 * poll:
+            raise ValueError("stale_after must be at least 5 heartbeat intervals (5 * poll)")
+        self._store = store
+        self.concurrency = concurrency
+        self.processes = processes
+        self.poll = poll
+        self.stale_after = stale_after
+        self.tasks: Dict[str, Task] = {}
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self._running: Dict[str, asyncio.Task] = {}
+        self._background: List[asyncio.Task] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._stopping = False
+        self.finished = registry.counter("jobs_total", "Finished background jobs", ("kind", "status"))
+        registry.gauge("jobs_running", "Background jobs running in this process").set_function(
+            lambda: len(self._running)
+        )
+
+    @property
+    def store(self) -> JobStore:
+        # Opened on first use, so importing the app doesn't create JOBS_DB
+        if self._store is None:
+            self._store = JobStore()
+        return self._store
+
+    def task(self, kind: str) -> Callable[[Task], Task]:
+        def register(fn: Task) -> Task:
+            self.tasks[kind] = fn
+            return fn
+        return register
+
+    async def start(self) -> None:
+        if self._store is None:
+            self._store = await run_in_threadpool(JobStore)
+        self._stopping = False
+        self._wake = asyncio.Event()
+        self.pool = ProcessPoolExecutor(self.processes, initializer=_lower_priority)
+        self._background = [asyncio.create_task(self._dispatch()), asyncio.create_task(self._watch())]
+
+    async def stop(self) -> None:
+        self._stopping = True
+        # Dispatcher first, so nothing claims a job after the running ones are requeued
+        for tasks in (self._background, list(self._running.values())):
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._background = []
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    async def submit(self, kind: str, params: Optional[dict] = None) -> dict:
+        if kind not in self.tasks:
+            raise ValueError(f"unknown job kind {kind!r}")
+        job_id = await run_in_threadpool(self.store.create, kind, params or {})
+        if self._wake is not None:
+            self._wake.set()
+        return await self.get(job_id)
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await run_in_threadpool(self.store.get, job_id)
+
+    async def list(self, status: Optional[str] = None, limit: int = 50) -> List[dict]:
+        return await run_in_threadpool(self.store.list, status, limit)
+
+    async def cancel(self, job_id: str) -> Optional[dict]:
+        status = await run_in_threadpool(self.store.request_cancel, job_id)
+        if status is None:
+            return None
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+        return await self.get(job_id)
+
+    async def _dispatch(self) -> None:
+        slots = asyncio.Semaphore(self.concurrency)
+        while True:
+            await slots.acquire()
+            try:
+                row = await self._claim()
+            except Exception:
+                logger.exception("claiming a job failed")
+                row = None
+            if row is None:
+                slots.release()
+                # submit() wakes us; jobs queued by other workers are found by polling.
+                # Not wait_for(): it can swallow the cancel from stop() when the timeout
+                # fires at the same moment, and stop() then waits forever.
+                wake = asyncio.ensure_future(self._wake.wait())
+                try:
+                    await asyncio.wait([wake], timeout=self.poll)
+                finally:
+                    wake.cancel()
+                self._wake.clear()
+                continue
+            checkpoint = json.loads(row.checkpoint) if row.checkpoint is not None else None
+            task = asyncio.create_task(self._run(row.id, row.kind, json.loads(row.params), checkpoint))
+            self._running[row.id] = task
+
+            def done(_, job_id=row.id):
+                self._running.pop(job_id, None)
+                slots.release()
+
+            task.add_done_callback(done)
+
+    async def _claim(self) -> Optional[sa.Row]:
+        claiming = asyncio.ensure_future(run_in_threadpool(self.store.claim, self.owner))
+        try:
+            return await asyncio.shield(claiming)
+        except asyncio.CancelledError:
+            # stop() while the claim was in flight: a job it took goes back to the queue
+            row = await claiming
+            if row is not None:
+                await run_in_threadpool(self.store.requeue, row.id)
+            raise
+
+    async def _watch(self) -> None:
+        last_stale_check = 0.0
+        while True:
+            await asyncio.sleep(self.poll)
+            try:
+                for job_id in await run_in_threadpool(self.store.heartbeat, list(self._running)):
+                    # Cancelled through another worker
+                    task = self._running.get(job_id)
+                    if task is not None:
+                        task.cancel()
+                if time.monotonic() - last_stale_check > self.stale_after:
+                    last_stale_check = time.monotonic()
+                    await run_in_threadpool(self.store.fail_stale, self.stale_after)
+            except Exception:
+                logger.exception("job heartbeat failed")
+
+    async def _run(self, job_id: str, kind: str, params: dict, checkpoint: Any = None) -> None:
+        result = error = None
+        task = self.tasks.get(kind)
+        try:
+            if task is None:
+                raise LookupError(f"no task registered for {kind!r} in this worker")
+            result = await task(Job(self, job_id, kind, params, checkpoint), params)
+            status = SUCCEEDED
+        except asyncio.CancelledError:
+            if self._stopping:
+                # Not finished, not failed: the next worker picks it up
+                await run_in_threadpool(self.store.requeue, job_id)
+                return
+            status = CANCELLED
+        except Exception as e:
+            logger.exception("job %s (%s) failed", job_id, kind)
+            status, error = FAILED, f"{type(e).__name__}: {e}"
+        await run_in_threadpool(self.store.finish, job_id, status, result, error)
+        self.finished.inc(kind, status)
@@ -0,0 +1,274 @@
+# Pre-fork launcher: N uvicorn workers sharing one listening socket.
+#
+#   python launcher.py sync_db_api:app --workers 4 --port 8001
+#   kill -HUP <launcher pid>     rolling restart, one worker at a time
+#   kill -TERM <launcher pid>    graceful shutdown
+#
+# Each worker runs its own event loop. Inherited engine pools are disposed right
+# after fork (a pooled connection must never be shared between processes) and
+# SQLite engines are switched to WAL so the workers can read concurrently.
+#
+# By default the app is imported in each worker, so a rolling restart picks up
+# new code. --preload imports it once in the launcher and shares the memory.
+
+import argparse
+import importlib
+import os
+import select
+import signal
+import socket
+import sys
+import time
+import traceback
+import weakref
+from typing import Dict, List, Tuple
+
+import uvicorn
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from sqlite_tuning import enable_wal
+
+
+def find_engines() -> List[Engine]:
+    """Module-level engines of everything imported so far (sync engines of async ones)."""
+    engines: Dict[int, Engine] = {}
+    for module in list(sys.modules.values()):
+        for value in list(getattr(module, "__dict__", {}).values()):
+            if isinstance(value, AsyncEngine):
+                value = value.sync_engine
+            if isinstance(value, Engine):
+                engines[id(value)] = value
+    return list(engines.values())
+
+
+_wal_engines: "weakref.WeakSet[Engine]" = weakref.WeakSet()
+
+
+def prepare_engines(after_fork: bool) -> None:
+    for engine in find_engines():
+        if engine not in _wal_engines:
+            enable_wal(engine)
+            _wal_engines.add(engine)
+        if after_fork:
+            # close=False: leave the parent's connections alone, just forget them here
+            engine.dispose(close=False)
+
+
+def load_app(target: str):
+    module_name, _, attribute = target.partition(":")
+    return getattr(importlib.import_module(module_name), attribute or "app")
+
+
+class _WorkerServer(uvicorn.Server):
+    """Tells the launcher through a pipe once the worker's startup has succeeded.
+
+    A failed lifespan startup doesn't raise: uvicorn sets should_exit and
+    returns. The pipe is then closed without a byte, which the launcher reads
+    as a failed start.
+    """
+
+    def __init__(self, config, ready_fd: int):
+        super().__init__(config)
+        self.ready_fd = ready_fd
+
+    async def startup(self, sockets=None):
+        try:
+            await super().startup(sockets=sockets)
+            if not self.should_exit:
+                os.write(self.ready_fd, b"1")
+        finally:
+            os.close(self.ready_fd)
+
+
+class Launcher:
+    def __init__(self, target: str, workers: int, sock: socket.socket, preload: bool, **uvicorn_options):
+        self.target = target
+        self.workers = workers
+        self.sock = sock
+        self.preload = preload
+        self.uvicorn_options = uvicorn_options
+        self.children: Dict[int, int] = {}  # pid -> slot
+        self.stopping = False
+        self.restart_requested = False
+        if preload:
+            self.app = load_app(target)
+            prepare_engines(after_fork=False)
+
+    def spawn(self, slot: int, timeout: float = 30.0) -> Tuple[int, bool]:
+        """(pid, ready); not ready if startup failed or took longer than timeout."""
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # Never return into the launcher's loop from a child
+            status = 0
+            try:
+                os.close(ready_read)
+                self._run_worker(ready_write)
+            except SystemExit as e:
+                # Newer uvicorn exits this way when the lifespan startup fails; it has logged why
+                status = e.code if isinstance(e.code, int) else 1
+            except BaseException:
+                traceback.print_exc()
+                status = 1
+            finally:
+                os._exit(status)
+
+        os.close(ready_write)
+        self.children[pid] = slot
+        readable, _, _ = select.select([ready_read], [], [], timeout)
+        # Closed without a byte: the worker's startup failed or it died
+        ready = bool(readable) and os.read(ready_read, 1) == b"1"
+        os.close(ready_read)
+        if not ready:
+            reason = "failed to start" if readable else f"not ready after {timeout:.0f} s"
+            print(f"[launcher] worker {pid} {reason}", file=sys.stderr)
+        return pid, ready
+
+    def _run_worker(self, ready_fd: int) -> None:
+        # SIGHUP is for the launcher only; uvicorn installs its own SIGTERM/SIGINT handlers
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        app = self.app if self.preload else load_app(self.target)
+        prepare_engines(after_fork=True)
+        config = uvicorn.Config(app, **self.uvicorn_options)
+        _WorkerServer(config, ready_fd).run(sockets=[self.sock])
+
+    def _stop_child(self, pid: int, timeout: float = 30.0) -> None:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            done, _ = os.waitpid(pid, os.WNOHANG)
+            if done:
+                break
+            time.sleep(0.05)
+        else:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.children.pop(pid, None)
+
+    def rolling_restart(self) -> None:
+        # Start each replacement before stopping the old worker, so capacity never drops
+        for pid, slot in list(self.children.items()):
+            new_pid, ready = self.spawn(slot)
+            if not ready:
+                # Keep the old workers serving rather than replace them with a broken build
+                self._stop_child(new_pid)
+                print(f"[launcher] rolling restart aborted, workers: {sorted(self.children)}", file=sys.stderr)
+                return
+            self._stop_child(pid)
+        print(f"[launcher] rolling restart done, workers: {sorted(self.children)}", file=sys.stderr)
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, "stopping", True))
+        signal.signal(signal.SIGINT, lambda *_: setattr(self, "stopping", True))
+        signal.signal(signal.SIGHUP, lambda *_: setattr(self, "restart_requested", True))
+
+        for slot in range(self.workers):
+            self.spawn(slot)
+        print(f"[launcher] {self.workers} workers serving {self.target}", file=sys.stderr)
+
+        while not self.stopping:
+            if self.restart_requested:
+                self.restart_requested = False
+                self.rolling_restart()
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid and pid in self.children:
+                # Crashed worker: replace it in the same slot, without spinning on a crash loop
+                slot = self.children.pop(pid)
+                print(f"[launcher] worker {pid} exited, respawning", file=sys.stderr)
+                time.sleep(1.0)
+                self.spawn(slot)
+            time.sleep(0.2)
+
+        for pid in list(self.children):
+            os.kill(pid, signal.SIGTERM)
+        for pid in list(self.children):
+            self._stop_child(pid)
+
+
+def bind_socket(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # Accepted sockets inherit this; without it the separate header/body writes hit
+    # Nagle + delayed ACK (~40 ms per keep-alive request)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _client(args) -> int:
+    import http.client
+
+    host, port, path, duration = args
+    done = 0
+    deadline = time.monotonic() + duration
+    conn = http.client.HTTPConnection(host, port)
+    while time.monotonic() < deadline:
+        conn.request("GET", path)
+        conn.getresponse().read()
+        done += 1
+    conn.close()
+    return done
+
+
+def benchmark(target: str, max_workers: int, path: str, clients: int, duration: float, port: int) -> None:
+    """Throughput for 1..max_workers workers, driven by `clients` keep-alive client processes."""
+    import multiprocessing
+    import subprocess
+    import urllib.request
+
+    counts = sorted({1, *[n for n in (2, 4, 8, 16, 32) if n < max_workers], max_workers})
+    for workers in counts:
+        proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), target, "--workers", str(workers),
+             "--port", str(port), "--log-level", "warning"],
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            for _ in range(100):
+                try:
+                    urllib.request.urlopen(f"http://127.0.0.1:{port}{path}").read()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            with multiprocessing.Pool(clients) as pool:
+                total = sum(pool.map(_client, [("127.0.0.1", port, path, duration)] * clients))
+            print(f"{workers:>3} workers: {total / duration:9.0f} req/s")
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            proc.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-fork uvicorn launcher")
+    parser.add_argument("target", help="module:attribute of the ASGI app, e.g. sync_db_api:app")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--preload", action="store_true", help="import the app once before forking")
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--bench", action="store_true", help="measure throughput from 1 to --workers workers")
+    parser.add_argument("--bench-path", default="/items")
+    parser.add_argument("--bench-clients", type=int, default=(os.cpu_count() or 1) * 2)
+    parser.add_argument("--bench-seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.getcwd())
+    if args.bench:
+        benchmark(args.target, args.workers, args.bench_path, args.bench_clients, args.bench_seconds, args.port)
+    else:
+        Launcher(
+            args.target,
+            args.workers,
+            bind_socket(args.host, args.port),
+            args.preload,
+            log_level=args.log_level,
+        ).run()
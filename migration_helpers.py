@@ -0,0 +1,151 @@
+# Online backfills for Alembic migrations on large tables.
+#
+# op.add_column(...) followed by one big UPDATE holds the write lock for the
+# whole table. backfill() walks the table in primary-key order and updates one
+# chunk per transaction, sleeping between chunks so application writes can get
+# in. After every chunk the last key is saved in a checkpoint table, so an
+# interrupted migration resumes where it stopped instead of starting over.
+#
+#   from migration_helpers import add_column_with_backfill, backfill
+#
+#   def upgrade():
+#       add_column_with_backfill(
+#           op, "requests", sa.Column("group", sa.String(), nullable=True), sa.literal("general"),
+#           chunk_size=5000, pause=0.05,
+#       )
+#       # or, for an existing column, only the rows still missing a value
+#       backfill(op, "items", {"is_active": sa.true()}, where=sa.column("is_active").is_(None))
+#
+# At most the chunk in flight when the process died is applied twice, so the
+# values must be idempotent (constants or expressions of other columns).
+
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+import sqlalchemy as sa
+
+logger = logging.getLogger("alembic.backfill")
+
+CHECKPOINT_TABLE = "migration_checkpoints"
+
+checkpoints = sa.table(
+    CHECKPOINT_TABLE,
+    sa.column("name"),
+    sa.column("last_key"),
+    sa.column("rows_done"),
+    sa.column("updated_at"),
+)
+
+
+@contextmanager
+def _connection(bind):
+    """Yield a connection on which every statement commits on its own."""
+    if hasattr(bind, "get_context"):
+        # alembic.op: leave the migration transaction for the duration of the backfill
+        with bind.get_context().autocommit_block():
+            yield bind.get_bind()
+    elif isinstance(bind, sa.engine.Engine):
+        with bind.connect() as conn:
+            yield conn.execution_options(isolation_level="AUTOCOMMIT")
+    else:
+        yield bind.execution_options(isolation_level="AUTOCOMMIT")
+
+
+def _ensure_checkpoint_table(conn) -> None:
+    conn.execute(
+        sa.text(
+            f"CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} ("
+            "name VARCHAR(128) PRIMARY KEY, last_key BIGINT, rows_done BIGINT, updated_at TIMESTAMP)"
+        )
+    )
+
+
+def _load_checkpoint(conn, name: str):
+    row = conn.execute(
+        sa.select(checkpoints.c.last_key, checkpoints.c.rows_done).where(checkpoints.c.name == name)
+    ).first()
+    return (row.last_key, row.rows_done) if row else (None, 0)
+
+
+def _save_checkpoint(conn, name: str, last_key, rows_done: int, exists: bool) -> None:
+    values = {"last_key": last_key, "rows_done": rows_done, "updated_at": sa.func.current_timestamp()}
+    if exists:
+        conn.execute(sa.update(checkpoints).where(checkpoints.c.name == name).values(**values))
+    else:
+        conn.execute(sa.insert(checkpoints).values(name=name, **values))
+
+
+def backfill(
+    bind,
+    table_name: str,
+    values: Dict[str, Any],
+    *,
+    key: str = "id",
+    where: Optional[sa.ColumnElement] = None,
+    name: Optional[str] = None,
+    chunk_size: int = 1000,
+    pause: float = 0.0,
+    progress: Optional[Callable[[int, Any], None]] = None,
+) -> int:
+    """Update `values` on every row of `table_name` in keyset-ordered chunks.
+
+    `bind` is alembic's `op`, an Engine or a Connection. Returns the number of
+    rows updated, including the ones done before a resume.
+    """
+    name = name or f"backfill:{table_name}:{','.join(sorted(values))}"
+    table = sa.table(table_name, sa.column(key), *(sa.column(column) for column in values))
+    key_column = table.c[key]
+
+    with _connection(bind) as conn:
+        _ensure_checkpoint_table(conn)
+        last_key, rows_done = _load_checkpoint(conn, name)
+        has_checkpoint = last_key is not None
+        if has_checkpoint:
+            logger.info("Resuming backfill %s after %s=%s (%d rows done)", name, key, last_key, rows_done)
+
+        while True:
+            window = sa.true() if last_key is None else key_column > last_key
+            if where is not None:
+                window = sa.and_(window, where)
+
+            keys = conn.execute(
+                sa.select(key_column).where(window).order_by(key_column).limit(chunk_size)
+            ).scalars().all()
+            if not keys:
+                break
+
+            upper = keys[-1]
+            result = conn.execute(sa.update(table).where(window, key_column <= upper).values(**values))
+            rows_done += result.rowcount
+            last_key = upper
+            _save_checkpoint(conn, name, last_key, rows_done, has_checkpoint)
+            has_checkpoint = True
+
+            logger.info("Backfill %s: %d rows, up to %s=%s", name, rows_done, key, last_key)
+            if progress is not None:
+                progress(rows_done, last_key)
+            if len(keys) < chunk_size:
+                break
+            if pause:
+                time.sleep(pause)
+
+        conn.execute(sa.delete(checkpoints).where(checkpoints.c.name == name))
+    return rows_done
+
+
+def add_column_with_backfill(op, table_name: str, column: sa.Column, value: Any, **backfill_options) -> int:
+    """Add a nullable column (cheap, no table rewrite) and fill it chunk by chunk.
+
+    The backfill commits the new column, so a rerun after an interruption
+    finds it already there and goes straight on to the checkpoint.
+    """
+    if not column.nullable:
+        raise ValueError("Add the column as nullable; tighten it with op.alter_column once backfilled")
+    existing = {info["name"] for info in sa.inspect(op.get_bind()).get_columns(table_name)}
+    if column.name in existing:
+        logger.info("Column %s.%s already exists, resuming its backfill", table_name, column.name)
+    else:
+        op.add_column(table_name, column)
+    return backfill(op, table_name, {column.name: value}, **backfill_options)
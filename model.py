@@ -1,5 +1,8 @@
 from sqlalchemy import TIMESTAMP, Column, Integer, String, Table, ForeignKey, case, func, select, text
 from sqlalchemy.orm import relationship, declarative_base, joinedload, load_only
+from counters import FacetCounts, TableVersions
+from graph import RequestGraph
+from summaries import RequestSummaries
 
 Base = declarative_base()
 
@@ -18,23 +21,47 @@ class Request(Base):
     name = Column(String, nullable=False)
     description = Column(String)
     group=Column(String, nullable=True)
+    # Bumped on every UPDATE; flushes and If-Match updates check it (see versioning.py)
+    version = Column(Integer, nullable=False, server_default="1")
     trainings = relationship("Training", secondary=request_training, back_populates="requests")
 
+    __mapper_args__ = {"version_id_col": version}
+
 class Training(Base):
     __tablename__ = "trainings"
     
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, nullable=False)
     duration = Column(Integer)
+    version = Column(Integer, nullable=False, server_default="1")
     requests = relationship("Request", secondary=request_training, back_populates="trainings")
 
+    __mapper_args__ = {"version_id_col": version}
+
+# Request totals and counts per group, kept by triggers (see counters.py)
+facets = FacetCounts(Base.metadata)
+facets.track(Request.__table__, "group")
+
+# GET /requests/ payload, pre-serialized per request (see summaries.py)
+summaries = RequestSummaries(Base.metadata)
+
+# Write counters per table, the cache key of the analytics results (see analytics.py)
+versions = TableVersions(Base.metadata)
+versions.track("requests", "trainings", "request_training")
+
+# In-memory adjacency snapshot of request_training for similarity queries (see graph.py)
+graph = RequestGraph(Base.metadata)
+
 
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlite_tuning import enable_savepoints
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./relation.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
+# POST /batch runs each operation in a SAVEPOINT (see batch.py)
+enable_savepoints(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
\ No newline at end of file
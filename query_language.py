@@ -0,0 +1,289 @@
+# Filter and sort query parameters compiled to one parameterized statement.
+#
+#   GET /items?filter=and(eq(is_active,true),or(prefix(name,ab),in(id,1,2,3)))&sort=-created_at&limit=50
+#
+#   eq(column, value)          in(column, v1, v2, ...)
+#   range(column, low, high)   either bound may be empty: range(id,100,) is id >= 100
+#   prefix(column, text)       compiled to text <= column < next(text), which can use
+#                              an index (LIKE 'text%' can't in SQLite)
+#
+# Timestamps are bound as text in SQLite's storage format ("YYYY-MM-DD
+# HH:MM:SS", UTC, as CURRENT_TIMESTAMP writes them), so eq() matches the value
+# the API returned and range() bounds compare correctly.
+#   and(...), or(...), not(x)
+#
+# Values containing , ( ) or spaces go in double quotes: eq(name,"a, b"). Only
+# allowlisted columns and operators are accepted. Sorting (sort=col,-col) on a
+# column without an index needs a limit, so nobody can ask for a full-table
+# sort. Statements are cached per shape (the expression with its values taken
+# out), so a repeated shape skips both building and compiling.
+
+import re
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import Boolean, DateTime, Integer, String, and_, bindparam, inspect, not_, or_, select
+
+LEAF_OPS = ("eq", "in", "range", "prefix")
+
+# Deeper and()/or()/not() nesting is rejected before it can exhaust the stack
+MAX_DEPTH = 32
+
+_TOKEN = re.compile(r'\s*(?:(?P<punct>[(),])|"(?P<quoted>(?:[^"\\]|\\.)*)"|(?P<bare>[^(),"]+))')
+
+
+class QueryError(ValueError):
+    pass
+
+
+def _tokenize(text: str) -> List[Tuple[str, str]]:
+    tokens, position = [], 0
+    text = text.strip()
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if match is None:
+            raise QueryError(f"unexpected character at {position}: {text[position:position + 10]!r}")
+        if match.group("punct"):
+            tokens.append(("punct", match.group("punct")))
+        elif match.group("quoted") is not None:
+            tokens.append(("value", re.sub(r"\\(.)", r"\1", match.group("quoted"))))
+        else:
+            tokens.append(("value", match.group("bare").strip()))
+        position = match.end()
+    return tokens
+
+
+def parse(text: str):
+    """('and'|'or', [nodes]) / ('not', node) / (op, column, [values])."""
+    tokens = _tokenize(text)
+    position = 0
+
+    def expect(value):
+        nonlocal position
+        if position >= len(tokens) or tokens[position] != ("punct", value):
+            raise QueryError(f"expected {value!r}")
+        position += 1
+
+    def arguments() -> List:
+        # Raw values up to the closing parenthesis; empty ones are kept (open range bounds)
+        nonlocal position
+        values = [""]
+        while position < len(tokens) and tokens[position] != ("punct", ")"):
+            kind, value = tokens[position]
+            if (kind, value) == ("punct", ","):
+                values.append("")
+            elif kind == "punct":
+                raise QueryError("nested expression inside a comparison")
+            else:
+                values[-1] = value
+            position += 1
+        return values
+
+    def node(depth=1):
+        nonlocal position
+        if depth > MAX_DEPTH:
+            raise QueryError(f"expression nested deeper than {MAX_DEPTH} levels")
+        if position >= len(tokens) or tokens[position][0] != "value":
+            raise QueryError("expected an operator")
+        op = tokens[position][1].lower()
+        position += 1
+        expect("(")
+        if op in ("and", "or", "not"):
+            children = [node(depth + 1)]
+            while position < len(tokens) and tokens[position] == ("punct", ","):
+                position += 1
+                children.append(node(depth + 1))
+            expect(")")
+            if op == "not":
+                if len(children) != 1:
+                    raise QueryError("not() takes one expression")
+                return ("not", children[0])
+            return (op, children)
+        if op not in LEAF_OPS:
+            raise QueryError(f"unknown operator {op!r}")
+        column, *values = arguments()
+        expect(")")
+        return (op, column, values)
+
+    tree = node()
+    if position != len(tokens):
+        raise QueryError("trailing input after the expression")
+    return tree
+
+
+def _convert(column, raw: str):
+    python_type = column.type
+    try:
+        if isinstance(python_type, Boolean):
+            lowered = raw.lower()
+            if lowered not in ("true", "false", "1", "0"):
+                raise ValueError(raw)
+            return lowered in ("true", "1")
+        if isinstance(python_type, Integer):
+            return int(raw)
+        if isinstance(python_type, DateTime):
+            value = datetime.fromisoformat(raw)
+            if value.tzinfo is not None:
+                value = value.astimezone(timezone.utc).replace(tzinfo=None)
+            # Microseconds only when given, as SQLAlchemy would write them
+            return value.isoformat(sep=" ")
+    except ValueError:
+        raise QueryError(f"invalid value {raw!r} for {column.key}") from None
+    return raw
+
+
+def _next_prefix(prefix: str) -> Optional[str]:
+    """Smallest string greater than every string starting with prefix; None if there is none."""
+    # Nothing sorts after U+10FFFF, so those characters can't be incremented
+    prefix = prefix.rstrip("\U0010ffff")
+    if not prefix:
+        return None
+    code = ord(prefix[-1]) + 1
+    if 0xD800 <= code <= 0xDFFF:
+        # Surrogates can't be encoded for the driver
+        code = 0xE000
+    return prefix[:-1] + chr(code)
+
+
+class QueryLanguage:
+    def __init__(self, model, allow: Dict[str, Iterable[str]], max_limit: int = 1000):
+        self.model = model
+        self.allow = {column: set(ops) for column, ops in allow.items()}
+        self.max_limit = max_limit
+        table = inspect(model).local_table
+        self.columns = {name: table.c[name] for name in self.allow}
+        # Columns an index can serve: primary key and first column of every index
+        self.indexed = {column.name for column in table.primary_key.columns}
+        self.indexed.update(column.name for column in table.columns if column.index)
+        self.indexed.update(next(iter(index.columns)).name for index in table.indexes)
+        self._statement = lru_cache(maxsize=256)(self._build)
+
+    def _check(self, op: str, column: str):
+        if column not in self.allow:
+            raise QueryError(f"filtering on {column!r} is not allowed")
+        if op not in self.allow[column]:
+            raise QueryError(f"{op}() is not allowed on {column!r}")
+        return self.columns[column]
+
+    def _shape(self, tree, params: List) -> str:
+        """Shape string of the tree; appends converted values to params in order."""
+        op = tree[0]
+        if op in ("and", "or"):
+            return f"{op}(" + ",".join(self._shape(child, params) for child in tree[1]) + ")"
+        if op == "not":
+            return f"not({self._shape(tree[1], params)})"
+        _, name, values = tree
+        column = self._check(op, name)
+        if op == "eq":
+            if len(values) != 1 or values[0] == "":
+                raise QueryError("eq() takes one value")
+            params.append(_convert(column, values[0]))
+            return f"eq({name})"
+        if op == "in":
+            if not values or "" in values:
+                raise QueryError("in() takes one or more values")
+            # One expanding parameter, so the shape doesn't depend on the list length
+            params.append([_convert(column, value) for value in values])
+            return f"in({name})"
+        if op == "range":
+            if len(values) != 2 or values == ["", ""]:
+                raise QueryError("range() takes a low and a high bound, one may be empty")
+            bounds = "".join("1" if value != "" else "0" for value in values)
+            params.extend(_convert(column, value) for value in values if value != "")
+            return f"range({name},{bounds})"
+        if len(values) != 1 or values[0] == "":
+            raise QueryError("prefix() takes one value")
+        upper = _next_prefix(values[0])
+        params.append(values[0])
+        if upper is None:
+            return f"prefix({name},0)"
+        params.append(upper)
+        return f"prefix({name})"
+
+    def _clause(self, shape: str, counter: List[int]):
+        # Rebuilds the expression from its shape string, numbering the parameters
+        def param(column, expanding=False):
+            counter[0] += 1
+            # Timestamps arrive as text in the storage format (see _convert)
+            type_ = String() if isinstance(column.type, DateTime) else None
+            return bindparam(f"p{counter[0] - 1}", expanding=expanding, type_=type_)
+
+        def build(node):
+            op = node[0]
+            if op in ("and", "or"):
+                return (and_ if op == "and" else or_)(*(build(child) for child in node[1]))
+            if op == "not":
+                return not_(build(node[1]))
+            _, name, values = node
+            column = self.columns[name]
+            if op == "eq":
+                return column == param(column)
+            if op == "in":
+                return column.in_(param(column, expanding=True))
+            if op == "range":
+                low, high = values[0] if values else "11"
+                conditions = []
+                if low == "1":
+                    conditions.append(column >= param(column))
+                if high == "1":
+                    conditions.append(column <= param(column))
+                return and_(*conditions)
+            if values == ["0"]:
+                # prefix of U+10FFFF characters: no upper bound
+                return column >= param(column)
+            return and_(column >= param(column), column < param(column))
+
+        return build(parse(shape))
+
+    def _build(self, filter_shape: Optional[str], sort: Tuple[str, ...], limited: bool):
+        statement = select(self.model)
+        counter = [0]
+        if filter_shape:
+            statement = statement.where(self._clause(filter_shape, counter))
+        order = []
+        for key in sort:
+            column = self.columns[key.lstrip("-")]
+            order.append(column.desc() if key.startswith("-") else column.asc())
+        # Primary key as the tie breaker keeps pages stable
+        primary_key = list(inspect(self.model).local_table.primary_key.columns)[0]
+        if sort and primary_key.name not in {key.lstrip("-") for key in sort}:
+            order.append(primary_key.asc())
+        if order:
+            statement = statement.order_by(*order)
+        if limited:
+            statement = statement.limit(bindparam("limit"))
+        return statement
+
+    def ordering(self, sort_text: Optional[str]) -> List[Tuple[str, bool]]:
+        """[(column, descending), ...] the compiled statement orders by, tie breaker included."""
+        order = [(key.strip().lstrip("-"), key.strip().startswith("-")) for key in (sort_text or "").split(",") if key.strip()]
+        primary_key = list(inspect(self.model).local_table.primary_key.columns)[0].name
+        if order and primary_key not in {name for name, _ in order}:
+            order.append((primary_key, False))
+        return order
+
+    def compile(
+        self, filter_text: Optional[str] = None, sort_text: Optional[str] = None, limit: Optional[int] = None
+    ):
+        """(statement, params) for the query parameters; raises QueryError for bad input."""
+        params: List = []
+        shape = self._shape(parse(filter_text), params) if filter_text else None
+
+        sort: Tuple[str, ...] = ()
+        if sort_text:
+            sort = tuple(key.strip() for key in sort_text.split(",") if key.strip())
+            for key in sort:
+                name = key.lstrip("-")
+                if name not in self.allow:
+                    raise QueryError(f"sorting on {name!r} is not allowed")
+                if name not in self.indexed and limit is None:
+                    raise QueryError(f"{name!r} has no index; sorting on it needs a limit")
+        if limit is not None and not 0 < limit <= self.max_limit:
+            raise QueryError(f"limit must be between 1 and {self.max_limit}")
+
+        statement = self._statement(shape, sort, limit is not None)
+        values = {f"p{i}": value for i, value in enumerate(params)}
+        if limit is not None:
+            values["limit"] = limit
+        return statement, values
@@ -30,12 +30,15 @@ class Training(Base):
 
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlite_tuning import enable_savepoints
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./relation.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
+# POST /batch runs each operation in a SAVEPOINT (see batch.py)
+enable_savepoints(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Create tables
@@ -63,9 +66,31 @@ class RequestCreate(RequestBase):
    
 from fastapi import FastAPI, Depends, HTTPException
 from sqlalchemy.orm import Session
+from admission import AdmissionMiddleware
+from compression import CompressionMiddleware
+from profiler import ProfilerMiddleware
+from idempotency import IdempotencyMiddleware
+from singleflight import SingleFlightMiddleware
+from metrics import instrument_app
+from statements import request_statements, training_statements, track_compiled_cache
+from index_advisor import record_from_env
+from batch import Batcher
 from typing import List
 
 app = FastAPI()
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(SingleFlightMiddleware, paths=("/requests/",))
+app.add_middleware(IdempotencyMiddleware, paths=("/requests/", "/trainings/", "/batch"))
+app.add_middleware(CompressionMiddleware)
+# X-Profile: $PROFILE_TOKEN profiles one request; PROFILE_SAMPLE_RATE profiles at random (see profiler.py)
+app.add_middleware(ProfilerMiddleware)
+instrument_app(app, engine)
+track_compiled_cache(engine)
+# RECORD_STATEMENTS=statements.json feeds index_advisor.py
+record_from_env(engine)
+
+request_stmts = request_statements(Request, Training)
+training_stmts = training_statements(Training)
 
 # Database connection dependency
 def get_db():
@@ -75,6 +100,9 @@ def get_db():
     finally:
         db.close()
 
+# POST /batch: several of the operations below in one call and one transaction
+batch = Batcher(app, engine, SessionLocal, get_db)
+
 @app.post("/trainings/")
 def create_training(training: TrainingCreate, db: Session = Depends(get_db)):
     db_training = Training(**training.model_dump())
@@ -93,8 +121,8 @@ def create_request(request: RequestCreate, db: Session = Depends(get_db)):
 
 @app.post("/requests/{request_id}/trainings/{training_id}")
 def associate_request_training(request_id: int, training_id: int, db: Session = Depends(get_db)):
-    request = db.query(Request).filter(Request.id == request_id).first()
-    training = db.query(Training).filter(Training.id == training_id).first()
+    request = db.scalars(request_stmts.by_id, {"request_id": request_id}).first()
+    training = db.scalars(training_stmts.by_id, {"training_id": training_id}).first()
     
     if not request or not training:
         raise HTTPException(status_code=404, detail="Request or Training not found")
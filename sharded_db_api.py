@@ -0,0 +1,169 @@
+from contextlib import asynccontextmanager
+from datetime import datetime
+import asyncio
+from typing import Optional
+from fastapi import FastAPI, Header, HTTPException, Response
+from sqlalchemy import Boolean, Integer, String, TIMESTAMP, func
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Mapped, mapped_column
+from pydantic import BaseModel
+from admission import AdmissionMiddleware
+from compression import CompressionMiddleware
+from profiler import ProfilerMiddleware
+from metrics import instrument_app
+from statements import item_statements
+from startup import prepare_database
+from sharding import ShardRouter
+from query_language import QueryError, QueryLanguage
+from projection import Projection, ProjectionError
+from versioning import ANY, etag, parse_if_match
+
+# Items spread over ITEM_SHARDS SQLite files (see sharding.py), same API shape as async_db_api
+shards = ShardRouter()
+
+Base = declarative_base()
+
+MAX_LIMIT = 1000
+# Every shard returns offset + limit rows for the merge; deeper pages should
+# filter on the sort key instead (filter=range(id,1234,))
+MAX_OFFSET = 1000
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Every shard gets the same schema; shards are created here, not by Alembic
+    await asyncio.gather(*(prepare_database(engine, Base.metadata, alembic_ini=None) for engine in shards.engines))
+    yield
+    await shards.dispose()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(CompressionMiddleware)
+# X-Profile: $PROFILE_TOKEN profiles one request; PROFILE_SAMPLE_RATE profiles at random (see profiler.py)
+app.add_middleware(ProfilerMiddleware)
+instrument_app(app, *shards.engines)
+
+class Item(Base):
+    __tablename__ = "items"
+
+    # Assigned by the shard's INSERT (shards.next_id), id % ITEM_SHARDS is the shard;
+    # AUTOINCREMENT keeps ids of deleted rows from coming back
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True, autoincrement=False)
+    name: Mapped[str] = mapped_column(String, index=True)
+    description: Mapped[Optional[str]] = mapped_column(String)
+    is_active: Mapped[bool] = mapped_column(Boolean)
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP, server_default=func.now())
+    version: Mapped[int] = mapped_column(Integer, nullable=False, server_default="1")
+
+    __mapper_args__ = {"eager_defaults": True, "version_id_col": version}
+
+stmts = item_statements(Item)
+
+item_queries = QueryLanguage(
+    Item,
+    allow={
+        "id": ("eq", "in", "range"),
+        "name": ("eq", "in", "prefix", "range"),
+        "is_active": ("eq",),
+        "created_at": ("eq", "range"),
+    },
+    # The endpoint checks limit and offset separately; shards are asked for both
+    max_limit=MAX_LIMIT + MAX_OFFSET,
+)
+
+# ?fields=id,name: plain rows serialized straight to JSON, no ORM objects (see projection.py)
+item_projection = Projection(Item)
+
+class ItemCreate(BaseModel):
+    name: str
+    description: str
+
+class ItemUpdate(BaseModel):
+    name: Optional[str] = None
+    description: Optional[str] = None
+    is_active: Optional[bool] = None
+
+# Scatter/gather: every shard runs the same ordered, limited statement, results are k-way merged
+@app.get("/items")
+async def read_items(
+    filter: Optional[str] = None,
+    sort: str = "id",
+    limit: int = 100,
+    offset: int = 0,
+    fields: Optional[str] = None,
+):
+    if not 0 < limit <= MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_LIMIT}")
+    if not 0 <= offset <= MAX_OFFSET:
+        raise HTTPException(status_code=400, detail=f"offset must be between 0 and {MAX_OFFSET}")
+    try:
+        statement, params = item_queries.compile(filter, sort, limit + offset)
+        names = item_projection.parse(fields) if fields is not None else None
+    except (QueryError, ProjectionError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    order = item_queries.ordering(sort)
+    if names is None:
+        return await shards.gather(statement, params, order, limit, offset)
+    # The merge needs the sort columns; they are selected but not sent
+    statement = item_projection.select(statement, names, tuple(name for name, _ in order))
+    return item_projection.response(await shards.gather(statement, params, order, limit, offset, rows=True), names)
+
+@app.get("/items/count")
+async def count_items(filter: Optional[str] = None):
+    try:
+        statement, params = item_queries.compile(filter)
+    except QueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"count": await shards.count_rows(statement, params)}
+
+@app.post("/itemscreate")
+async def create_item(item: ItemCreate, x_tenant: Optional[str] = Header(None)):
+    # Same tenant, same shard; without one new items are spread round robin
+    shard = shards.for_key(x_tenant)
+    async with shards.session(shard) as db:
+        new_item = Item(**item.model_dump(), is_active=True)
+        new_item.id = shards.next_id(Item, shard)
+        db.add(new_item)
+        await db.commit()
+        return new_item
+
+@app.get("/items/{item_id}")
+async def read_item(item_id: int, response: Response):
+    async with shards.session(shards.for_id(item_id)) as db:
+        item = (await db.scalars(stmts.by_id, {"item_id": item_id})).first()
+    if item is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    response.headers["ETag"] = etag(item.version)
+    return item
+
+@app.put("/items/{item_id}")
+async def update_item(item_id: int, item: ItemUpdate, response: Response, if_match: Optional[str] = Header(None)):
+    versions = parse_if_match(if_match) if if_match is not None else ANY
+    params = {"item_id": item_id, **item.model_dump(exclude_unset=True)}
+    async with shards.session(shards.for_id(item_id)) as db:
+        if versions is ANY:
+            updated_item = (await db.scalars(stmts.update_returning, params)).first()
+        else:
+            updated_item = (await db.scalars(stmts.update_if_version, {**params, "versions": versions})).first()
+        if updated_item is None:
+            if versions is ANY or (await db.scalars(stmts.by_id, params)).first() is None:
+                raise HTTPException(status_code=404, detail="Item not found")
+            raise HTTPException(status_code=412, detail="Item was modified since it was read")
+        await db.commit()
+    response.headers["ETag"] = etag(updated_item.version)
+    return updated_item
+
+@app.delete("/items/{item_id}")
+async def delete_item(item_id: int):
+    async with shards.session(shards.for_id(item_id)) as db:
+        result = await db.execute(stmts.delete_by_id, {"item_id": item_id})
+        if result.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Item not found")
+        await db.commit()
+    return {"message": f"Item {item_id} deleted successfully"}
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=8002)
@@ -0,0 +1,137 @@
+# Hash-sharded storage: N SQLite files, one engine each.
+#
+#   shards = ShardRouter("sqlite+aiosqlite:///./items_shard_{}.db", count=4)
+#   shard = shards.for_key(tenant)                      # new rows
+#   item.id = shards.next_id(Item, shard)               # ids encode their shard
+#   async with shards.session(shards.for_id(item_id)) as db:   # point operations
+#       ...
+#   items = await shards.gather(statement, params, order=[("name", False), ("id", False)], limit=50)
+#   total = await shards.count_rows(statement, params)
+#
+# SQLite has one writer per file, so every shard adds a writer. New rows go to
+# the shard picked by a stable hash of the tenant key (round robin without one)
+# and get an id with id % count == shard, assigned inside the INSERT itself
+# (highest id so far + count), so reads, updates and deletes by id route with
+# no lookup. The shard count is part of every id: changing it means moving rows.
+#
+# The sharded table must be created with sqlite_autoincrement=True: its
+# sqlite_sequence entry remembers the highest id ever used, so deleting the
+# newest row doesn't hand its id out again.
+#
+# Lists, searches and counts run on all shards concurrently (asyncio.gather).
+# Each shard returns its rows already ordered and limited; a k-way merge
+# (heapq.merge) of the sorted streams gives the global order, so a page of
+# `limit` rows never needs more than `limit` rows from any one shard.
+
+import asyncio
+import hashlib
+import heapq
+import itertools
+import os
+from typing import Any, Awaitable, Callable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import column, func, select, table
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+ITEM_SHARDS = int(os.getenv("ITEM_SHARDS", "4"))
+SHARD_URL = os.getenv("SHARD_URL", "sqlite+aiosqlite:///./items_shard_{}.db")
+
+Order = Sequence[Tuple[str, bool]]
+
+sqlite_sequence = table("sqlite_sequence", column("name"), column("seq"))
+
+
+def stable_hash(key: str) -> int:
+    # hash() is salted per process; shards must agree across workers and restarts
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class _Descending:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def sort_key(order: Order) -> Callable[[Any], tuple]:
+    """Python key matching ORDER BY on `order`; NULLs first, as SQLite sorts them."""
+    def key(row):
+        parts = []
+        for name, descending in order:
+            value = getattr(row, name)
+            part = (value is not None, value)
+            parts.append(_Descending(part) if descending else part)
+        return tuple(parts)
+    return key
+
+
+class ShardRouter:
+    def __init__(self, url: str = SHARD_URL, count: int = ITEM_SHARDS, **engine_options):
+        self.count = count
+        self.engines = [create_async_engine(url.format(shard), **engine_options) for shard in range(count)]
+        self.sessionmakers = [async_sessionmaker(engine, expire_on_commit=False) for engine in self.engines]
+        self._round_robin = itertools.count()
+
+    def for_id(self, id: int) -> int:
+        return id % self.count
+
+    def for_key(self, key: Optional[str] = None) -> int:
+        if key is None:
+            return next(self._round_robin) % self.count
+        return stable_hash(key) % self.count
+
+    def next_id(self, model, shard: int):
+        """SQL expression for the id of a new row on `shard`; assign it to the primary key before the flush."""
+        highest_ever = select(sqlite_sequence.c.seq).where(sqlite_sequence.c.name == model.__tablename__)
+        highest_now = select(func.max(model.id))
+        # Two-argument max() is SQLite's scalar max; max(id) covers rows inserted before AUTOINCREMENT
+        return select(
+            func.max(
+                func.coalesce(highest_ever.scalar_subquery(), shard),
+                func.coalesce(highest_now.scalar_subquery(), shard),
+            ) + self.count
+        ).scalar_subquery()
+
+    def session(self, shard: int) -> AsyncSession:
+        return self.sessionmakers[shard]()
+
+    async def scatter(self, operation: Callable[[AsyncSession], Awaitable[Any]]) -> List[Any]:
+        """Run operation(session) on every shard concurrently; results in shard order."""
+        async def run(shard):
+            async with self.session(shard) as db:
+                return await operation(db)
+
+        return await asyncio.gather(*(run(shard) for shard in range(self.count)))
+
+    async def gather(
+        self, statement, params: dict, order: Order, limit: int, offset: int = 0, rows: bool = False
+    ) -> List[Any]:
+        """ORM objects (or with rows=True, Row tuples) of an ordered statement from all shards, merged in order.
+
+        The statement must already ORDER BY `order` and LIMIT to offset + limit,
+        and select the `order` columns.
+        """
+        async def fetch(db):
+            result = await db.execute(statement, params)
+            return result.all() if rows else result.scalars().all()
+
+        per_shard = await self.scatter(fetch)
+        merged = heapq.merge(*per_shard, key=sort_key(order))
+        return list(itertools.islice(merged, offset, offset + limit))
+
+    async def count_rows(self, statement, params: Optional[dict] = None) -> int:
+        counted = select(func.count()).select_from(statement.order_by(None).limit(None).subquery())
+
+        async def fetch(db):
+            return (await db.execute(counted, params or {})).scalar()
+
+        return sum(await self.scatter(fetch))
+
+    async def dispose(self) -> None:
+        await asyncio.gather(*(engine.dispose() for engine in self.engines))
@@ -0,0 +1,139 @@
+# Single-flight coalescing for expensive GETs.
+#
+#   app.add_middleware(SingleFlightMiddleware, paths=("/items",), window=0.05)
+#
+# Concurrent identical GETs (same path, same query parameters in any order)
+# run the handler once: the first request is the leader, the others await it
+# and are answered with a copy of its status, headers and body bytes. With
+# `window` > 0 a successful response keeps being served for that many seconds
+# after it finished. Requests carrying credentials are never shared.
+#
+# Add it after AdmissionMiddleware (followers never take an admission slot) and
+# before CompressionMiddleware, so the shared bytes are the uncompressed ones
+# and every follower still gets its own Accept-Encoding.
+
+import asyncio
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+from metrics import MetricsRegistry, registry
+
+SINGLE_FLIGHT_WINDOW_MS = float(os.getenv("SINGLE_FLIGHT_WINDOW_MS", "0"))
+
+PRIVATE_HEADERS = (b"authorization", b"cookie")
+
+Key = Tuple[str, str]
+
+
+def request_key(scope) -> Key:
+    query = scope.get("query_string", b"").decode("latin-1")
+    return scope["path"], urlencode(sorted(parse_qsl(query, keep_blank_values=True)))
+
+
+class _Flight:
+    __slots__ = ("done", "messages", "finished_at")
+
+    def __init__(self):
+        self.done = asyncio.Event()
+        # None until the leader finished successfully
+        self.messages: Optional[List[dict]] = None
+        self.finished_at = 0.0
+
+
+class SingleFlightMiddleware:
+    """Pure ASGI; the leader streams to its own client while the copy is recorded."""
+
+    def __init__(
+        self,
+        app,
+        paths: Iterable[str] = ("/items", "/requests/"),
+        window: float = SINGLE_FLIGHT_WINDOW_MS / 1000,
+        max_bytes: int = 8 * 1024 * 1024,
+        registry: MetricsRegistry = registry,
+    ):
+        self.app = app
+        self.paths = frozenset(paths)
+        self.window = window
+        self.max_bytes = max_bytes
+        self.flights: Dict[Key, _Flight] = {}
+        self.requests = registry.counter(
+            "singleflight_requests_total", "Coalescable GETs by how they were answered", ("path", "outcome")
+        )
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "GET"
+            or scope["path"] not in self.paths
+            or any(name in PRIVATE_HEADERS for name, _ in scope["headers"])
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        key = request_key(scope)
+        flight = self.flights.get(key)
+        if flight is not None and flight.done.is_set():
+            if flight.messages is not None and time.monotonic() - flight.finished_at < self.window:
+                self.requests.inc(key[0], "window")
+                await _replay(flight.messages, send)
+                return
+            flight = None
+            del self.flights[key]
+
+        if flight is not None:
+            await flight.done.wait()
+            if flight.messages is not None:
+                self.requests.inc(key[0], "shared")
+                await _replay(flight.messages, send)
+                return
+            # The leader failed or its response wasn't shareable: do the work ourselves
+            self.requests.inc(key[0], "fallback")
+            await self.app(scope, receive, send)
+            return
+
+        flight = self.flights[key] = _Flight()
+        self.requests.inc(key[0], "leader")
+        await self._lead(key, flight, scope, receive, send)
+
+    async def _lead(self, key: Key, flight: _Flight, scope, receive, send):
+        recorded: List[dict] = []
+        size = 0
+        shareable = True
+
+        async def send_wrapper(message):
+            nonlocal size, shareable
+            if shareable:
+                if message["type"] == "http.response.start":
+                    shareable = message["status"] < 500
+                elif message["type"] == "http.response.body":
+                    size += len(message.get("body", b""))
+                    shareable = size <= self.max_bytes
+                # Copied: outer middleware may replace the message's headers
+                recorded.append(dict(message))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            complete = bool(recorded) and not recorded[-1].get("more_body", False)
+            if shareable and complete:
+                flight.messages = recorded
+                flight.finished_at = time.monotonic()
+            flight.done.set()
+            # Keep a finished flight only as long as its window lasts
+            if flight.messages is None or self.window <= 0:
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+            else:
+                asyncio.get_running_loop().call_later(self.window, self._expire, key, flight)
+
+    def _expire(self, key: Key, flight: _Flight) -> None:
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+
+
+async def _replay(messages: List[dict], send) -> None:
+    for message in messages:
+        await send(dict(message))
@@ -1,34 +1,27 @@
-from model import Request, Training, SessionLocal
+from model import Base, Request, Training, request_training, SessionLocal, engine, facets, graph, summaries, versions
+from analytics import Analytics
+from admission import AdmissionMiddleware
+from compression import CompressionMiddleware
+from profiler import ProfilerMiddleware
+from idempotency import IdempotencyMiddleware
+from singleflight import SingleFlightMiddleware
+from metrics import instrument_app
+from statements import request_statements, training_statements, track_compiled_cache
+from index_advisor import record_from_env
+from startup import STARTUP_MODE, DeferredMiddleware, prepare_database
+from versioning import etag, update_versioned
+from batch import Batcher
+from contextlib import asynccontextmanager
 from sqlalchemy import Column, Integer, String, Table, ForeignKey, case, func, select, text
 from sqlalchemy.orm import relationship, declarative_base, joinedload, load_only
 # Create tables
 # Base.metadata.create_all(bind=engine)
 import logging
-from colorlog import ColoredFormatter
 import json
-from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
-from opentelemetry import trace
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import ConsoleSpanExporter, BatchSpanProcessor
-from opentelemetry.sdk.resources import Resource
-# Set up the tracer
-
-# Create a resource with service name
-resource = Resource.create({"service.name": "my-fastapi-service"})
-
-# Initialize TracerProvider with the resource
-tracer_provider = TracerProvider(resource=resource)
-
-# Create and register console exporter
-console_exporter = ConsoleSpanExporter()
-span_processor = BatchSpanProcessor(console_exporter)
-tracer_provider.add_span_processor(span_processor)
-
-# Set the global tracer provider
-trace.set_tracer_provider(tracer_provider)
 # Add this logging configuration after your imports
 # def setup_logger():
 #     """Set up the logger with color formatting"""
+#     from colorlog import ColoredFormatter
 #     formatter = ColoredFormatter(
 #         "%(log_color)s%(levelname)-8s%(reset)s %(blue)s%(message)s",
 #         datefmt=None,
@@ -89,14 +82,54 @@ class TrainingCreate(TrainingBase):
 class RequestCreate(RequestBase):
     pass
 
+class TrainingUpdate(BaseModel):
+    title: Optional[str] = None
+    duration: Optional[int] = None
+
+class RequestUpdate(BaseModel):
+    name: Optional[str] = None
+    description: Optional[str] = None
+
 
    
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Response
 from sqlalchemy.orm import Session
 from typing import List
 
-app = FastAPI()
-FastAPIInstrumentor.instrument_app(app)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Tables are managed by Alembic (alembic.ini); fast mode checks the revision and prewarms
+    if STARTUP_MODE == "fast":
+        await prepare_database(
+            engine, Base.metadata, warm=[(request_stmts.by_id, {"request_id": 0}), (training_stmts.by_id, {"training_id": 0})]
+        )
+    with engine.begin() as conn:
+        facets.install(conn)
+        summaries.install(conn)
+        versions.install(conn)
+        graph.install(conn)
+    yield
+
+app = FastAPI(lifespan=lifespan)
+# Sampling and exporter are configured through TRACE_* environment variables. OpenTelemetry
+# is imported by the startup prewarm or the first request, not at module import.
+app.add_middleware(
+    DeferredMiddleware, factory="tracing:tracing_middleware", engines=(engine,), service_name="my-fastapi-service"
+)
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(SingleFlightMiddleware, paths=("/requests/",))
+app.add_middleware(IdempotencyMiddleware, paths=("/requests/", "/trainings/", "/batch"))
+app.add_middleware(CompressionMiddleware)
+# X-Profile: $PROFILE_TOKEN profiles one request; PROFILE_SAMPLE_RATE profiles at random (see profiler.py)
+app.add_middleware(ProfilerMiddleware)
+instrument_app(app, engine)
+track_compiled_cache(engine)
+# RECORD_STATEMENTS=statements.json feeds index_advisor.py
+record_from_env(engine)
+
+request_stmts = request_statements(Request, Training)
+training_stmts = training_statements(Training)
+analytics = Analytics(Request, Training, request_training, versions)
 
 # Database connection dependency
 def get_db():
@@ -106,6 +139,9 @@ def get_db():
     finally:
         db.close()
 
+# POST /batch: several of the operations below in one call and one transaction
+batch = Batcher(app, engine, SessionLocal, get_db)
+
 @app.post("/trainings/")
 def create_training(training: TrainingCreate, db: Session = Depends(get_db)):
     db_training = Training(**training.model_dump())
@@ -126,8 +162,8 @@ def create_request(request: RequestCreate, db: Session = Depends(get_db)):
 
 @app.post("/requests/{request_id}/trainings/{training_id}")
 def associate_request_training(request_id: int, training_id: int, db: Session = Depends(get_db)):
-    request = db.query(Request).filter(Request.id == request_id).first()
-    training = db.query(Training).filter(Training.id == training_id).first()
+    request = db.scalars(request_stmts.by_id, {"request_id": request_id}).first()
+    training = db.scalars(training_stmts.by_id, {"training_id": training_id}).first()
     
     if not request or not training:
         raise HTTPException(status_code=404, detail="Request or Training not found")
@@ -136,17 +172,53 @@ def associate_request_training(request_id: int, training_id: int, db: Session =
     db.commit()
     return {"message": "Association created successfully"}
 
+# Conditional updates: If-Match with the version (ETag) from an earlier response, 412 on conflict
+@app.put("/trainings/{training_id}")
+def update_training(
+    training_id: int,
+    training: TrainingUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    params = {"training_id": training_id, **training.model_dump(exclude_unset=True)}
+    db_training = update_versioned(db, training_stmts, params, if_match, what="Training")
+    response.headers["ETag"] = etag(db_training.version)
+    return db_training
+
+@app.put("/requests/{request_id}")
+def update_request(
+    request_id: int,
+    request: RequestUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    params = {"request_id": request_id, **request.model_dump(exclude_unset=True)}
+    db_request = update_versioned(db, request_stmts, params, if_match, what="Request")
+    response.headers["ETag"] = etag(db_request.version)
+    return db_request
+
+@app.get("/requests/facets")
+def get_request_facets(db: Session = Depends(get_db)):
+    # Total and counts per group from facet_counts, no COUNT(*) over requests
+    return facets.read(db)
+
 @app.get("/requests/")
 def get_all_requests(db: Session = Depends(get_db)):
     # Fetching data using sqlalchemy
-    results = (
-        db.query(Request)
-        .options(
-            load_only(Request.id, Request.name),
-            joinedload(Request.trainings).load_only(Training.id, Training.title)
-        )
-        .all()
-    )
+    # results = (
+    #     db.query(Request)
+    #     .options(
+    #         load_only(Request.id, Request.name),
+    #         joinedload(Request.trainings).load_only(Training.id, Training.title)
+    #     )
+    #     .all()
+    # )
+    # Same query, prebuilt once in statements.py
+    # results = db.execute(request_stmts.with_trainings).unique().scalars().all()
+    # Pre-serialized by the request_summaries triggers (see summaries.py): one table scan
+    results = Response(summaries.payload(db), media_type="application/json")
 
     # msg={"message": "Association created successfully"}
     # logger.info(
@@ -205,6 +277,34 @@ def get_all_requests(db: Session = Depends(get_db)):
     return results
 
 
+# Analytics, aggregated by the database and cached until one of the tables changes
+@app.get("/analytics/trainings/top")
+def top_trainings(n: int = Query(10, ge=1, le=1000), db: Session = Depends(get_db)):
+    return analytics.top_trainings(db, n)
+
+@app.get("/analytics/groups/duration")
+def group_durations(db: Session = Depends(get_db)):
+    return analytics.group_durations(db)
+
+@app.get("/analytics/groups/duration-percentiles")
+def group_duration_percentiles(p: List[int] = Query([50, 90, 99]), db: Session = Depends(get_db)):
+    if len(p) > 10:
+        raise HTTPException(status_code=422, detail="at most 10 percentiles")
+    if any(not 0 < value <= 100 for value in p):
+        raise HTTPException(status_code=422, detail="percentiles must be in (0, 100]")
+    return analytics.duration_percentiles(db, p)
+
+
+# Graph queries on the in-memory request_training snapshot (see graph.py)
+@app.get("/graph/requests/{request_id}/similar")
+def similar_requests(request_id: int, n: int = Query(10, ge=1, le=1000), db: Session = Depends(get_db)):
+    return graph.similar_requests(db, request_id, n)
+
+@app.get("/graph/trainings/{training_id}/co-assigned")
+def co_assigned_trainings(training_id: int, n: int = Query(10, ge=1, le=1000), db: Session = Depends(get_db)):
+    return graph.co_assigned(db, training_id, n)
+
+
 @app.get("/sample/")
 def sample(db: Session = Depends(get_db)):
     data=db.query(Request).filter(Request.id == 1).first()
@@ -0,0 +1,35 @@
+# SQLite connection tweaks shared by the apps.
+
+from sqlalchemy import event
+
+
+def enable_savepoints(engine) -> None:
+    """Let SQLAlchemy own BEGIN so SAVEPOINT (session.begin_nested()) works.
+
+    pysqlite/aiosqlite start transactions lazily on their own and break
+    SAVEPOINT handling; this is the workaround from the SQLAlchemy SQLite docs.
+    """
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "connect")
+    def _disable_driver_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(sync_engine, "begin")
+    def _emit_begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
+
+def enable_wal(engine, busy_timeout_ms: int = 5000) -> None:
+    """WAL lets many processes read while one writes; busy_timeout queues writers instead of failing."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    if sync_engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(sync_engine, "connect")
+    def _set_wal(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+        cursor.close()
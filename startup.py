@@ -0,0 +1,250 @@
+# Startup modes for the apps.
+#
+#   STARTUP_MODE=create_all  (default) create missing tables on startup
+#   STARTUP_MODE=fast        only check that the database is at the Alembic head
+#                            revision, then prewarm the pool, the compiled cache and
+#                            deferred imports in the background
+#
+# Each database has its own Alembic config: alembic.ini for relation.db,
+# alembic_items.ini for the items apps' test.db. Databases Alembic doesn't
+# manage (the item shards) pass alembic_ini=None and skip the check.
+#
+# Optional heavy modules (OpenTelemetry, ...) are wrapped in DeferredMiddleware so
+# they are imported by the background prewarm or, at the latest, by the first
+# request that needs them, never at module import.
+
+import asyncio
+import configparser
+import importlib
+import os
+import re
+import threading
+from contextlib import asynccontextmanager
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+STARTUP_MODE = os.getenv("STARTUP_MODE", "create_all")
+ALEMBIC_INI = os.getenv("ALEMBIC_INI", "alembic.ini")
+ALEMBIC_ITEMS_INI = os.getenv("ALEMBIC_ITEMS_INI", "alembic_items.ini")
+
+WarmStatement = Tuple[Any, dict]
+
+_REVISION = re.compile(r"^revision\s*(?::\s*\w+\s*)?=\s*['\"]([^'\"]+)['\"]", re.M)
+_DOWN_REVISION = re.compile(r"^down_revision\s*(?::[^=]+)?=\s*(.+)$", re.M)
+
+
+def alembic_head(ini_path: str = ALEMBIC_INI) -> Optional[str]:
+    """Head revision of the migration scripts referenced by alembic.ini, None if there are none yet.
+
+    Parses the version files directly: importing alembic costs more than the
+    create_all this mode replaces.
+    """
+    here = os.path.dirname(os.path.abspath(ini_path))
+    config = configparser.ConfigParser(defaults={"here": here})
+    config.read(ini_path)
+    script_location = os.path.join(here, config.get("alembic", "script_location"))
+    locations = config.get("alembic", "version_locations", fallback=None)
+    version_dirs = locations.split(os.pathsep) if locations else [os.path.join(script_location, "versions")]
+
+    revisions, parents = set(), set()
+    for version_dir in version_dirs:
+        if not os.path.isdir(version_dir):
+            continue
+        for filename in os.listdir(version_dir):
+            if not filename.endswith(".py"):
+                continue
+            with open(os.path.join(version_dir, filename)) as f:
+                source = f.read()
+            revision = _REVISION.search(source)
+            if revision is None:
+                continue
+            revisions.add(revision.group(1))
+            down = _DOWN_REVISION.search(source)
+            if down:
+                parents.update(re.findall(r"['\"]([^'\"]+)['\"]", down.group(1)))
+
+    heads = revisions - parents
+    if not revisions:
+        return None
+    if len(heads) != 1:
+        raise RuntimeError(f"Expected exactly one Alembic head in {version_dirs}, found {sorted(heads)}")
+    return heads.pop()
+
+
+def check_schema(connection, ini_path: str = ALEMBIC_INI) -> None:
+    head = alembic_head(ini_path)
+    try:
+        current = connection.execute(text("SELECT version_num FROM alembic_version")).scalar()
+    except Exception:
+        current = None
+    if current != head:
+        raise RuntimeError(
+            f"Database is at revision {current!r} but the Alembic head is {head!r}; run `alembic upgrade head`"
+        )
+
+
+class DeferredMiddleware:
+    """ASGI middleware whose real implementation is imported and built on first use.
+
+    `factory` is "module:function"; the function receives the wrapped app plus
+    `options` and returns the ASGI app to use. prewarm() builds every instance
+    in the background so the first request usually doesn't pay for it.
+    """
+
+    instances: List["DeferredMiddleware"] = []
+
+    def __init__(self, app, factory: str, **options):
+        self.app = app
+        self.factory = factory
+        self.options = options
+        self._built = None
+        self._lock = threading.Lock()
+        DeferredMiddleware.instances.append(self)
+
+    def build(self):
+        with self._lock:
+            if self._built is None:
+                module_name, function = self.factory.split(":")
+                self._built = getattr(importlib.import_module(module_name), function)(self.app, **self.options)
+        return self._built
+
+    async def __call__(self, scope, receive, send):
+        app = self._built or self.build()
+        await app(scope, receive, send)
+
+
+def _warm_statements(connection, statements: Sequence[WarmStatement]) -> None:
+    # Executed and rolled back, just to put the compiled forms in the cache
+    with Session(bind=connection) as session:
+        for statement, params in statements:
+            session.execute(statement, params)
+        session.rollback()
+
+
+async def prewarm(engine, statements: Sequence[WarmStatement] = (), connections: Optional[int] = None) -> None:
+    for middleware in list(DeferredMiddleware.instances):
+        await asyncio.to_thread(middleware.build)
+
+    sync_engine = getattr(engine, "sync_engine", engine)
+    size = connections or getattr(sync_engine.pool, "size", lambda: 1)()
+    if sync_engine is engine:
+        def warm():
+            opened = [engine.connect() for _ in range(size)]
+            try:
+                with opened[0].begin():
+                    _warm_statements(opened[0], statements)
+            finally:
+                for conn in opened:
+                    conn.close()
+
+        await asyncio.to_thread(warm)
+    else:
+        opened = [await engine.connect() for _ in range(size)]
+        try:
+            await opened[0].run_sync(_warm_statements, statements)
+        finally:
+            for conn in opened:
+                await conn.close()
+
+
+_background: set = set()
+
+
+async def prepare_database(
+    engine, metadata, warm: Iterable[WarmStatement] = (), alembic_ini: Optional[str] = ALEMBIC_INI
+) -> None:
+    """Run from an app's lifespan, before it starts serving.
+
+    alembic_ini is the config of the migrations that manage this database; with
+    None fast mode skips the revision check.
+    """
+    is_async = hasattr(engine, "sync_engine")
+    if STARTUP_MODE != "fast":
+        if is_async:
+            async with engine.begin() as conn:
+                await conn.run_sync(metadata.create_all)
+        else:
+            metadata.create_all(bind=engine)
+        return
+
+    if alembic_ini is None:
+        pass
+    elif is_async:
+        async with engine.connect() as conn:
+            await conn.run_sync(check_schema, alembic_ini)
+    else:
+        with engine.connect() as conn:
+            check_schema(conn, alembic_ini)
+
+    task = asyncio.create_task(prewarm(engine, list(warm)))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+if __name__ == "__main__":
+    # Benchmark: import time and time to first response per app and startup mode
+    import json
+    import subprocess
+    import sys
+    import tempfile
+
+    repo = os.path.dirname(os.path.abspath(__file__))
+    probe = r"""
+import asyncio, json, sys, time
+start = time.perf_counter()
+import {module} as target
+imported = time.perf_counter()
+
+async def first_request():
+    async def receive():
+        return {{"type": "http.request", "body": b"", "more_body": False}}
+    status = []
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+    async with target.app.router.lifespan_context(target.app):
+        scope = {{"type": "http", "asgi": {{"version": "3.0"}}, "http_version": "1.1", "method": "GET",
+                 "scheme": "http", "path": "{path}", "raw_path": b"{path}", "root_path": "",
+                 "query_string": b"", "headers": [], "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80)}}
+        await target.app(scope, receive, send)
+        return status[0], time.perf_counter()
+
+status, answered = asyncio.run(first_request())
+print(json.dumps({{"import_ms": (imported - start) * 1e3, "first_response_ms": (answered - start) * 1e3, "status": status}}))
+"""
+    revision = '"""bench"""\nrevision = "0001"\ndown_revision = None\n'
+
+    targets = [("sync_db_api", "/items", "test.db"), ("async_db_api", "/items", "test.db"),
+               ("sqlalchemy_relations", "/requests/", "relation.db")]
+    for module, path, database in targets:
+        for mode in ("create_all", "fast"):
+            runs = []
+            for _ in range(5):
+                with tempfile.TemporaryDirectory() as tmp:
+                    os.makedirs(os.path.join(tmp, "alembic", "versions"))
+                    with open(os.path.join(tmp, "alembic", "versions", "0001_bench.py"), "w") as f:
+                        f.write(revision)
+                    for ini in ("alembic.ini", "alembic_items.ini"):
+                        with open(os.path.join(tmp, ini), "w") as f:
+                            f.write("[alembic]\nscript_location = alembic\n")
+                    # Pre-migrated database so both modes start from the same state
+                    setup = (
+                        f"import {module} as m, sqlalchemy as sa; "
+                        f"e = sa.create_engine('sqlite:///./{database}'); m.Base.metadata.create_all(e); "
+                        "c = e.connect(); c.exec_driver_sql('CREATE TABLE alembic_version (version_num VARCHAR(32))'); "
+                        "c.exec_driver_sql(\"INSERT INTO alembic_version VALUES ('0001')\"); c.commit()"
+                    )
+                    env = dict(os.environ, PYTHONPATH=repo, STARTUP_MODE=mode)
+                    subprocess.run([sys.executable, "-c", setup], cwd=tmp, env=env, check=True, capture_output=True)
+                    out = subprocess.run(
+                        [sys.executable, "-c", probe.format(module=module, path=path)],
+                        cwd=tmp, env=env, check=True, capture_output=True, text=True,
+                    )
+                    runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+            best = min(runs, key=lambda r: r["first_response_ms"])
+            print(
+                f"{module:<20} {mode:<11} import {best['import_ms']:7.1f} ms, "
+                f"first response {best['first_response_ms']:7.1f} ms (HTTP {best['status']})"
+            )
@@ -0,0 +1,108 @@
+# Materialized request -> trainings summary.
+#
+# GET /requests/ used to join requests, request_training and trainings on every
+# call. request_summaries keeps one row per request with its trainings already
+# serialized as JSON, and SQLite triggers keep it current when a request is
+# added, renamed or removed, when an association is added or removed and when
+# a training is renamed or removed. The whole /requests/ payload is then one
+# scan of one table, assembled by SQLite:
+#
+#   summaries = RequestSummaries(Base.metadata)
+#   summaries.install(conn)                    # lifespan: table, triggers, first build
+#   Response(summaries.payload(db), media_type="application/json")
+#
+# python summaries.py rebuild --url sqlite:///./relation.db repairs it.
+
+import sqlalchemy as sa
+
+REQUESTS, TRAININGS, ASSOCIATION = "requests", "trainings", "request_training"
+
+
+def _trainings_json(request_id_sql: str) -> str:
+    # Ordered subquery, so every rebuild produces the same bytes
+    return (
+        "(SELECT json_group_array(json_object('id', id, 'title', title)) FROM ("
+        f"SELECT t.id AS id, t.title AS title FROM {ASSOCIATION} rt JOIN {TRAININGS} t ON t.id = rt.training_id "
+        f"WHERE rt.request_id = {request_id_sql} ORDER BY t.id))"
+    )
+
+
+class RequestSummaries:
+    def __init__(self, metadata: sa.MetaData, name: str = "request_summaries"):
+        existing = metadata.tables.get(name)
+        self.table = existing if existing is not None else sa.Table(
+            name,
+            metadata,
+            sa.Column("request_id", sa.Integer, primary_key=True),
+            sa.Column("name", sa.String, nullable=False),
+            sa.Column("trainings", sa.Text, nullable=False, server_default="[]"),
+        )
+        name = self.table.name
+        self._payload = sa.text(
+            "SELECT COALESCE(json_group_array(json_object('id', request_id, 'name', name, "
+            f"'trainings', json(trainings))), '[]') FROM (SELECT * FROM {name} ORDER BY request_id)"
+        )
+
+    def _triggers(self):
+        name = self.table.name
+        refresh = f"UPDATE {name} SET trainings = {_trainings_json(name + '.request_id')}"
+        return [
+            f"CREATE TRIGGER IF NOT EXISTS {name}_request_insert AFTER INSERT ON {REQUESTS} BEGIN "
+            f"INSERT OR REPLACE INTO {name} (request_id, name, trainings) "
+            f"VALUES (NEW.id, NEW.name, {_trainings_json('NEW.id')}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {name}_request_rename AFTER UPDATE OF name ON {REQUESTS} BEGIN "
+            f"UPDATE {name} SET name = NEW.name WHERE request_id = NEW.id; END",
+            f"CREATE TRIGGER IF NOT EXISTS {name}_request_delete AFTER DELETE ON {REQUESTS} BEGIN "
+            f"DELETE FROM {name} WHERE request_id = OLD.id; END",
+            f"CREATE TRIGGER IF NOT EXISTS {name}_link_insert AFTER INSERT ON {ASSOCIATION} BEGIN "
+            f"{refresh} WHERE request_id = NEW.request_id; END",
+            f"CREATE TRIGGER IF NOT EXISTS {name}_link_delete AFTER DELETE ON {ASSOCIATION} BEGIN "
+            f"{refresh} WHERE request_id = OLD.request_id; END",
+            f"CREATE TRIGGER IF NOT EXISTS {name}_training_rename AFTER UPDATE OF title ON {TRAININGS} BEGIN "
+            f"{refresh} WHERE request_id IN (SELECT request_id FROM {ASSOCIATION} WHERE training_id = NEW.id); END",
+            f"CREATE TRIGGER IF NOT EXISTS {name}_training_delete AFTER DELETE ON {TRAININGS} BEGIN "
+            f"{refresh} WHERE request_id IN (SELECT request_id FROM {ASSOCIATION} WHERE training_id = OLD.id); END",
+        ]
+
+    def install(self, conn) -> None:
+        """Create the table and triggers if missing; build it the first time."""
+        if conn.dialect.name != "sqlite":
+            raise RuntimeError(f"summary triggers are only written for SQLite, not {conn.dialect.name}")
+        inspector = sa.inspect(conn)
+        if not all(inspector.has_table(table) for table in (REQUESTS, TRAININGS, ASSOCIATION)):
+            # Not migrated yet; picked up by the next install()
+            return
+        created = not inspector.has_table(self.table.name)
+        self.table.create(conn, checkfirst=True)
+        for statement in self._triggers():
+            conn.exec_driver_sql(statement)
+        if created:
+            self.rebuild(conn)
+
+    def rebuild(self, conn) -> int:
+        name = self.table.name
+        conn.exec_driver_sql(f"DELETE FROM {name}")
+        result = conn.exec_driver_sql(
+            f"INSERT INTO {name} (request_id, name, trainings) "
+            f"SELECT r.id, r.name, {_trainings_json('r.id')} FROM {REQUESTS} r"
+        )
+        return result.rowcount
+
+    def payload(self, conn) -> str:
+        """The whole GET /requests/ response body as a JSON string (works on a Session too)."""
+        return conn.execute(self._payload).scalar()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Request summary maintenance")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--url", default="sqlite:///./relation.db")
+    args = parser.parse_args()
+
+    summaries = RequestSummaries(sa.MetaData())
+    with sa.create_engine(args.url).begin() as conn:
+        summaries.install(conn)
+        rows = summaries.rebuild(conn)
+    print(f"Rebuilt {rows} request summaries")
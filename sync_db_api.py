@@ -2,17 +2,36 @@ from contextlib import asynccontextmanager
 from datetime import datetime
 import os
 from typing import Dict, Optional
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, Header, HTTPException, Response
 from sqlalchemy import Boolean, create_engine, Column, Integer, String,TIMESTAMP,func, not_, or_, select
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Mapped, mapped_column, sessionmaker, Session
+from sqlalchemy.orm.exc import StaleDataError
 from pydantic import BaseModel
+from admission import AdmissionMiddleware
+from compression import CompressionMiddleware
+from profiler import ProfilerMiddleware
+from idempotency import IdempotencyMiddleware
+from singleflight import SingleFlightMiddleware
+from metrics import instrument_app
+from statements import item_statements, track_compiled_cache
+from index_advisor import record_from_env
+from startup import ALEMBIC_ITEMS_INI, prepare_database
+from archive import Archive, attach_archive
+from counters import FacetCounts
+from query_language import QueryError, QueryLanguage
+from projection import Projection, ProjectionError
+from versioning import etag, update_versioned
+from sqlite_tuning import enable_savepoints
+from batch import Batcher
 # Initialize FastAPI app
 
 
 # Database configuration
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+# POST /batch runs each operation in a SAVEPOINT (see batch.py)
+enable_savepoints(engine)
 
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -22,8 +41,13 @@ Base = declarative_base()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Create tables on startup
-    Base.metadata.create_all(bind=engine)
+    # Create tables on startup (STARTUP_MODE=fast only checks the Alembic revision)
+    await prepare_database(
+        engine, Base.metadata, warm=[(stmts.by_id, {"item_id": 0}), (stmts.delete_by_id, {"item_id": 0})],
+        alembic_ini=ALEMBIC_ITEMS_INI,
+    )
+    with engine.begin() as conn:
+        facets.install(conn)
     yield
     # Base.metadata.drop_all(bind=engine)
     # if os.path.exists("./test.db"):
@@ -31,16 +55,76 @@ async def lifespan(app: FastAPI):
 
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(SingleFlightMiddleware, paths=("/items",))
+app.add_middleware(IdempotencyMiddleware, paths=("/itemscreate", "/items/bulk-update", "/batch"))
+app.add_middleware(CompressionMiddleware)
+# X-Profile: $PROFILE_TOKEN profiles one request; PROFILE_SAMPLE_RATE profiles at random (see profiler.py)
+app.add_middleware(ProfilerMiddleware)
+instrument_app(app, engine)
+track_compiled_cache(engine)
+# RECORD_STATEMENTS=statements.json feeds index_advisor.py
+record_from_env(engine)
 class Item(Base):
     __tablename__ = "items"
+    # Ids of archived rows are never handed out again (see archive.py)
+    __table_args__ = {"sqlite_autoincrement": True}
     
     id: Mapped[int] = mapped_column(Integer,primary_key=True, index=True, autoincrement=True)
     name: Mapped[str] = mapped_column(String,index=True)
     description: Mapped[Optional[str]] = mapped_column(String)
     is_active: Mapped[bool] = mapped_column(Boolean)
     created_at: Mapped[datetime] = mapped_column(TIMESTAMP, server_default=func.now())
+    # Bumped on every UPDATE; flushes and If-Match updates check it (see versioning.py)
+    version: Mapped[int] = mapped_column(Integer, nullable=False, server_default="1")
 
+    __mapper_args__ = {"version_id_col": version}
 
+# Prebuilt statements for the hot queries (see statements.py)
+stmts = item_statements(Item)
+
+# Inactive items are moved out by `python archive.py archive`; ?include_archived=true reads both
+items_archive = Archive(Item.__table__)
+attach_archive(engine)
+all_with_archived = items_archive.select_all(Item)
+
+# Item totals and counts per is_active, kept by triggers (see counters.py)
+facets = FacetCounts(Base.metadata)
+facets.track(Item.__table__, "is_active")
+
+# ?filter=...&sort=...&limit=... on GET /items (see query_language.py)
+item_queries = QueryLanguage(
+    Item,
+    allow={
+        "id": ("eq", "in", "range"),
+        "name": ("eq", "in", "prefix", "range"),
+        "is_active": ("eq",),
+        "created_at": ("eq", "range"),
+    },
+)
+
+def compile_query(filter, sort, limit, include_archived):
+    if include_archived:
+        raise HTTPException(status_code=400, detail="filter/sort/limit can't be combined with include_archived")
+    try:
+        return item_queries.compile(filter, sort, limit)
+    except QueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# ?fields=id,name: plain rows serialized straight to JSON, no ORM objects (see projection.py)
+item_projection = Projection(Item)
+
+def projected_query(fields, filter, sort, limit, include_archived):
+    try:
+        names = item_projection.parse(fields)
+    except ProjectionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if filter or sort or limit is not None:
+        statement, params = compile_query(filter, sort, limit, include_archived)
+        return item_projection.select(statement, names), params, names
+    if include_archived:
+        return items_archive.select_columns(names), {}, names
+    return item_projection.select(stmts.all, names), {}, names
 
 # Dependency to get database session
 def get_db():
@@ -50,15 +134,37 @@ def get_db():
     finally:
         db.close()
 
+# POST /batch: several item operations in one call and one transaction
+batch = Batcher(app, engine, SessionLocal, get_db)
+
 # Test endpoint
 @app.get("/items")
-def read_items(db: Session = Depends(get_db)):
+def read_items(
+    include_archived: bool = False,
+    filter: Optional[str] = None,
+    sort: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    if fields is not None:
+        statement, params, names = projected_query(fields, filter, sort, limit, include_archived)
+        return item_projection.response(db.execute(statement, params).all(), names)
     # with query
     #items = db.query(Item).all()
     # with select
-    items = db.execute(select(Item)).scalars().all()
+    # items = db.execute(select(Item)).scalars().all()
+    # with a prebuilt statement
+    if filter or sort or limit is not None:
+        statement, params = compile_query(filter, sort, limit, include_archived)
+        return db.execute(statement, params).scalars().all()
+    items = db.execute(all_with_archived if include_archived else stmts.all).scalars().all()
     return items
 
+@app.get("/items/facets")
+def read_item_facets(db: Session = Depends(get_db)):
+    return facets.read(db)
+
 class ItemCreate(BaseModel):
     name: str
     description: str
@@ -83,23 +189,23 @@ class ItemUpdate(BaseModel):
     is_active: Optional[bool] = None
 
 @app.put("/items/{item_id}")
-def update_item(item_id: int, item: ItemUpdate, db: Session = Depends(get_db)):
-    db_item = db.query(Item).filter(Item.id == item_id).first()
-    if not db_item:
-        raise HTTPException(status_code=404, detail="Item not found")
-    
-    # Update only provided fields
+def update_item(
+    item_id: int,
+    item: ItemUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    # Update only provided fields, in one UPDATE ... RETURNING. With If-Match the
+    # version must still match, otherwise 412 (see versioning.py)
     update_data = item.model_dump(exclude_unset=True)
-    for key, value in update_data.items():
-        setattr(db_item, key, value)
-    
-    db.commit()
-    db.refresh(db_item)
+    db_item = update_versioned(db, stmts, {"item_id": item_id, **update_data}, if_match)
+    response.headers["ETag"] = etag(db_item.version)
     return db_item
 
 @app.delete("/items/{item_id}")
 def delete_item(item_id: int, db: Session = Depends(get_db)):
-    db_item = db.query(Item).filter(Item.id == item_id).first()
+    db_item = db.scalars(stmts.by_id, {"item_id": item_id}).first()
     if not db_item:
         raise HTTPException(status_code=404, detail="Item not found")
     
@@ -117,6 +223,7 @@ class ItemResponse(BaseModel):
     description: str
     is_active: bool
     created_at: datetime
+    version: int
 
     model_config = {
         "from_attributes": True,
@@ -129,7 +236,7 @@ def update_multiple_items(items: Dict[int, ItemUpdate], db: Session = Depends(ge
     not_found_ids = []
     
     for item_id, update_data in items.items():
-        db_item = db.query(Item).filter(Item.id == item_id).first()
+        db_item = db.scalars(stmts.by_id, {"item_id": item_id}).first()
         if not db_item:
             not_found_ids.append(item_id)
             continue
@@ -146,7 +253,12 @@ def update_multiple_items(items: Dict[int, ItemUpdate], db: Session = Depends(ge
             detail=f"Items with ids {not_found_ids} not found"
         )
     
-    db.commit()
+    try:
+        db.commit()
+    except StaleDataError:
+        # Another writer updated one of the items between our read and the flush
+        db.rollback()
+        raise HTTPException(status_code=412, detail="Items were modified concurrently, retry the update")
     
     # Convert SQLAlchemy objects to Pydantic models
     response_items = [ItemResponse.model_validate(item) for item in updated_items]
@@ -0,0 +1,133 @@
+import math
+import random
+from collections import Counter, defaultdict
+
+import pytest
+import sqlalchemy as sa
+
+import model
+from analytics import Analytics
+
+
+@pytest.fixture
+def seeded(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'analytics.db'}")
+    model.Base.metadata.create_all(engine)
+    rng = random.Random(7)
+    trainings = {i: rng.choice([None, 1, 5, 5, 10, 30]) for i in range(1, 21)}
+    requests = {i: rng.choice(["a", "b", "c", None]) for i in range(1, 61)}
+    # Few distinct popularities, so ranks tie
+    links = {(r, t) for r in requests for t in rng.sample(sorted(trainings), rng.randint(0, 4))}
+    links |= {(r, 1) for r in range(1, 11)} | {(r, 2) for r in range(11, 21)}
+    with engine.begin() as conn:
+        conn.execute(sa.insert(model.Training), [
+            {"id": i, "title": f"t{i}", "duration": d} for i, d in trainings.items()
+        ])
+        conn.execute(sa.insert(model.Request), [
+            {"id": i, "name": f"r{i}", "group": g} for i, g in requests.items()
+        ])
+        conn.execute(sa.insert(model.request_training), [
+            {"request_id": r, "training_id": t} for r, t in sorted(links)
+        ])
+        model.versions.install(conn)
+    analytics = Analytics(model.Request, model.Training, model.request_training, model.versions)
+    return engine, analytics, trainings, requests, links
+
+
+def test_top_trainings(seeded):
+    engine, analytics, trainings, requests, links = seeded
+    counts = Counter(t for _, t in links)
+    expected = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    ranks = {c: 1 + sum(1 for other in counts.values() if other > c) for c in counts.values()}
+    assert len(set(counts.values())) < len(counts)  # the data has ties
+
+    with engine.connect() as conn:
+        top = analytics.top_trainings(conn, n=8)
+    assert [(row["id"], row["requests"], row["rank"]) for row in top] == [
+        (t, c, ranks[c]) for t, c in expected[:8]
+    ]
+    assert all(row["title"] == f"t{row['id']}" for row in top)
+
+
+def test_group_durations(seeded):
+    engine, analytics, trainings, requests, links = seeded
+    totals, request_ids, link_counts = defaultdict(int), defaultdict(set), Counter()
+    for r, t in links:
+        group = requests[r]
+        totals[group] += trainings[t] or 0
+        request_ids[group].add(r)
+        link_counts[group] += 1
+
+    with engine.connect() as conn:
+        groups = analytics.group_durations(conn)
+    assert {row["group"]: (row["requests"], row["trainings"], row["total_duration"]) for row in groups} == {
+        group: (len(request_ids[group]), link_counts[group], totals[group]) for group in totals
+    }
+    assert [row["total_duration"] for row in groups] == sorted(totals.values(), reverse=True)
+    assert sum(row["share"] for row in groups) == pytest.approx(1.0)
+    for row in groups:
+        assert row["share"] == pytest.approx(totals[row["group"]] / sum(totals.values()))
+
+
+def test_duration_percentiles_nearest_rank(seeded):
+    engine, analytics, trainings, requests, links = seeded
+    loads = defaultdict(lambda: defaultdict(int))
+    for r, t in links:
+        loads[requests[r]][r] += trainings[t] or 0
+    percentiles = (1, 25, 50, 90, 100)
+
+    def nearest_rank(values, p):
+        values = sorted(values)
+        return values[math.ceil(p * len(values) / 100) - 1]
+
+    with engine.connect() as conn:
+        rows = analytics.duration_percentiles(conn, percentiles)
+    assert {row["group"]: row for row in rows} == {
+        group: {"group": group, "requests": len(per_request),
+                **{f"p{p}": nearest_rank(per_request.values(), p) for p in percentiles}}
+        for group, per_request in loads.items()
+    }
+
+
+def test_duration_percentiles_small_inputs(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'small.db'}")
+    model.Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(sa.insert(model.Training), [{"id": i, "title": "t", "duration": i * 10} for i in (1, 2, 3)])
+        conn.execute(sa.insert(model.Request), [{"id": 1, "name": "one", "group": "solo"}] + [
+            {"id": i, "name": "pair", "group": "pair"} for i in (2, 3)
+        ])
+        conn.execute(sa.insert(model.request_training), [
+            {"request_id": 1, "training_id": 2},
+            {"request_id": 2, "training_id": 1},
+            {"request_id": 3, "training_id": 3},
+        ])
+        model.versions.install(conn)
+    analytics = Analytics(model.Request, model.Training, model.request_training, model.versions)
+    with engine.connect() as conn:
+        rows = {row["group"]: row for row in analytics.duration_percentiles(conn, (1, 50, 51, 100))}
+    assert rows["solo"] == {"group": "solo", "requests": 1, "p1": 20, "p50": 20, "p51": 20, "p100": 20}
+    # Two values: p50 is the lower one, anything above p50 the upper one
+    assert rows["pair"] == {"group": "pair", "requests": 2, "p1": 10, "p50": 10, "p51": 30, "p100": 30}
+
+
+def test_cache_follows_table_versions(seeded):
+    engine, analytics, trainings, requests, links = seeded
+    with engine.connect() as conn:
+        first = analytics.top_trainings(conn, n=1)
+        assert analytics.top_trainings(conn, n=1) is first
+        before = analytics.group_durations(conn)
+    leader = first[0]["id"]
+
+    with engine.begin() as conn:
+        conn.execute(sa.insert(model.request_training), [
+            {"request_id": r, "training_id": 20} for r in requests if (r, 20) not in links
+        ])
+        conn.execute(sa.update(model.Training).where(model.Training.id == 20).values(duration=1000))
+
+    with engine.connect() as conn:
+        after = analytics.top_trainings(conn, n=1)
+        assert after is not first
+        assert after[0]["id"] == 20 != leader
+        assert after[0]["requests"] == len(requests)
+        assert analytics.group_durations(conn) != before
@@ -0,0 +1,70 @@
+import pytest
+import sqlalchemy as sa
+
+from archive import Archive, ArchiveConflict
+
+
+def make(tmp_path, autoincrement):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'archive.db'}")
+    metadata = sa.MetaData()
+    table = sa.Table(
+        "things",
+        metadata,
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("name", sa.String),
+        sa.Column("is_active", sa.Boolean),
+        sqlite_autoincrement=autoincrement,
+    )
+    archive = Archive(table, schema=None)
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(sa.insert(table), [
+            {"name": "a", "is_active": True},
+            {"name": "b", "is_active": False},
+            {"name": "c", "is_active": True},
+        ])
+    return engine, table, archive
+
+
+def archive_delete_newest_insert(engine, table, archive):
+    assert archive.archive(engine) == 1
+    with engine.begin() as conn:
+        conn.execute(sa.delete(table).where(table.c.id == 3))
+        return conn.execute(sa.insert(table).values(name="d", is_active=True)).inserted_primary_key[0]
+
+
+def test_autoincrement_keeps_archived_ids_unique(tmp_path):
+    engine, table, archive = make(tmp_path, autoincrement=True)
+    assert archive_delete_newest_insert(engine, table, archive) == 4
+
+    assert archive.restore(engine) == 1
+    with engine.connect() as conn:
+        rows = conn.execute(sa.select(table.c.id, table.c.name).order_by(table.c.id)).all()
+    assert rows == [(1, "a"), (2, "b"), (4, "d")]
+
+
+def test_restore_refuses_to_overwrite_a_reused_id(tmp_path):
+    engine, table, archive = make(tmp_path, autoincrement=False)
+    # Without AUTOINCREMENT the new row gets max(id) + 1 = 2, the archived id
+    assert archive_delete_newest_insert(engine, table, archive) == 2
+
+    with pytest.raises(ArchiveConflict):
+        archive.restore(engine)
+    with engine.connect() as conn:
+        assert conn.execute(sa.select(table.c.name)).scalars().all() == ["a", "d"]
+        assert conn.execute(sa.select(archive.cold.c.name)).scalars().all() == ["b"]
+
+
+def test_interrupted_batch_is_redone(tmp_path):
+    engine, table, archive = make(tmp_path, autoincrement=True)
+    # A crash between the insert and the delete leaves the same row on both sides
+    with engine.begin() as conn:
+        conn.execute(sa.insert(archive.cold).from_select(
+            ["id", "name", "is_active", "archived_at"],
+            sa.select(table.c.id, table.c.name, table.c.is_active, sa.func.current_timestamp()).where(table.c.id == 2),
+        ))
+
+    assert archive.archive(engine) == 1
+    with engine.connect() as conn:
+        assert conn.execute(sa.select(table.c.id)).scalars().all() == [1, 3]
+        assert conn.execute(sa.select(archive.cold.c.id)).scalars().all() == [2]
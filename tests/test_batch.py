@@ -0,0 +1,155 @@
+import pytest
+import sqlalchemy as sa
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column, sessionmaker
+
+from batch import Batcher
+from sqlite_tuning import enable_savepoints
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class Thing(Base):
+    __tablename__ = "things"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(unique=True)
+    parent_id: Mapped[int | None]
+
+
+class ThingCreate(BaseModel):
+    name: str
+    parent_id: int | None = None
+
+
+@pytest.fixture
+def setup(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'batch.db'}", connect_args={"check_same_thread": False})
+    enable_savepoints(engine)
+    Base.metadata.create_all(engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    app = FastAPI()
+
+    def get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def other_dependency():
+        return "not a session"
+
+    @app.post("/things/", status_code=201)
+    def create_thing(thing: ThingCreate, db: Session = Depends(get_db)):
+        db_thing = Thing(**thing.model_dump())
+        db.add(db_thing)
+        db.commit()
+        db.refresh(db_thing)
+        return db_thing
+
+    @app.get("/things/{thing_id}")
+    def read_thing(thing_id: int, db: Session = Depends(get_db)):
+        thing = db.get(Thing, thing_id)
+        if thing is None:
+            raise HTTPException(status_code=404, detail="Thing not found")
+        return thing
+
+    @app.get("/async/things")
+    async def list_things_async():
+        return []
+
+    @app.get("/other")
+    def uses_other(value: str = Depends(other_dependency)):
+        return value
+
+    Batcher(app, engine, SessionLocal, get_db)
+
+    def names():
+        with engine.connect() as conn:
+            return conn.execute(sa.select(Thing.name).order_by(Thing.id)).scalars().all()
+
+    return TestClient(app), names
+
+
+def create(thing, parent=None, **extra):
+    body = {"name": thing} if parent is None else {"name": thing, "parent_id": parent}
+    return {"method": "POST", "path": "/things/", "body": body, **extra}
+
+
+def test_references_to_earlier_results(setup):
+    client, names = setup
+    response = client.post("/batch", json={"operations": [
+        create("a", name="first"),
+        create("b", "$first.id"),
+        {"method": "GET", "path": "/things/$1.id"},
+    ]})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["committed"] is True
+    assert [result["status"] for result in body["results"]] == [201, 201, 200]
+    assert body["results"][2]["body"]["parent_id"] == body["results"][0]["body"]["id"]
+    assert names() == ["a", "b"]
+
+
+def test_atomic_failure_commits_nothing(setup):
+    client, names = setup
+    response = client.post("/batch", json={"operations": [
+        create("a"),
+        create("b"),
+        create("a"),  # unique violation
+        create("c"),
+    ]})
+    # The batch takes the failing operation's status
+    assert response.status_code == 409
+    body = response.json()
+    assert body["committed"] is False
+    assert [result["status"] for result in body["results"]] == [201, 201, 409, 424]
+    assert names() == []
+
+
+def test_best_effort_commits_the_rest(setup):
+    client, names = setup
+    response = client.post("/batch", json={"atomic": False, "operations": [
+        create("a"),
+        {"method": "GET", "path": "/things/999", "name": "missing"},
+        create("a"),
+        create("b"),
+    ]})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["committed"] is True
+    assert [result["status"] for result in body["results"]] == [201, 404, 409, 201]
+    # The failed insert was rolled back to its savepoint, the others kept
+    assert names() == ["a", "b"]
+
+
+def test_reference_to_a_failed_operation_is_424(setup):
+    client, names = setup
+    response = client.post("/batch", json={"atomic": False, "operations": [
+        {"method": "GET", "path": "/things/999", "name": "missing"},
+        create("child", "$missing.id"),
+        {"method": "GET", "path": "/things/$missing.id"},
+        create("other"),
+    ]})
+    body = response.json()
+    assert [result["status"] for result in body["results"]] == [404, 424, 424, 201]
+    assert "refers to failed operation 0" in body["results"][1]["body"]["detail"]
+    assert names() == ["other"]
+
+
+@pytest.mark.parametrize("operation, detail", [
+    ({"method": "GET", "path": "/async/things"}, "is async and can't be batched"),
+    ({"method": "GET", "path": "/other"}, "depends on other_dependency, which a batch can't provide"),
+])
+def test_async_and_foreign_dependency_routes_are_rejected(setup, operation, detail):
+    client, names = setup
+    response = client.post("/batch", json={"operations": [create("a"), operation]})
+    assert response.status_code == 400
+    body = response.json()
+    assert body["committed"] is False
+    assert detail in body["results"][1]["body"]["detail"]
+    assert names() == []
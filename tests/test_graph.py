@@ -0,0 +1,81 @@
+import random
+
+import pytest
+import sqlalchemy as sa
+
+import model
+from graph import ASSOCIATION, RequestGraph
+
+SIMILAR = sa.text(
+    f"SELECT b.request_id, count(*) AS shared FROM {ASSOCIATION} a JOIN {ASSOCIATION} b "
+    "ON b.training_id = a.training_id WHERE a.request_id = :id AND b.request_id != :id "
+    "GROUP BY b.request_id ORDER BY shared DESC, b.request_id LIMIT :n"
+)
+CO_ASSIGNED = sa.text(
+    f"SELECT b.training_id, count(*) AS requests FROM {ASSOCIATION} a JOIN {ASSOCIATION} b "
+    "ON b.request_id = a.request_id WHERE a.training_id = :id AND b.training_id != :id "
+    "GROUP BY b.training_id ORDER BY requests DESC, b.training_id LIMIT :n"
+)
+
+
+@pytest.fixture
+def seeded(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'graph.db'}")
+    model.Base.metadata.create_all(engine)
+    graph = RequestGraph(model.Base.metadata)
+    rng = random.Random(3)
+    links = {(rng.randint(1, 30), rng.randint(1, 12)) for _ in range(150)}
+    with engine.begin() as conn:
+        graph.install(conn)
+        conn.execute(sa.insert(model.request_training), [
+            {"request_id": r, "training_id": t} for r, t in sorted(links)
+        ])
+    return engine, graph, rng, links
+
+
+def assert_matches_self_join(conn, graph, n=5):
+    for request_id in range(0, 35):
+        expected = [tuple(row) for row in conn.execute(SIMILAR, {"id": request_id, "n": n})]
+        got = [(row["request_id"], row["shared_trainings"]) for row in graph.similar_requests(conn, request_id, n)]
+        assert got == expected, request_id
+    for training_id in range(0, 16):
+        expected = [tuple(row) for row in conn.execute(CO_ASSIGNED, {"id": training_id, "n": n})]
+        got = [(row["training_id"], row["requests"]) for row in graph.co_assigned(conn, training_id, n)]
+        assert got == expected, training_id
+
+
+def test_snapshot_and_change_log_match_the_self_join(seeded):
+    engine, graph, rng, links = seeded
+    with engine.connect() as conn:
+        assert_matches_self_join(conn, graph)
+        built = graph._by_request
+
+    # Links and unlinks after the snapshot, including new ids past the arrays and re-links
+    with engine.begin() as conn:
+        for r, t in rng.sample(sorted(links), 40):
+            conn.execute(sa.delete(model.request_training).where(
+                model.request_training.c.request_id == r, model.request_training.c.training_id == t
+            ))
+        for r, t in [(31, 1), (31, 2), (32, 2), (3, 14), (40, 14)] + rng.sample(sorted(links), 10):
+            conn.execute(sa.insert(model.request_training).prefix_with("OR IGNORE").values(request_id=r, training_id=t))
+
+    with engine.connect() as conn:
+        assert_matches_self_join(conn, graph)
+        # Served from the overlay, not a rebuild
+        assert graph._by_request is built and graph._changes > 0
+
+    # Past compact_after the arrays are rebuilt and still agree
+    graph.compact_after = graph._changes
+    with engine.begin() as conn:
+        conn.execute(sa.insert(model.request_training).values(request_id=33, training_id=1))
+    with engine.connect() as conn:
+        assert_matches_self_join(conn, graph)
+        assert graph._by_request is not built and graph._changes == 0
+
+
+def test_negative_and_unknown_ids_have_no_neighbours(seeded):
+    engine, graph, rng, links = seeded
+    with engine.connect() as conn:
+        for node in (-1, -2, -1000, 10_000):
+            assert graph.similar_requests(conn, node) == []
+            assert graph.co_assigned(conn, node) == []
@@ -0,0 +1,47 @@
+import threading
+
+import pytest
+
+from idempotency import DONE, MISMATCH, NEW, PENDING, IdempotencyStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return IdempotencyStore(f"sqlite:///{tmp_path / 'idempotency.db'}", lock_timeout=60)
+
+
+def test_concurrent_claims_have_one_owner(tmp_path):
+    # One store per thread, like launcher.py workers sharing the file
+    url = f"sqlite:///{tmp_path / 'idempotency.db'}"
+    stores = [IdempotencyStore(url) for _ in range(8)]
+    for store in stores:
+        store.claim("warmup", "f")
+    for round in range(20):
+        barrier = threading.Barrier(len(stores))
+        outcomes = []
+
+        def claim(store):
+            barrier.wait()
+            outcomes.append(store.claim(f"key-{round}", "f")[0])
+
+        threads = [threading.Thread(target=claim, args=(store,)) for store in stores]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(outcomes) == [NEW] + [PENDING] * (len(stores) - 1)
+
+
+def test_completed_key_replays(store):
+    assert store.claim("key", "f") == (NEW, None)
+    store.complete("key", 201, [(b"content-type", b"application/json")], b"{}", ttl=60)
+    assert store.claim("key", "f") == (DONE, (201, [(b"content-type", b"application/json")], b"{}"))
+    assert store.claim("key", "other") == (MISMATCH, None)
+
+
+def test_expired_claim_is_taken_over_once(store):
+    store.lock_timeout = 0
+    assert store.claim("key", "f")[0] == NEW
+    store.lock_timeout = 60
+    assert store.claim("key", "f")[0] == NEW
+    assert store.claim("key", "f")[0] == PENDING
@@ -0,0 +1,180 @@
+import asyncio
+import threading
+import time
+
+import pytest
+import sqlalchemy as sa
+
+from jobs import CANCELLED, FAILED, QUEUED, RUNNING, SUCCEEDED, JobRunner, JobStore
+from metrics import MetricsRegistry
+
+
+def make_runner(path, owner, **options):
+    runner = JobRunner(JobStore(f"sqlite:///{path}"), processes=1, poll=0.05, stale_after=60,
+                       registry=MetricsRegistry(), **options)
+    runner.owner = owner
+    return runner
+
+
+async def wait_for(runner, job_id, *statuses, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = await runner.get(job_id)
+        if job["status"] in statuses:
+            return job
+        assert time.monotonic() < deadline, job
+        await asyncio.sleep(0.02)
+
+
+def test_claims_are_atomic_across_stores(tmp_path):
+    stores = [JobStore(f"sqlite:///{tmp_path / 'jobs.db'}") for _ in range(4)]
+    job_ids = {stores[0].create("noop", {}) for _ in range(60)}
+    claimed = {index: [] for index in range(len(stores))}
+
+    def worker(index):
+        while (row := stores[index].claim(f"worker-{index}")) is not None:
+            claimed[index].append(row.id)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(len(stores))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    everything = [job_id for ids in claimed.values() for job_id in ids]
+    assert sorted(everything) == sorted(job_ids)
+    with stores[0].engine.connect() as conn:
+        owners = dict(conn.execute(sa.select(stores[0].table.c.id, stores[0].table.c.owner)).all())
+    assert all(owners[job_id] == f"worker-{index}" for index, ids in claimed.items() for job_id in ids)
+
+
+def test_two_runners_run_every_job_once(tmp_path):
+    runs = []
+
+    async def main():
+        runners = [make_runner(tmp_path / "jobs.db", f"runner-{i}", concurrency=3) for i in range(2)]
+        for runner in runners:
+            @runner.task("record")
+            async def record(job, params, owner=runner.owner):
+                runs.append((job.params["n"], owner))
+                await asyncio.sleep(0.01)
+                return params["n"]
+
+            await runner.start()
+        submitted = [await runners[n % 2].submit("record", {"n": n}) for n in range(30)]
+        try:
+            for job in submitted:
+                done = await wait_for(runners[0], job["id"], SUCCEEDED, FAILED)
+                assert done["status"] == SUCCEEDED and done["result"] == done["params"]["n"]
+        finally:
+            for runner in runners:
+                await runner.stop()
+
+    asyncio.run(main())
+    assert sorted(n for n, _ in runs) == list(range(30))
+    assert {owner for _, owner in runs} == {"runner-0", "runner-1"}
+
+
+def test_stop_requeues_and_the_next_runner_resumes_from_the_checkpoint(tmp_path):
+    seen = []
+
+    async def main():
+        first = make_runner(tmp_path / "jobs.db", "first")
+        blocked = asyncio.Event()
+
+        @first.task("steps")
+        async def steps(job, params):
+            await job.checkpoint({"done": 3})
+            blocked.set()
+            await asyncio.Event().wait()
+
+        await first.start()
+        job = await first.submit("steps")
+        await asyncio.wait_for(blocked.wait(), 5)
+        await first.stop()
+
+        requeued = await first.get(job["id"])
+        assert requeued["status"] == QUEUED and requeued["started_at"] is None
+
+        second = make_runner(tmp_path / "jobs.db", "second")
+
+        @second.task("steps")
+        async def resumed(job, params):
+            seen.append(job.resume_from)
+            return "done"
+
+        await second.start()
+        try:
+            finished = await wait_for(second, job["id"], SUCCEEDED, FAILED)
+        finally:
+            await second.stop()
+        assert finished["status"] == SUCCEEDED
+
+    asyncio.run(main())
+    assert seen == [{"done": 3}]
+
+
+def test_cancel_a_running_job(tmp_path):
+    async def main():
+        runner = make_runner(tmp_path / "jobs.db", "runner")
+        other = JobStore(f"sqlite:///{tmp_path / 'jobs.db'}")
+        started = asyncio.Event()
+
+        @runner.task("forever")
+        async def forever(job, params):
+            started.set()
+            await asyncio.Event().wait()
+
+        await runner.start()
+        try:
+            for cancel_through_runner in (True, False):
+                started.clear()
+                job = await runner.submit("forever")
+                await asyncio.wait_for(started.wait(), 5)
+                assert (await runner.get(job["id"]))["status"] == RUNNING
+                if cancel_through_runner:
+                    await runner.cancel(job["id"])
+                else:
+                    # Another worker's request: picked up by this runner's next heartbeat
+                    assert other.request_cancel(job["id"]) == RUNNING
+                cancelled = await wait_for(runner, job["id"], CANCELLED, SUCCEEDED, FAILED)
+                assert cancelled["status"] == CANCELLED and cancelled["finished_at"] is not None
+        finally:
+            await runner.stop()
+
+    asyncio.run(main())
+
+
+def test_cancel_requested_before_stop_is_not_requeued(tmp_path):
+    async def main():
+        runner = make_runner(tmp_path / "jobs.db", "runner")
+        started = asyncio.Event()
+
+        @runner.task("forever")
+        async def forever(job, params):
+            started.set()
+            await asyncio.Event().wait()
+
+        await runner.start()
+        job = await runner.submit("forever")
+        await asyncio.wait_for(started.wait(), 5)
+        # Flagged, but the runner stops before its heartbeat cancels the task
+        runner.store.request_cancel(job["id"])
+        await runner.stop()
+        assert (await runner.get(job["id"]))["status"] == CANCELLED
+
+    asyncio.run(main())
+
+
+def test_fail_stale_only_fails_jobs_without_heartbeats(tmp_path):
+    store = JobStore(f"sqlite:///{tmp_path / 'jobs.db'}")
+    dead, alive = store.create("a", {}), store.create("b", {})
+    assert {store.claim("w").id, store.claim("w").id} == {dead, alive}
+    with store.engine.begin() as conn:
+        conn.execute(sa.update(store.table).where(store.table.c.id == dead).values(heartbeat_at=time.time() - 120))
+
+    assert store.fail_stale(60) == 1
+    assert store.get(dead)["status"] == FAILED and store.get(dead)["error"] == "worker stopped"
+    assert store.get(alive)["status"] == RUNNING
+    with pytest.raises(ValueError):
+        JobRunner(store, poll=1.0, stale_after=4.0, registry=MetricsRegistry())
@@ -0,0 +1,33 @@
+import asyncio
+
+import sqlalchemy as sa
+
+from metrics import MetricsMiddleware, MetricsRegistry, instrument_engine
+
+
+def test_unknown_methods_share_one_label():
+    registry = MetricsRegistry()
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+
+    async def send(message):
+        pass
+
+    middleware = MetricsMiddleware(app, registry=registry)
+    for method in ("GET", "FOO", "BAR"):
+        asyncio.run(middleware({"type": "http", "method": method, "path": "/"}, None, send))
+    exposed = registry.expose()
+    assert 'method="GET"' in exposed
+    assert 'method="other",status="200"} 2' in exposed
+    assert "FOO" not in exposed
+
+
+def test_pool_checkout_duration_from_pool_events():
+    registry = MetricsRegistry()
+    engine = sa.create_engine("sqlite://")
+    instrument_engine(engine, "test", registry=registry)
+    for _ in range(3):
+        with engine.connect() as conn:
+            conn.execute(sa.text("SELECT 1"))
+    assert 'db_pool_checkout_duration_seconds_count{engine="test"} 3' in registry.expose()
@@ -0,0 +1,74 @@
+import sqlalchemy as sa
+from alembic import command
+from alembic.config import Config
+
+ENV = '''
+from alembic import context
+from sqlalchemy import create_engine
+
+engine = create_engine(context.config.get_main_option("sqlalchemy.url"))
+with engine.connect() as connection:
+    context.configure(connection=connection)
+    with context.begin_transaction():
+        context.run_migrations()
+'''
+
+MIGRATION = '''
+import os
+
+import sqlalchemy as sa
+from alembic import op
+
+from migration_helpers import add_column_with_backfill
+
+revision = "0001"
+down_revision = None
+
+
+def stop_after(rows_done, last_key):
+    if rows_done >= int(os.environ.get("BACKFILL_STOP_AFTER", "0")) > 0:
+        raise KeyboardInterrupt
+
+
+def upgrade():
+    add_column_with_backfill(
+        op, "items", sa.Column("grp", sa.String(), nullable=True), sa.literal("general"),
+        chunk_size=10, progress=stop_after,
+    )
+'''
+
+
+def _alembic(tmp_path):
+    scripts = tmp_path / "alembic"
+    (scripts / "versions").mkdir(parents=True)
+    (scripts / "env.py").write_text(ENV)
+    (scripts / "script.py.mako").write_text("")
+    (scripts / "versions" / "0001_grp.py").write_text(MIGRATION)
+    url = f"sqlite:///{tmp_path / 'app.db'}"
+    config = Config()
+    config.set_main_option("script_location", str(scripts))
+    config.set_main_option("sqlalchemy.url", url)
+    return config, sa.create_engine(url)
+
+
+def test_interrupted_backfill_resumes_on_rerun(tmp_path, monkeypatch):
+    config, engine = _alembic(tmp_path)
+    with engine.begin() as conn:
+        conn.execute(sa.text("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)"))
+        conn.execute(sa.text("INSERT INTO items (name) VALUES (:name)"), [{"name": str(i)} for i in range(45)])
+
+    monkeypatch.setenv("BACKFILL_STOP_AFTER", "20")
+    try:
+        command.upgrade(config, "head")
+    except KeyboardInterrupt:
+        pass
+    with engine.connect() as conn:
+        assert conn.execute(sa.text("SELECT count(*) FROM items WHERE grp IS NOT NULL")).scalar() == 20
+        assert conn.execute(sa.text("SELECT last_key FROM migration_checkpoints")).scalar() == 20
+
+    monkeypatch.delenv("BACKFILL_STOP_AFTER")
+    command.upgrade(config, "head")
+    with engine.connect() as conn:
+        assert conn.execute(sa.text("SELECT count(*) FROM items WHERE grp = 'general'")).scalar() == 45
+        assert conn.execute(sa.text("SELECT count(*) FROM migration_checkpoints")).scalar() == 0
+        assert conn.execute(sa.text("SELECT version_num FROM alembic_version")).scalar() == "0001"
@@ -0,0 +1,45 @@
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+
+from query_language import MAX_DEPTH, QueryError, QueryLanguage, parse
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class Thing(Base):
+    __tablename__ = "things"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str]
+
+
+queries = QueryLanguage(Thing, allow={"id": ("eq", "range"), "name": ("eq", "prefix")})
+
+
+def nested(depth: int) -> str:
+    return "not(" * (depth - 1) + "eq(id,1)" + ")" * (depth - 1)
+
+
+def test_nesting_up_to_max_depth_compiles():
+    engine = sa.create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(sa.insert(Thing), [{"id": 1, "name": "a"}, {"id": 2, "name": "b"}])
+        statement, params = queries.compile(nested(MAX_DEPTH))
+        # An odd number of not()s
+        assert conn.execute(statement, params).scalars().all() == [2]
+
+
+@pytest.mark.parametrize("text", [
+    nested(MAX_DEPTH + 1),
+    nested(1200),
+    "and(" * 1200 + "eq(id,1)" + ")" * 1200,
+    "or(eq(id,1)," * 1200 + "eq(id,2)" + ")" * 1200,
+])
+def test_deeper_nesting_is_a_query_error(text):
+    with pytest.raises(QueryError, match="nested deeper"):
+        parse(text)
+    with pytest.raises(QueryError):
+        queries.compile(text)
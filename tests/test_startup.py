@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+import sqlalchemy as sa
+
+import startup
+
+
+def _alembic(tmp_path, name, revisions):
+    """An ini whose script location holds these (revision, down_revision) pairs."""
+    versions = tmp_path / name / "versions"
+    versions.mkdir(parents=True)
+    for revision, down_revision in revisions:
+        (versions / f"{revision}_test.py").write_text(f"revision = {revision!r}\ndown_revision = {down_revision!r}\n")
+    ini = tmp_path / f"{name}.ini"
+    ini.write_text(f"[alembic]\nscript_location = {name}\n")
+    return str(ini)
+
+
+def _database(tmp_path, revision):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE alembic_version (version_num VARCHAR(32))")
+        conn.exec_driver_sql("INSERT INTO alembic_version VALUES (?)", (revision,))
+    return engine
+
+
+def test_fast_mode_checks_the_apps_own_config(tmp_path, monkeypatch):
+    monkeypatch.setattr(startup, "STARTUP_MODE", "fast")
+    monkeypatch.setattr(startup, "prewarm", lambda *args: asyncio.sleep(0))
+    relation_ini = _alembic(tmp_path, "relation", [("r1", None), ("r2", "r1")])
+    items_ini = _alembic(tmp_path, "items", [("i1", None)])
+    engine = _database(tmp_path, "i1")
+
+    asyncio.run(startup.prepare_database(engine, sa.MetaData(), alembic_ini=items_ini))
+    with pytest.raises(RuntimeError, match="'r2'"):
+        asyncio.run(startup.prepare_database(engine, sa.MetaData(), alembic_ini=relation_ini))
+    # Not managed by Alembic: nothing to check
+    asyncio.run(startup.prepare_database(engine, sa.MetaData(), alembic_ini=None))
+
+
+def test_alembic_head_follows_down_revisions(tmp_path):
+    assert startup.alembic_head(_alembic(tmp_path, "a", [("r1", None), ("r2", "r1"), ("r3", "r2")])) == "r3"
+    with pytest.raises(RuntimeError):
+        startup.alembic_head(_alembic(tmp_path, "b", [("r1", None), ("x", "r1"), ("y", "r1")]))
+
+
+def test_no_revisions_means_no_head(tmp_path):
+    assert startup.alembic_head(_alembic(tmp_path, "empty", [])) is None
+    # A database without alembic_version is at that (empty) head
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    with engine.connect() as conn:
+        startup.check_schema(conn, str(tmp_path / "empty.ini"))
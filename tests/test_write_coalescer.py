@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+
+from sqlite_tuning import enable_savepoints
+from write_coalescer import WriteCoalescer
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class Thing(Base):
+    __tablename__ = "things"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(unique=True)
+
+
+def run(tmp_path, scenario, max_delay=0.05):
+    """scenario(writer, engine) on a fresh database; returns its result and the number of commits."""
+    async def main():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'coalescer.db'}")
+        enable_savepoints(engine)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        commits = []
+        sa.event.listen(engine.sync_engine, "commit", lambda conn: commits.append(1))
+        writer = WriteCoalescer(async_sessionmaker(engine, expire_on_commit=False), max_delay=max_delay)
+        await writer.start()
+        try:
+            result = await scenario(writer, engine)
+        finally:
+            await writer.stop()
+            await engine.dispose()
+        return result, len(commits)
+
+    return asyncio.run(main())
+
+
+def create(name):
+    async def op(session):
+        thing = Thing(name=name)
+        session.add(thing)
+        return thing
+    return op
+
+
+async def names(engine):
+    async with engine.connect() as conn:
+        return sorted((await conn.execute(sa.select(Thing.name))).scalars())
+
+
+def test_concurrent_creates_share_commits(tmp_path):
+    async def scenario(writer, engine):
+        things = await asyncio.gather(*(writer.submit(create(f"t{i}")) for i in range(50)))
+        return things, await names(engine)
+
+    (things, stored), commits = run(tmp_path, scenario)
+    assert len({thing.id for thing in things}) == 50
+    assert all(thing.id is not None for thing in things)
+    assert stored == sorted(f"t{i}" for i in range(50))
+    # One commit per batch, not per write (create_all commits once too)
+    assert commits <= 5
+
+
+def test_failing_op_only_fails_its_caller(tmp_path):
+    async def boom(session):
+        session.add(Thing(name="never"))
+        raise ValueError("boom")
+
+    async def scenario(writer, engine):
+        await writer.submit(create("taken"))
+        results = await asyncio.gather(
+            writer.submit(create("a")),
+            writer.submit(boom),
+            writer.submit(create("taken")),  # unique violation, raised at flush
+            writer.submit(create("b")),
+            return_exceptions=True,
+        )
+        return results, await names(engine)
+
+    (results, stored), _ = run(tmp_path, scenario)
+    assert isinstance(results[1], ValueError)
+    assert isinstance(results[2], IntegrityError)
+    assert results[0].name == "a" and results[3].name == "b"
+    assert stored == ["a", "b", "taken"]
+
+
+def test_delete_and_update_in_one_batch(tmp_path):
+    def rename(thing_id, name):
+        async def op(session):
+            thing = await session.get(Thing, thing_id)
+            if thing is None:
+                raise LookupError(thing_id)
+            thing.name = name
+            return thing
+        return op
+
+    def delete(thing_id):
+        async def op(session):
+            await session.execute(sa.delete(Thing).where(Thing.id == thing_id))
+        return op
+
+    async def scenario(writer, engine):
+        first = await writer.submit(create("first"))
+        second = await writer.submit(create("second"))
+        results = await asyncio.gather(
+            writer.submit(delete(first.id)),
+            writer.submit(rename(first.id, "gone")),
+            writer.submit(rename(second.id, "renamed")),
+            return_exceptions=True,
+        )
+        return results, await names(engine)
+
+    (results, stored), _ = run(tmp_path, scenario)
+    assert results[0] is None
+    assert isinstance(results[1], LookupError)
+    assert results[2].name == "renamed"
+    assert stored == ["renamed"]
+
+
+def test_submit_requires_start():
+    writer = WriteCoalescer(None)
+    with pytest.raises(RuntimeError):
+        asyncio.run(writer.submit(create("x")))
@@ -0,0 +1,295 @@
+# Tracing pipeline: head/tail sampling, batched exporters and per-statement SQL spans.
+#
+# Configuration comes from the environment so the same app can run with tracing
+# switched off, head sampled or tail sampled without code changes:
+#
+#   TRACE_SAMPLING      off | head | tail | always     (default: tail)
+#   TRACE_SAMPLE_RATIO  fraction of ordinary traces kept (default: 0.01)
+#   TRACE_SLOW_MS       tail sampling keeps traces slower than this (default: 500)
+#   TRACE_EXPORTER      file | otlp | console          (default: file)
+#   TRACE_FILE          output of the file exporter    (default: traces.ndjson)
+#   OTEL_EXPORTER_OTLP_ENDPOINT  used by the otlp exporter, e.g. http://127.0.0.1:4318
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import ReadableSpan, SpanProcessor, TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter, SpanExporter, SpanExportResult
+from opentelemetry.sdk.trace.sampling import ALWAYS_ON, ParentBased, TraceIdRatioBased
+from opentelemetry.trace import SpanKind, StatusCode
+from sqlalchemy import event
+
+_TRACE_ID_LIMIT = (1 << 64) - 1
+
+
+class BatchedFileExporter(SpanExporter):
+    """Write each batch as compact NDJSON in a single append, instead of pretty-printing every span."""
+
+    def __init__(self, path: str = "traces.ndjson"):
+        self._file = open(path, "ab")
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _encode(span: ReadableSpan) -> bytes:
+        ctx = span.context
+        record = {
+            "t": format(ctx.trace_id, "032x"),
+            "s": format(ctx.span_id, "016x"),
+            "p": format(span.parent.span_id, "016x") if span.parent else None,
+            "n": span.name,
+            "b": span.start_time,
+            "e": span.end_time,
+            "st": span.status.status_code.value,
+            "a": dict(span.attributes or {}),
+        }
+        return json.dumps(record, separators=(",", ":"), default=str).encode()
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        payload = b"\n".join(self._encode(span) for span in spans) + b"\n"
+        with self._lock:
+            self._file.write(payload)
+            self._file.flush()
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class TailSamplingProcessor(SpanProcessor):
+    """Buffer spans until their local root ends, then keep or drop the whole trace.
+
+    Traces containing an error or slower than `slow_ms` are always kept, the
+    rest are kept with probability `ratio` (decided on the trace id, so every
+    service makes the same choice).
+    """
+
+    def __init__(self, next_processor: SpanProcessor, ratio: float = 0.01, slow_ms: float = 500, max_pending: int = 10_000):
+        self._next = next_processor
+        self._bound = round(ratio * (_TRACE_ID_LIMIT + 1))
+        self._slow_ns = int(slow_ms * 1e6)
+        self._max_pending = max_pending
+        self._pending: "OrderedDict[int, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def on_start(self, span, parent_context=None) -> None:
+        pass
+
+    def on_end(self, span: ReadableSpan) -> None:
+        trace_id = span.context.trace_id
+        is_local_root = span.parent is None or span.parent.is_remote
+        with self._lock:
+            spans = self._pending.get(trace_id)
+            if spans is None:
+                spans = self._pending[trace_id] = []
+                if len(self._pending) > self._max_pending:
+                    # Roots that never end must not grow the buffer forever
+                    self._pending.popitem(last=False)
+            spans.append(span)
+            if not is_local_root:
+                return
+            del self._pending[trace_id]
+
+        if self._keep(span, spans):
+            for finished in spans:
+                self._next.on_end(finished)
+
+    def _keep(self, root: ReadableSpan, spans: list) -> bool:
+        if root.end_time - root.start_time >= self._slow_ns:
+            return True
+        if any(s.status.status_code is StatusCode.ERROR for s in spans):
+            return True
+        return (root.context.trace_id & _TRACE_ID_LIMIT) < self._bound
+
+    def shutdown(self) -> None:
+        self._next.shutdown()
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return self._next.force_flush(timeout_millis)
+
+
+def build_exporter(kind: str = "file", path: str = "traces.ndjson") -> SpanExporter:
+    if kind == "file":
+        return BatchedFileExporter(path)
+    if kind == "console":
+        return ConsoleSpanExporter()
+    if kind == "otlp":
+        # Optional dependency: opentelemetry-exporter-otlp-proto-http
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+        return OTLPSpanExporter()
+    raise ValueError(f"Unknown trace exporter {kind!r}")
+
+
+def build_tracer_provider(
+    service_name: str,
+    sampling: str = "tail",
+    ratio: float = 0.01,
+    slow_ms: float = 500,
+    exporter: Optional[SpanExporter] = None,
+) -> trace.TracerProvider:
+    if sampling == "off":
+        return trace.NoOpTracerProvider()
+
+    resource = Resource.create({"service.name": service_name})
+
+    exporter = exporter or build_exporter()
+    batch = BatchSpanProcessor(exporter, max_queue_size=8192, max_export_batch_size=512)
+    if sampling == "head":
+        # Unsampled traces become non-recording spans and cost almost nothing
+        provider = TracerProvider(resource=resource, sampler=ParentBased(TraceIdRatioBased(ratio)))
+        provider.add_span_processor(batch)
+    elif sampling == "tail":
+        provider = TracerProvider(resource=resource, sampler=ALWAYS_ON)
+        provider.add_span_processor(TailSamplingProcessor(batch, ratio=ratio, slow_ms=slow_ms))
+    elif sampling == "always":
+        provider = TracerProvider(resource=resource, sampler=ALWAYS_ON)
+        provider.add_span_processor(batch)
+    else:
+        raise ValueError(f"Unknown trace sampling mode {sampling!r}")
+    return provider
+
+
+def instrument_engine(engine, tracer_provider: trace.TracerProvider) -> None:
+    """Emit one CLIENT span per SQL statement executed on a sync or async engine."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    tracer = tracer_provider.get_tracer(__name__)
+    db_system = sync_engine.dialect.name
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _start_span(conn, cursor, statement, parameters, context, executemany):
+        span = tracer.start_span(statement.split(None, 1)[0], kind=SpanKind.CLIENT)
+        if span.is_recording():
+            span.set_attribute("db.system", db_system)
+            span.set_attribute("db.statement", statement)
+        context._trace_span = span
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _end_span(conn, cursor, statement, parameters, context, executemany):
+        span = getattr(context, "_trace_span", None)
+        if span is not None:
+            span.end()
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _fail_span(exception_context):
+        span = getattr(exception_context.execution_context, "_trace_span", None)
+        if span is not None:
+            span.set_status(StatusCode.ERROR, str(exception_context.original_exception))
+            span.end()
+
+
+def provider_from_env(service_name: str) -> trace.TracerProvider:
+    sampling = os.getenv("TRACE_SAMPLING", "tail")
+    if sampling == "off":
+        return trace.NoOpTracerProvider()
+
+    provider = build_tracer_provider(
+        service_name,
+        sampling=sampling,
+        ratio=float(os.getenv("TRACE_SAMPLE_RATIO", "0.01")),
+        slow_ms=float(os.getenv("TRACE_SLOW_MS", "500")),
+        exporter=build_exporter(os.getenv("TRACE_EXPORTER", "file"), os.getenv("TRACE_FILE", "traces.ndjson")),
+    )
+    trace.set_tracer_provider(provider)
+    return provider
+
+
+def setup_tracing(app, *engines, service_name: str = "my-fastapi-service") -> trace.TracerProvider:
+    """Configure tracing from the environment for a FastAPI app and its engines."""
+    from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+
+    provider = provider_from_env(service_name)
+    if isinstance(provider, trace.NoOpTracerProvider):
+        # Not even a middleware: nothing is traced at all
+        return provider
+
+    FastAPIInstrumentor.instrument_app(app, tracer_provider=provider)
+    for engine in engines:
+        instrument_engine(engine, provider)
+    return provider
+
+
+def tracing_middleware(app, engines: Sequence = (), service_name: str = "my-fastapi-service"):
+    """Same pipeline as setup_tracing, as a factory for startup.DeferredMiddleware."""
+    from opentelemetry.instrumentation.asgi import OpenTelemetryMiddleware
+
+    provider = provider_from_env(service_name)
+    if isinstance(provider, trace.NoOpTracerProvider):
+        return app
+
+    for engine in engines:
+        instrument_engine(engine, provider)
+    return OpenTelemetryMiddleware(app, tracer_provider=provider)
+
+
+def run_collector_stand_in(host: str = "127.0.0.1", port: int = 4318, path: str = "otlp_received.bin") -> None:
+    """Minimal OTLP/HTTP sink for local runs: stores each payload length-prefixed."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path == "/v1/traces":
+                with lock, open(path, "ab") as out:
+                    out.write(len(body).to_bytes(4, "big") + body)
+                self.send_response(200)
+            else:
+                self.send_response(404)
+            # An empty body is a valid (empty) ExportTraceServiceResponse
+            self.send_header("Content-Type", "application/x-protobuf")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    print(f"OTLP collector stand-in listening on http://{host}:{port}/v1/traces")
+    ThreadingHTTPServer((host, port), Handler).serve_forever()
+
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+
+    if sys.argv[1:2] == ["collector"]:
+        run_collector_stand_in()
+        raise SystemExit
+
+    # Benchmark: cost of one simulated request (server span + 3 SQL spans, 1% errors)
+    def simulate(tracer, n):
+        start = time.perf_counter()
+        for i in range(n):
+            with tracer.start_as_current_span("GET /requests/", kind=SpanKind.SERVER) as root:
+                for _ in range(3):
+                    with tracer.start_as_current_span("SELECT", kind=SpanKind.CLIENT) as span:
+                        span.set_attribute("db.statement", "SELECT requests.id FROM requests")
+                if i % 100 == 0:
+                    root.set_status(StatusCode.ERROR)
+        return time.perf_counter() - start
+
+    n = 20_000
+    configs = [
+        ("off", {"sampling": "off"}),
+        ("head 1%", {"sampling": "head", "ratio": 0.01}),
+        ("head 100%", {"sampling": "head", "ratio": 1.0}),
+        ("tail 1% + errors/slow", {"sampling": "tail", "ratio": 0.01}),
+        ("tail 100%", {"sampling": "tail", "ratio": 1.0}),
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, options in configs:
+            exporter = BatchedFileExporter(os.path.join(tmp, "bench.ndjson"))
+            provider = build_tracer_provider("bench", exporter=exporter, **options)
+            tracer = provider.get_tracer("bench")
+            simulate(tracer, 1000)
+            elapsed = simulate(tracer, n)
+            if hasattr(provider, "shutdown"):
+                provider.shutdown()
+            print(f"{label:<24} {elapsed / n * 1e6:8.2f} us/request")
@@ -0,0 +1,66 @@
+# Optimistic concurrency: a version column per row and If-Match on updates.
+#
+#   class Item(Base):
+#       version = Column(Integer, nullable=False, server_default="1")
+#       __mapper_args__ = {"version_id_col": version}
+#
+# The ORM then adds "AND version = ?" to every flushed UPDATE/DELETE and bumps
+# the version, raising StaleDataError when another writer got there first.
+# Handlers skip the load-modify-flush round trips altogether with a prebuilt
+# conditional statement (statements.py):
+#
+#   UPDATE items SET name=?, version=version + 1 WHERE id = ? AND version IN (?) RETURNING ...
+#
+# No row back means the item is gone (404) or was changed since the client read
+# it (412). No row locks are taken; a losing writer simply re-reads and retries.
+# The version goes out as the ETag ("3") and comes back in If-Match. The
+# server_default lets an existing table get the column with one ALTER TABLE,
+# which the Alembic revisions do (alembic_items 0003 for items, alembic 0002
+# for requests and trainings):
+#
+#   ALTER TABLE items ADD COLUMN version INTEGER NOT NULL DEFAULT 1
+
+from typing import List, Optional
+
+from fastapi import HTTPException
+
+# If-Match: * only asks for the row to exist
+ANY = None
+
+
+def etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def parse_if_match(header: str) -> Optional[List[int]]:
+    """Versions named by an If-Match header; ANY for "*", [] when none can match."""
+    if header.strip() == "*":
+        return ANY
+    versions = []
+    for tag in header.split(","):
+        # CompressionMiddleware weakens the ETag of compressed responses; it still names the row version
+        tag = tag.strip().removeprefix("W/").strip('"')
+        if tag.isdigit():
+            versions.append(int(tag))
+    return versions
+
+
+def update_versioned(db, statements, params: dict, if_match: Optional[str], what: str = "Item"):
+    """Run statements.update_returning / update_if_version on a sync Session.
+
+    Returns the updated row, detached so the commit doesn't expire it (no
+    reload after the commit); raises 404 or 412.
+    """
+    versions = parse_if_match(if_match) if if_match is not None else ANY
+    if versions is ANY:
+        row = db.scalars(statements.update_returning, params).first()
+    else:
+        row = db.scalars(statements.update_if_version, {**params, "versions": versions}).first()
+    if row is None:
+        db.rollback()
+        if versions is ANY or db.scalars(statements.by_id, params).first() is None:
+            raise HTTPException(status_code=404, detail=f"{what} not found")
+        raise HTTPException(status_code=412, detail=f"{what} was modified since it was read")
+    db.expunge(row)
+    db.commit()
+    return row
@@ -0,0 +1,187 @@
+# Group commit for async writes.
+#
+# Every concurrent write used to open its own transaction and pay its own
+# commit (fsync) while waiting on SQLite's single writer lock. The coalescer
+# queues write operations and a single writer task runs them in micro-batches
+# with one transaction, one flush and one commit per batch. If any operation
+# fails, the batch is replayed with one SAVEPOINT per operation so only that
+# caller sees the error. Operations may therefore run twice and must only touch
+# the session they are given.
+#
+#   async def op(session):
+#       item = Item(**data)
+#       session.add(item)
+#       return item             # flushed (id assigned) before the future resolves
+#
+#   item = await writer.submit(op)
+
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+WriteOp = Callable[[AsyncSession], Awaitable[Any]]
+
+
+class _OpFailed(Exception):
+    pass
+
+
+class WriteCoalescer:
+    def __init__(self, session_maker: async_sessionmaker, max_batch: int = 128, max_delay: float = 0.002):
+        # Sessions need expire_on_commit=False so results stay usable after the batch commits
+        self.session_maker = session_maker
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        # Everything queued before the sentinel is still committed
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, op: WriteOp) -> Any:
+        if self._task is None:
+            raise RuntimeError("WriteCoalescer is not running, call start() first")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((op, future))
+        return await future
+
+    def _drain(self, batch: List[Tuple[WriteOp, asyncio.Future]]) -> bool:
+        while len(batch) < self.max_batch:
+            try:
+                entry = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return False
+            if entry is None:
+                return True
+            batch.append(entry)
+        return False
+
+    async def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            entry = await self._queue.get()
+            if entry is None:
+                break
+            batch = [entry]
+            stopping = self._drain(batch)
+            if not stopping and len(batch) < self.max_batch and self.max_delay > 0:
+                # Give concurrent writers a moment to join this batch
+                await asyncio.sleep(self.max_delay)
+                stopping = self._drain(batch)
+            await self._commit(batch)
+
+    async def _commit(self, batch: List[Tuple[WriteOp, asyncio.Future]]) -> None:
+        batch = [(op, future) for op, future in batch if not future.cancelled()]
+        if not batch:
+            return
+        try:
+            outcomes = await self._run_batch(batch)
+        except _OpFailed:
+            # Some operation failed: replay the batch with one SAVEPOINT per
+            # operation so every caller gets its own result or error
+            try:
+                outcomes = await self._run_batch(batch, isolated=True)
+            except Exception as exc:
+                self._fail(batch, exc)
+                return
+        except Exception as exc:
+            # The batch commit itself failed: nobody's write is durable
+            self._fail(batch, exc)
+            return
+
+        for (_, future), (ok, value) in zip(batch, outcomes):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    async def _run_batch(self, batch, isolated: bool = False) -> list:
+        outcomes = []
+        async with self.session_maker() as session:
+            async with session.begin():
+                for op, _ in batch:
+                    if not isolated:
+                        # Fast path: no savepoints, a single flush for the whole batch
+                        try:
+                            outcomes.append((True, await op(session)))
+                        except Exception as exc:
+                            raise _OpFailed() from exc
+                        continue
+                    try:
+                        async with session.begin_nested():
+                            result = await op(session)
+                            await session.flush()
+                        outcomes.append((True, result))
+                    except Exception as exc:
+                        outcomes.append((False, exc))
+                if not isolated:
+                    try:
+                        await session.flush()
+                    except Exception as exc:
+                        raise _OpFailed() from exc
+        return outcomes
+
+    @staticmethod
+    def _fail(batch, exc: Exception) -> None:
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(exc)
+
+
+if __name__ == "__main__":
+    # Benchmark: concurrent inserts, one transaction each vs coalesced batches
+    import os
+    import tempfile
+    import time
+
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    from async_db_api import Base, Item
+    from sqlite_tuning import enable_savepoints
+
+    async def bench(n: int = 2000, concurrency: int = 100) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}")
+            enable_savepoints(engine)
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            session_maker = async_sessionmaker(engine, expire_on_commit=False)
+            limit = asyncio.Semaphore(concurrency)
+
+            async def insert_own_transaction(i):
+                async with limit, session_maker() as session:
+                    session.add(Item(name=f"item {i}", description="d", is_active=True))
+                    await session.commit()
+
+            writer = WriteCoalescer(session_maker)
+            await writer.start()
+
+            async def insert_coalesced(i):
+                async def op(session):
+                    session.add(Item(name=f"item {i}", description="d", is_active=True))
+
+                async with limit:
+                    await writer.submit(op)
+
+            for label, fn in (("one transaction each", insert_own_transaction), ("coalesced", insert_coalesced)):
+                start = time.perf_counter()
+                await asyncio.gather(*(fn(i) for i in range(n)))
+                elapsed = time.perf_counter() - start
+                print(f"{label:<22} {n / elapsed:9.0f} inserts/s")
+
+            await writer.stop()
+            await engine.dispose()
+
+    asyncio.run(bench())